@@ -0,0 +1,67 @@
+"""
+Сессия aiogram без сети: вместо запросов к Bot API записывает вызовы и
+возвращает правдоподобные ответы, прогоняя их через обычную десериализацию.
+"""
+
+import time
+import asyncio
+from collections import Counter
+from typing import Any, AsyncGenerator, Dict, Optional
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import InputFile
+
+
+class FakeTelegramSession(BaseSession):
+    """
+    Args:
+        latency (float): Искусственная задержка ответа Bot API (сек)
+    """
+
+    def __init__(self, latency: float = 0.0, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self.uploaded_bytes = 0
+        self._message_id = 0
+
+    async def close(self) -> None:
+        pass
+
+    async def stream_content(self, url: str, headers: Optional[Dict[str, Any]] = None, timeout: int = 30,
+                             chunk_size: int = 65536, raise_for_status: bool = True) -> AsyncGenerator[bytes, None]:
+        yield b""
+
+    def _message(self, method: TelegramMethod) -> Dict[str, Any]:
+        self._message_id += 1
+        message = {
+            "message_id": getattr(method, "message_id", None) or self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": getattr(method, "chat_id", None) or 0, "type": "private"},
+        }
+        if getattr(method, "text", None):
+            message["text"] = method.text
+        return message
+
+    async def make_request(self, bot: Bot, method: TelegramMethod[TelegramType],
+                           timeout: Optional[int] = None) -> TelegramType:
+        name = method.__api_method__
+        self.calls[name] += 1
+        # Документы вычитываются целиком, как при настоящей загрузке
+        for field in method.model_fields:
+            value = getattr(method, field, None)
+            if isinstance(value, InputFile):
+                async for chunk in value.read(bot):
+                    self.uploaded_bytes += len(chunk)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if name in ("sendMessage", "editMessageText", "sendDocument"):
+            result: Any = self._message(method)
+        else:
+            result = True
+        content = self.json_dumps({"ok": True, "result": result})
+        return self.check_response(bot, method, 200, content).result
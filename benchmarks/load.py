@@ -0,0 +1,209 @@
+"""
+Нагрузочный тест бота целиком: синтетические апдейты подаются в Dispatcher
+из script/main.py, ответы уходят в FakeTelegramSession, а команды к ВМ
+выполняются на локальном SSH/SFTP-сервере (BenchSSHServer).
+
+Запуск из корня проекта:
+    python -m benchmarks.load --updates 2000 --users 50 --ssh-latency 0.005
+"""
+
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import resource
+import tempfile
+from collections import defaultdict
+from typing import Dict, List
+
+from .fake_telegram import FakeTelegramSession
+from .ssh_server import BENCH_PASSWORD, BenchSSHServer
+
+BENCH_TOKEN = "42:BENCHMARK"
+
+# Команда -> текст сообщения; путь отсчитывается от корня BenchSSHServer
+COMMANDS = {
+    "start": "/start",
+    "status": "/status",
+    "ls": "/ls data",
+    "cat": "/cat big.log 0 3000",
+    "cat_doc": "/cat big.log",
+}
+DEFAULT_MIX = "start=1,status=2,ls=3,cat=3,cat_doc=1"
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота")
+    parser.add_argument("--updates", type=int, default=2000, help="Сколько апдейтов отправить")
+    parser.add_argument("--users", type=int, default=50, help="Сколько разных пользователей")
+    parser.add_argument("--hosts", type=int, default=10, help="Сколько разных хостов ВМ (127.0.0.N)")
+    parser.add_argument("--concurrency", type=int, default=64, help="Апдейтов в обработке одновременно")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Доли команд, по умолчанию {DEFAULT_MIX}")
+    parser.add_argument("--ssh-latency", type=float, default=0.002, help="Задержка каждой операции SSH (сек)")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="Задержка ответа Bot API (сек)")
+    parser.add_argument("--files", type=int, default=50, help="Файлов в листинге /ls")
+    parser.add_argument("--file-size", type=int, default=64 * 1024, help="Размер файлов на ВМ (байт)")
+    parser.add_argument("--rate-limit", action="store_true", help="Включить RateLimitMiddleware")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="Вывести результат в JSON")
+    return parser.parse_args(argv)
+
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in COMMANDS:
+            raise SystemExit(f"Unknown command in --mix: {name}")
+        weights[name] = int(weight or 1)
+    return weights
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def make_update(update_id: int, user_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": int(time.time()), "text": text,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "username": f"user{user_id}"},
+        },
+    }
+
+
+async def prepare_users(db, users: int, hosts: List[str], ssh_port: int):
+    async with db.async_session() as session:
+        session.add(db.User(userid=1, username="teacher", role="teacher", tutorcode="BENCH001"))
+        for user_id in range(2, users + 2):
+            session.add(db.User(
+                userid=user_id, username=f"user{user_id}", role="student", subscribe="teacher", teacher_id=1,
+                vm_host=hosts[user_id % len(hosts)], vm_port=ssh_port, vm_username=f"user{user_id}",
+                vm_password=BENCH_PASSWORD,
+            ))
+        await session.commit()
+
+
+async def run(args: argparse.Namespace) -> dict:
+    weights = parse_mix(args.mix)
+    workdir = tempfile.TemporaryDirectory(prefix="bench-db-")
+    server = BenchSSHServer(latency=args.ssh_latency, files=args.files, file_size=args.file_size,
+                            hosts=args.hosts).start()
+
+    # Dispatcher собирается так же, как в script/main.py, но с временной базой и
+    # журналом в stderr, чтобы не трогать bot.db и logs/bot.log
+    logging.basicConfig(level=logging.WARNING, stream=sys.stderr)
+    from script import db
+    db.initialize_db(f"sqlite+aiosqlite:///{workdir.name}/bench.db")
+    from script.main import create_dispatcher
+    from script.delivery import RateLimitMiddleware
+    from script.metrics import handler_errors
+    from script.pool import ssh_pool
+    from script.scheduler import command_scheduler
+    from aiogram import Bot
+    from aiogram.client.default import DefaultBotProperties
+    from aiogram.enums import ParseMode
+    from aiogram.types import Update
+
+    dp = create_dispatcher()
+    await db.init_db()
+    await prepare_users(db, args.users, server.hosts, server.port)
+
+    session = FakeTelegramSession(latency=args.api_latency)
+    if args.rate_limit:
+        session.middleware(RateLimitMiddleware())
+    bot = Bot(BENCH_TOKEN, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+
+    rng = random.Random(args.seed)
+    names = rng.choices(list(weights), weights=list(weights.values()), k=args.updates)
+    updates = [
+        (name, Update(**make_update(i + 1, rng.randint(2, args.users + 1), COMMANDS[name])))
+        for i, name in enumerate(names)
+    ]
+
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def feed(name: str, update: Update):
+        async with slots:
+            started = time.perf_counter()
+            try:
+                await dp.feed_update(bot, update)
+            except Exception as e:
+                errors[name] += 1
+                logging.getLogger(__name__).warning(f"Update {update.update_id} ({name}) failed: {e}")
+            latencies[name].append(time.perf_counter() - started)
+
+    # Память до нагрузки: основную часть занимает импорт aiogram и SQLAlchemy
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    ssh_pool.start()
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(feed(name, update) for name, update in updates))
+        elapsed = time.perf_counter() - started
+    finally:
+        await ssh_pool.close()
+        await dp.storage.close()
+        await db.engine.dispose()
+        server.stop()
+        workdir.cleanup()
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        "updates": args.updates,
+        "seconds": round(elapsed, 3),
+        "updates_per_sec": round(args.updates / elapsed, 1),
+        "latency_ms": {
+            name: {
+                "count": len(values),
+                "p50": round(percentile(values, 0.50) * 1000, 2),
+                "p90": round(percentile(values, 0.90) * 1000, 2),
+                "p99": round(percentile(values, 0.99) * 1000, 2),
+                "max": round(max(values) * 1000, 2),
+            }
+            for name, values in sorted(latencies.items()) + [("all", all_latencies)]
+        },
+        "errors": dict(errors),
+        "handler_errors": sum(handler_errors.values.values()),
+        "rss_before_load_mb": round(rss_before / 1024, 1),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "telegram_calls": dict(session.calls),
+        "uploaded_bytes": session.uploaded_bytes,
+        "ssh_pool": {"hits": ssh_pool.hits, "misses": ssh_pool.misses, "evictions": ssh_pool.evictions},
+        "scheduler_rejected": command_scheduler.rejected,
+    }
+
+
+def print_report(result: dict):
+    print(f"Апдейтов: {result['updates']} за {result['seconds']} с - {result['updates_per_sec']} апдейтов/с")
+    print(f"Пиковый RSS: {result['peak_rss_mb']} МБ (до нагрузки {result['rss_before_load_mb']} МБ)")
+    print(f"{'команда':<10}{'кол-во':>8}{'p50 мс':>10}{'p90 мс':>10}{'p99 мс':>10}{'max мс':>10}")
+    for name, stats in result["latency_ms"].items():
+        print(f"{name:<10}{stats['count']:>8}{stats['p50']:>10}{stats['p90']:>10}{stats['p99']:>10}{stats['max']:>10}")
+    print(f"Ошибки: {result['errors'] or 'нет'}, в обработчиках: {result['handler_errors']}, "
+          f"отклонено планировщиком: {result['scheduler_rejected']}")
+    print(f"Вызовы Bot API: {result['telegram_calls']}, загружено {result['uploaded_bytes']} байт")
+    print(f"SSH-пул: {result['ssh_pool']}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        print_report(result)
+    return 1 if result["errors"] or result["handler_errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
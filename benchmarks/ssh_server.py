@@ -0,0 +1,256 @@
+"""
+Локальный SSH/SFTP-сервер на paramiko для нагрузочного теста.
+
+Сервер принимает любой логин с паролем BENCH_PASSWORD или с любым ключом, дает по SFTP
+читать и записывать файлы временной директории и выполняет команды "echo", "tail -n N -F -- путь"
+и "cd -- путь && find ..." (обход дерева для /tree).
+Каждая операция SFTP и exec задерживается на latency секунд, имитируя сеть.
+"""
+
+import os
+import time
+import shlex
+import socket
+import subprocess
+import logging
+import tempfile
+import threading
+from typing import List, Optional
+
+import paramiko
+
+logger = logging.getLogger(__name__)
+logging.getLogger("benchmarks.ssh_server.transport").setLevel(logging.CRITICAL)
+
+BENCH_PASSWORD = "bench"
+
+
+class _Server(paramiko.ServerInterface):
+    def __init__(self, latency: float, root: str):
+        self.latency = latency
+        self.root = root
+
+    def check_auth_password(self, username, password):
+        time.sleep(self.latency)
+        return paramiko.AUTH_SUCCESSFUL if password == BENCH_PASSWORD else paramiko.AUTH_FAILED
+
+    def check_auth_publickey(self, username, key):
+        time.sleep(self.latency)
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return "password,publickey"
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED_OPEN_REQUEST
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=self._exec, args=(channel, command.decode()), daemon=True).start()
+        return True
+
+    def _exec(self, channel: paramiko.Channel, command: str):
+        time.sleep(self.latency)
+        if command.startswith("echo "):
+            channel.sendall((command[5:] + "\n").encode())
+            channel.send_exit_status(0)
+        elif command.startswith("tail "):
+            self._tail(channel, shlex.split(command))
+        elif command.startswith("cd -- ") and " && find " in command:
+            # Обход дерева для /tree выполняется настоящим find внутри временной директории
+            result = subprocess.run(["sh", "-c", command], cwd=self.root, capture_output=True)
+            channel.sendall(result.stdout)
+            channel.send_exit_status(result.returncode)
+        else:
+            channel.sendall_stderr(f"{command.split()[0]}: command not found\n".encode())
+            channel.send_exit_status(127)
+        channel.close()
+
+    def _tail(self, channel: paramiko.Channel, args: List[str]):
+        """Последние N строк файла, затем дописываемые в него байты - пока клиент не закроет канал."""
+        lines = int(args[args.index("-n") + 1]) if "-n" in args else 10
+        path = os.path.join(self.root, os.path.normpath("/" + args[-1]).lstrip("/"))
+        try:
+            f = open(path, "rb")
+        except OSError as e:
+            channel.sendall_stderr(f"tail: cannot open '{args[-1]}': {e.strerror}\n".encode())
+            channel.send_exit_status(1)
+            return
+        with f:
+            try:
+                channel.sendall(b"".join(f.read().splitlines(keepends=True)[-lines:]))
+                while not channel.closed:
+                    data = f.read()
+                    if data:
+                        channel.sendall(data)
+                    else:
+                        time.sleep(0.02)
+            except OSError:
+                pass  # клиент закрыл канал посреди отправки
+
+
+class _Handle(paramiko.SFTPHandle):
+    def __init__(self, file_obj, latency: float, flags: int = 0):
+        super().__init__(flags)
+        self.readfile = file_obj
+        if flags & (os.O_WRONLY | os.O_RDWR):
+            self.writefile = file_obj
+        self.latency = latency
+
+    def read(self, offset, length):
+        time.sleep(self.latency)
+        return super().read(offset, length)
+
+    def stat(self):
+        return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+
+def _sftp_interface(root: str, latency: float):
+    """Класс SFTPServerInterface для файлов внутри root."""
+
+    class _SFTP(paramiko.SFTPServerInterface):
+        def _real(self, path: str) -> str:
+            return os.path.join(root, self.canonicalize(path).lstrip("/"))
+
+        def canonicalize(self, path):
+            if not path.startswith("/"):
+                path = "/" + path
+            return os.path.normpath(path)
+
+        def list_folder(self, path):
+            time.sleep(latency)
+            real = self._real(path)
+            try:
+                result = []
+                for name in os.listdir(real):
+                    attr = paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(real, name)))
+                    attr.filename = name
+                    result.append(attr)
+                return result
+            except OSError as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+
+        def stat(self, path):
+            time.sleep(latency)
+            try:
+                return paramiko.SFTPAttributes.from_stat(os.stat(self._real(path)))
+            except OSError as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+
+        lstat = stat
+
+        def open(self, path, flags, attr):
+            time.sleep(latency)
+            if flags & os.O_APPEND:
+                mode = "ab"
+            elif flags & os.O_WRONLY:
+                mode = "wb"
+            else:
+                mode = "r+b" if flags & os.O_RDWR else "rb"
+            try:
+                fd = os.open(self._real(path), flags, 0o644)
+                return _Handle(os.fdopen(fd, mode), latency, flags)
+            except OSError as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+
+        def remove(self, path):
+            try:
+                os.remove(self._real(path))
+            except OSError as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+            return paramiko.SFTP_OK
+
+        def posix_rename(self, oldpath, newpath):
+            try:
+                os.replace(self._real(oldpath), self._real(newpath))
+            except OSError as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+            return paramiko.SFTP_OK
+
+    return _SFTP
+
+
+class BenchSSHServer:
+    """
+    SSH-сервер в фоновых потоках на случайном порту адресов 127.0.0.1 ... 127.0.0.<hosts>.
+
+    Разные адреса нужны, чтобы бот видел разные хосты ВМ: лимиты планировщика
+    и SSH-исполнителя считаются по хосту.
+
+    Пример:
+        with BenchSSHServer(latency=0.005, files=50, file_size=65536, hosts=4) as server:
+            ...  # подключаться к server.hosts[i]:server.port
+    """
+
+    def __init__(self, latency: float = 0.0, files: int = 50, file_size: int = 64 * 1024, hosts: int = 1):
+        self.latency = latency
+        self.files = files
+        self.file_size = file_size
+        self.hosts = [f"127.0.0.{i}" for i in range(1, hosts + 1)]
+        self.port: Optional[int] = None
+        self._host_key = paramiko.RSAKey.generate(2048)
+        self._tmp = tempfile.TemporaryDirectory(prefix="bench-vm-")
+        self._socks: List[socket.socket] = []
+        self._transports: List[paramiko.Transport] = []
+        self._stopped = threading.Event()
+
+    @property
+    def root(self) -> str:
+        return self._tmp.name
+
+    def _populate(self):
+        line = b"2024-01-01 00:00:00 INFO benchmark log line with some payload\n"
+        content = (line * (self.file_size // len(line) + 1))[:self.file_size]
+        data_dir = os.path.join(self.root, "data")
+        os.makedirs(data_dir)
+        for i in range(self.files):
+            with open(os.path.join(data_dir, f"file{i:04d}.log"), "wb") as f:
+                f.write(content)
+        with open(os.path.join(self.root, "big.log"), "wb") as f:
+            f.write(content)
+
+    def start(self):
+        self._populate()
+        for host in self.hosts:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((host, self.port or 0))
+            sock.listen(128)
+            self.port = sock.getsockname()[1]
+            self._socks.append(sock)
+            threading.Thread(target=self._accept_loop, args=(sock,), name=f"bench-ssh-{host}", daemon=True).start()
+        return self
+
+    def _accept_loop(self, sock: socket.socket):
+        while not self._stopped.is_set():
+            try:
+                client, _ = sock.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(client)
+            # Разрывы соединений при остановке клиента - штатная ситуация для стенда
+            transport.set_log_channel("benchmarks.ssh_server.transport")
+            transport.add_server_key(self._host_key)
+            transport.set_subsystem_handler("sftp", paramiko.SFTPServer,
+                                            _sftp_interface(self.root, self.latency))
+            try:
+                transport.start_server(server=_Server(self.latency, self.root))
+            except (paramiko.SSHException, EOFError) as e:
+                logger.warning("Bench SSH handshake failed: %s", e)
+                continue
+            self._transports.append(transport)
+
+    def stop(self):
+        self._stopped.set()
+        for sock in self._socks:
+            sock.close()
+        for transport in self._transports:
+            transport.close()
+        self._tmp.cleanup()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
@@ -0,0 +1,130 @@
+"""
+Время холодного старта: каждый сценарий запускается в новом интерпретаторе
+с "python -X importtime", из вывода берутся время импорта и самые тяжелые модули.
+
+Запуск из корня проекта:
+    python -m benchmarks.startup --repeat 3
+"""
+
+import sys
+import json
+import time
+import argparse
+import subprocess
+from pathlib import Path
+from typing import Dict, List, NamedTuple
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Сценарий -> код, выполняемый в новом процессе
+SCENARIOS = {
+    "db": "import script.db",
+    "ssh": "import script.pool",
+    "handlers": "import handlers.vm_commands, handlers.teacher",
+    "main": "import script.main",
+    "app": "from script.main import create_app; create_app('42:STARTUP', 'sqlite+aiosqlite://')",
+}
+# Модули, которых не должно быть среди импортированных при старте: paramiko
+# загружается при первой команде к ВМ
+FORBIDDEN = ("paramiko",)
+WATCHED = ("paramiko", "cryptography", "aiogram", "aiohttp", "sqlalchemy", "pydantic")
+
+
+class ImportRecord(NamedTuple):
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def parse_importtime(stderr: str) -> List[ImportRecord]:
+    """Строки вида "import time:  self [us] | cumulative | name" из stderr интерпретатора."""
+    records = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue  # заголовок таблицы
+        name = parts[2].rstrip()
+        module = name.lstrip()
+        records.append(ImportRecord(module, int(parts[0]), int(parts[1]), (len(name) - len(module)) // 2))
+    return records
+
+
+def run_scenario(code: str) -> Dict:
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT,
+                            capture_output=True, text=True)
+    wall = time.perf_counter() - started
+    if result.returncode:
+        # Последняя строка traceback, например несовместимая версия aiogram
+        errors = [line for line in result.stderr.splitlines() if line and not line.startswith("import time:")]
+        return {"error": errors[-1] if errors else f"exit code {result.returncode}"}
+    records = parse_importtime(result.stderr)
+    modules = {record.module for record in records}
+    return {
+        "wall_ms": wall * 1000,
+        "import_ms": sum(record.self_us for record in records) / 1000,
+        "modules": len(records),
+        "loaded": sorted(name for name in WATCHED if name in modules),
+        "forbidden": sorted(name for name in FORBIDDEN if name in modules),
+        "top": [(record.module, record.cumulative_us / 1000)
+                for record in sorted(records, key=lambda r: r.cumulative_us, reverse=True)
+                if record.depth <= 1][:5],
+    }
+
+
+def measure(names: List[str], repeat: int) -> Dict[str, Dict]:
+    """Лучший (минимальный по времени) из repeat запусков каждого сценария."""
+    results = {}
+    for name in names:
+        runs = [run_scenario(SCENARIOS[name]) for _ in range(repeat)]
+        failed = next((run for run in runs if "error" in run), None)
+        if failed:
+            results[name] = failed
+            continue
+        best = min(runs, key=lambda run: run["wall_ms"])
+        results[name] = {**best, "wall_ms": round(best["wall_ms"], 1), "import_ms": round(best["import_ms"], 1),
+                         "top": [(module, round(ms, 1)) for module, ms in best["top"]]}
+    return results
+
+
+def print_report(results: Dict[str, Dict]):
+    print(f"{'сценарий':<10}{'старт мс':>10}{'импорт мс':>11}{'модулей':>9}  загружены")
+    for name, result in results.items():
+        if "error" in result:
+            print(f"{name:<10}  ошибка: {result['error']}")
+            continue
+        print(f"{name:<10}{result['wall_ms']:>10}{result['import_ms']:>11}{result['modules']:>9}  "
+              f"{', '.join(result['loaded']) or '-'}")
+    for name, result in results.items():
+        if "error" in result:
+            continue
+        top = ", ".join(f"{module} {ms} мс" for module, ms in result["top"])
+        print(f"{name}: {top}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Время холодного старта бота")
+    parser.add_argument("scenarios", nargs="*", help=f"Сценарии из {', '.join(SCENARIOS)}; по умолчанию все")
+    parser.add_argument("--repeat", type=int, default=3, help="Запусков каждого сценария, берется лучший")
+    parser.add_argument("--json", action="store_true", help="Вывести результат в JSON")
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    results = measure(args.scenarios or list(SCENARIOS), args.repeat)
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print_report(results)
+    failed = {name: result["forbidden"] for name, result in results.items() if result.get("forbidden")}
+    if failed:
+        print(f"Imported at startup: {failed}", file=sys.stderr)
+    return 1 if failed or any("error" in result for result in results.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,7 +8,7 @@ router = Router()
 
 @router.message(Command("help"))
 async def help_handler(message: Message):
-    logger.info(f"User {message.from_user.id} requested /help")
+    logger.info("User %s requested /help", message.from_user.id)
     
     help_text = (
         "<b>Доступные команды:</b>\n\n"
@@ -19,11 +19,28 @@ async def help_handler(message: Message):
         "<b>Работа с VM:</b>\n"
         "▫️ /vmpath <code>host user pass</code> - Сохранить данные для подключения\n"
         "   <i>Пример: /vmpath 1.2.3.4 myuser mypass</i>\n"
+        "▫️ /vmkey <code>host user [пароль_ключа]</code> - Подключаться по SSH-ключу (ключ - файлом или со следующей строки)\n"
         "▫️ /check - Проверить соединение с VM\n"
-        "▫️ /ls [путь] - Показать содержимое директории\n"
-        "   <i>Пример: /ls или /ls /home/user/docs</i>\n"
-        "▫️ /cat <code>путь_к_файлу</code> - Прочитать текстовый файл\n"
-        "   <i>Пример: /cat /etc/hosts</i>"
+        "▫️ /ls [путь] [шаблон] - Показать содержимое директории\n"
+        "   <i>Пример: /ls, /ls /home/user/docs или /ls /var/log *.log</i>\n"
+        "▫️ /tree <code>[путь] [глубина]</code> - Дерево директорий с размерами\n"
+        "   <i>Пример: /tree ~/lab1 3</i>\n"
+        "▫️ /cat <code>путь_к_файлу [смещение] [длина]</code> - Прочитать текстовый файл (большие файлы приходят документом)\n"
+        "   <i>Пример: /cat /etc/hosts или /cat app.log 4096 1024</i>\n"
+        "▫️ /get <code>путь_к_файлу</code> - Скачать файл с VM документом\n"
+        "▫️ /put <code>[путь]</code> - Подпись к файлу или ответ на него: сохранить файл на VM\n"
+        "   <i>Пример: /put ~/lab1/</i> - в ~/lab1 под исходным именем\n"
+        "▫️ /batch <code>ls путь; cat файл</code> - Несколько операций одним запросом\n"
+        "   <i>Пример: /batch ls ~/lab1; cat lab1/main.py; cat lab1/README.md</i>\n"
+        "▫️ /find <code>[путь] шаблон</code> - Найти файлы по имени\n"
+        "   <i>Пример: /find ~/lab1 '*.py'</i>\n"
+        "▫️ /grep <code>шаблон [путь]</code> - Найти строки в файлах\n"
+        "   <i>Пример: /grep 'def main' ~/lab1</i>\n"
+        "▫️ /tail <code>путь [строк]</code> - Следить за файлом: сообщение обновляется по мере появления строк\n"
+        "   <i>Пример: /tail ~/app/build.log 40</i>. Остановить: /stop\n\n"
+        "<b>Для преподавателей:</b>\n"
+        "▫️ /class <code>задача [путь]</code> - Выполнить задачу на ВМ всех своих студентов\n"
+        "   <i>Пример: /class check, /class ls ~/lab1 или /class cat lab1/main.py</i>"
     )
     
     await message.answer(help_text)
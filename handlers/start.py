@@ -6,9 +6,9 @@ from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.future import select
 
-from script.db import User, async_session
+from script.db import User
+from script.users import user_cache
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -26,8 +26,7 @@ def get_role_keyboard() -> InlineKeyboardMarkup:
 @router.message(Command("start"))
 async def start_handler(message: Message, state: FSMContext):
     user_id = message.from_user.id
-    async with async_session() as session:
-        user = await session.get(User, user_id)
+    user = await user_cache.get(user_id)
 
     if user:
         await message.answer(f"👋 Привет, {user.username}!\nТы уже зарегистрирован как {user.role}.")
@@ -51,9 +50,12 @@ async def teacher_role_chosen(query: CallbackQuery, state: FSMContext):
         role='teacher',
         tutorcode=tutor_code
     )
-    async with async_session() as session:
-        session.add(new_user)
-        await session.commit()
+    try:
+        await user_cache.register(new_user)
+    except IntegrityError:
+        await query.message.edit_text("Вы уже зарегистрированы. Используйте /status.")
+        await state.clear()
+        return
 
     await query.message.edit_text(
         "✅ Вы зарегистрированы как <b>Преподаватель</b>.\n"
@@ -72,20 +74,22 @@ async def process_tutor_code(message: Message, state: FSMContext):
     username = message.from_user.username or f"user_{user_id}"
     tutor_code = message.text
 
-    async with async_session() as session:
-        result = await session.execute(select(User).where(User.tutorcode == tutor_code))
-        teacher = result.scalar_one_or_none()
+    teacher = await user_cache.get_teacher_by_code(tutor_code)
 
     if teacher:
         new_user = User(
             userid=user_id,
             username=username,
             role='student',
-            subscribe=teacher.username
+            subscribe=teacher.username,
+            teacher_id=teacher.userid
         )
-        async with async_session() as session:
-            session.add(new_user)
-            await session.commit()
+        try:
+            await user_cache.register(new_user)
+        except IntegrityError:
+            await message.answer("Вы уже зарегистрированы. Используйте /status.")
+            await state.clear()
+            return
 
         await message.answer(f"✅ Вы успешно зарегистрированы как <b>Слушатель</b> и подписаны на преподавателя @{teacher.username}.")
         await state.clear()
@@ -0,0 +1,74 @@
+import os
+import html
+import time
+import logging
+from contextlib import aclosing
+
+from aiogram import Router
+from aiogram.types import Message
+from aiogram.filters import Command
+
+from script.delivery import ProgressReply
+from script.documents import buffered_document
+from script.fanout import FANOUT_TASKS, FanoutReport, fan_out, load_students
+from script.pool import ssh_pool
+from script.users import user_cache
+
+logger = logging.getLogger(__name__)
+router = Router()
+
+# Как часто (сек) обновляется сообщение с отчетом, пока ВМ отвечают
+FANOUT_EDIT_INTERVAL = float(os.getenv("FANOUT_EDIT_INTERVAL", "2"))
+
+
+def get_usage_text() -> str:
+    tasks = "\n".join(
+        f"▫️ <code>{name}{' путь' if task.needs_path else ''}</code> - {task.description}"
+        for name, task in FANOUT_TASKS.items()
+    )
+    return (
+        "Используйте: <code>/class задача [путь]</code>\n"
+        f"Доступные задачи:\n{tasks}\n"
+        "<i>Пример: /class ls ~/lab1 или /class cat lab1/main.py</i>"
+    )
+
+
+@router.message(Command("class"))
+async def class_handler(message: Message):
+    user_id = message.from_user.id
+    teacher = await user_cache.get(user_id)
+    if not teacher or teacher.role != 'teacher':
+        await message.answer("⛔️ Команда доступна только преподавателям.")
+        return
+
+    args = message.text.split(maxsplit=2)
+    task = FANOUT_TASKS.get(args[1]) if len(args) > 1 else None
+    arg = args[2].strip() if len(args) > 2 else None
+    if task is None or (task.needs_path and not arg):
+        await message.answer(get_usage_text())
+        return
+
+    students = await load_students(teacher.userid, teacher.username)
+    if not students:
+        await message.answer("У вас пока нет подписанных студентов.")
+        return
+
+    title = f"/class {args[1]}" + (f" {arg}" if task.needs_path else "")
+    report = FanoutReport(title, students)
+    reply = ProgressReply(message)
+    await reply.update(report.render_summary())
+    logger.info("Teacher %s runs '%s' on %s VMs", user_id, title, len(students))
+
+    last_edit = time.monotonic()
+    results = fan_out(students, task, arg if task.needs_path else None, ssh_pool)
+    async with aclosing(results):
+        async for result in results:
+            report.add(result)
+            if not report.done and time.monotonic() - last_edit >= FANOUT_EDIT_INTERVAL:
+                await reply.update(report.render_summary())
+                last_edit = time.monotonic()
+
+    await reply.answer(report.render_summary())
+    if any(result.ok for result in report.results.values()):
+        document = buffered_document(report.render_document().encode(), f"class-{args[1]}.txt")
+        await message.answer_document(document, caption=f"Выводы: <code>{html.escape(title)}</code>")
@@ -1,24 +1,96 @@
+import os
+import html
+import stat
+import time
 import logging
 import re
-from aiogram import Router
-from aiogram.types import Message
+import shlex
+import posixpath
+from contextlib import aclosing, asynccontextmanager
+from typing import Any, Awaitable, Callable, Hashable, List, Optional, Tuple
+from aiogram import Router, F
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import Command
 
-from script.classes import VMConfigManager, SSHConnection
-import paramiko
-from script.db import async_session
+from script.classes import VMConfig, VMConfigManager, FileOperations
+from script.pool import ssh_pool
+from script.users import user_cache
+from script.scheduler import QueueFull, command_scheduler
+from script.delivery import ProgressReply, exclusive
+from script.metrics import registry, ssh_phase
+from script.streaming import PAGE_SIZE, iter_html_pages, read_ahead
+from script.listing import ListingSnapshot, ListView, SORT_KEYS, listing_cache, render_text
+from script.documents import (DOCUMENT_MAX_BYTES, DOCUMENT_THRESHOLD, StreamedInputFile,
+                              buffered_document, worth_compressing)
+from script.lazy import LazyModule
+from script.keys import KEY_MAX_BYTES, key_cache, key_type_of, load_private_key
+from script.executor import ssh_executor
+from script.tail import STOP_REASONS, TAIL_LINES, TailSession, tail_sessions
+from script.tree import (TREE_MAX_DEPTH, TREE_MAX_ENTRIES, TreeIndex, build_index, refresh_index,
+                         render_tree, tree_cache)
+from script.transfer import PUT_MAX_BYTES, PUT_READ_AHEAD, TransferMeter, format_size, telegram_file_chunks
+
+# Нужен только для обработки ошибок аутентификации; импортируется при первой такой ошибке
+paramiko = LazyModule("paramiko")
 
 logger = logging.getLogger(__name__)
 router = Router()
 
-# Создаем один экземпляр менеджера конфигураций
-vm_config_manager = VMConfigManager(async_session)
+# Максимальный объем файла (в байтах), который /cat отдает сообщениями за один вызов
+CAT_MAX_BYTES = int(os.getenv("CAT_MAX_BYTES", str(64 * 1024)))
+# Листинг длиннее этого числа страниц /ls отправляет документом
+LS_DOCUMENT_PAGES = int(os.getenv("LS_DOCUMENT_PAGES", "10"))
+# Максимум операций в одном /batch и объем, который читает каждая операция cat
+BATCH_MAX_OPS = int(os.getenv("BATCH_MAX_OPS", "8"))
+BATCH_CAT_BYTES = int(os.getenv("BATCH_CAT_BYTES", str(16 * 1024)))
+# Ограничения /find и /grep: число строк результата, их общий объем и длина одной строки
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "200"))
+SEARCH_MAX_BYTES = int(os.getenv("SEARCH_MAX_BYTES", str(32 * 1024)))
+SEARCH_MAX_LINE = 300
+# Больше строк в окне /tail не помещается в одно сообщение
+TAIL_MAX_LINES = 100
+# Сколько уровней /tree показывает по умолчанию
+TREE_SHOW_DEPTH = 2
+
+# Создаем один экземпляр менеджера конфигураций; сессии берутся из script.db на момент запроса
+vm_config_manager = VMConfigManager(ssh_pool=ssh_pool, user_cache=user_cache)
+registry.callback("vm_config_cache_hits_total", "Данные ВМ, найденные в кэше", "counter",
+                  lambda: vm_config_manager.cache.hits)
+registry.callback("vm_config_cache_misses_total", "Данные ВМ, прочитанные из БД", "counter",
+                  lambda: vm_config_manager.cache.misses)
+
+QUEUE_FULL_TEXT = "⏳ У вас уже слишком много команд в очереди. Дождитесь их выполнения и повторите."
+
+
+async def run_scheduled(reply: Optional[ProgressReply], user_id: int, vm_config: VMConfig,
+                        factory: Callable[[], Awaitable[Any]], key: Optional[Hashable] = None):
+    """Выполняет работу с ВМ через планировщик команд, сообщая пользователю о месте в очереди."""
+    async def notify(ahead: int):
+        if reply is None:
+            return
+        if ahead:
+            await reply.update(f"⏳ Команда поставлена в очередь, перед ней: {ahead}.")
+        else:
+            await reply.update("⏳ ВМ занята командами других пользователей, команда ждет своей очереди.")
+
+    return await command_scheduler.run(user_id, vm_config.host, factory, key=key, on_queued=notify)
+
+def parse_host(host_str: str) -> Optional[Tuple[str, int]]:
+    """Разбирает "host" или "host:port"; None - если порт указан неверно."""
+    if ':' not in host_str:
+        return host_str, 22
+    host, port_str = host_str.split(':', 1)
+    if not port_str.isdigit() or not (0 < int(port_str) < 65536):
+        return None
+    return host, int(port_str)
+
 
 @router.message(Command("vmpath"))
 async def vmpath_handler(message: Message):
     user_id = message.from_user.id
     args = message.text.split()
-    logger.info(f"/vmpath args from user {user_id}: {args}")
+    logger.info("/vmpath args from user %s: %s", user_id, args)
     if len(args) != 4:
         await message.answer(
             "Неверный формат. Используйте: <code>/vmpath host username password</code>\n"
@@ -27,117 +99,809 @@ async def vmpath_handler(message: Message):
         return
 
     host_str, username, password = args[1], args[2], args[3]
-    # Простая валидация хоста
-    if ':' in host_str:
-        host, port_str = host_str.split(':', 1)
-        if not port_str.isdigit() or not (0 < int(port_str) < 65536):
-            await message.answer("Неверный номер порта. Укажите число от 1 до 65535.")
-            return
-        port = int(port_str)
-    else:
-        host = host_str
-        port = 22
+    address = parse_host(host_str)
+    if address is None:
+        await message.answer("Неверный номер порта. Укажите число от 1 до 65535.")
+        return
+    host, port = address
 
-    logger.info(f"User {user_id} setting VM config: Host={host}, Port={port}, User={username}")
+    logger.info("User %s setting VM config: Host=%s, Port=%s, User=%s", user_id, host, port, username)
 
     try:
         success = await vm_config_manager.save_vm_config(user_id, host, port, username, password)
         if success:
+            listing_cache.invalidate_user(user_id)
+            tree_cache.invalidate_user(user_id)
             await message.answer("✅ Данные для подключения к VM успешно сохранены!")
         else:
             # Проверим, зарегистрирован ли пользователь
-            from script.db import User, async_session
-            async with async_session() as session:
-                user = await session.get(User, user_id)
+            user = await user_cache.get(user_id)
             if not user:
-                logger.warning(f"User {user_id} tried to set VM config but is not registered.")
+                logger.warning("User %s tried to set VM config but is not registered.", user_id)
                 await message.answer("❗️ Вы не зарегистрированы. Сначала используйте /start.")
             else:
                 await message.answer("❌ Ошибка при сохранении данных. Проверьте логи или обратитесь к администратору.")
     except Exception as e:
-        logger.error(f"Exception in /vmpath for user {user_id}: {e}")
+        logger.error("Exception in /vmpath for user %s: %s", user_id, e)
+        await message.answer(f"❌ Произошла ошибка: {e}")
+
+
+VMKEY_USAGE_TEXT = (
+    "Используйте: <code>/vmkey host[:port] username [пароль_ключа]</code>\n"
+    "Закрытый ключ пришлите файлом с этой командой в подписи или вставьте текстом со следующей строки.\n"
+    "<i>Пример: /vmkey 1.2.3.4 myuser, а ниже - содержимое ~/.ssh/id_ed25519</i>"
+)
+
+
+@router.message(Command("vmkey"))
+async def vmkey_handler(message: Message):
+    user_id = message.from_user.id
+    # Команда приходит либо текстом, либо подписью к файлу с ключом
+    first_line, _, key_text = (message.text or message.caption or "").partition("\n")
+    args = first_line.split()
+    if len(args) not in (3, 4):
+        await message.answer(VMKEY_USAGE_TEXT)
+        return
+    address = parse_host(args[1])
+    if address is None:
+        await message.answer("Неверный номер порта. Укажите число от 1 до 65535.")
+        return
+    host, port = address
+    username = args[2]
+    passphrase = args[3] if len(args) == 4 else None
+
+    if message.document:
+        if (message.document.file_size or 0) > KEY_MAX_BYTES:
+            await message.answer("❌ Файл слишком большой для закрытого ключа.")
+            return
+        data = await message.bot.download(message.document)
+        key_text = data.read().decode("utf-8", errors="replace")
+    key_text = key_text.strip()
+    if not key_text:
+        await message.answer(VMKEY_USAGE_TEXT)
+        return
+
+    logger.info("User %s setting VM key: Host=%s, Port=%s, User=%s", user_id, host, port, username)
+    try:
+        # Расшифровка ключа - тяжелая операция, выполняем ее вне event loop
+        pkey = await ssh_executor.run(host, load_private_key, key_text, None, passphrase)
+        key_type = key_type_of(pkey)
+    except paramiko.PasswordRequiredException:
+        await message.answer("🔒 Ключ зашифрован. Укажите его пароль: "
+                             "<code>/vmkey host username пароль_ключа</code>")
+        return
+    except (paramiko.SSHException, ValueError) as e:
+        await message.answer(f"❌ Не удалось прочитать ключ: {html.escape(str(e))}")
+        return
+
+    try:
+        success = await vm_config_manager.save_vm_key(user_id, host, port, username, key_text, key_type, passphrase)
+    except Exception as e:
+        logger.error("Exception in /vmkey for user %s: %s", user_id, e)
         await message.answer(f"❌ Произошла ошибка: {e}")
+        return
+    if not success:
+        if not await user_cache.get(user_id):
+            await message.answer("❗️ Вы не зарегистрированы. Сначала используйте /start.")
+        else:
+            await message.answer("❌ Ошибка при сохранении данных. Проверьте логи или обратитесь к администратору.")
+        return
+
+    # Первое подключение возьмет уже расшифрованный ключ
+    key_cache.put(key_text, passphrase, pkey)
+    listing_cache.invalidate_user(user_id)
+    tree_cache.invalidate_user(user_id)
+    # Закрытый ключ не должен оставаться в истории чата
+    try:
+        await message.delete()
+        deleted = "\nСообщение с ключом удалено из чата."
+    except TelegramBadRequest:
+        deleted = "\n⚠️ Не удалось удалить сообщение с ключом, удалите его вручную."
+    await message.answer(f"✅ Ключ {key_type.upper()} для {html.escape(username)}@{html.escape(host)} сохранен.\n"
+                         f"Отпечаток: <code>{pkey.fingerprint}</code>{deleted}")
 
 
 @router.message(Command("check"))
 async def check_vm_connection_handler(message: Message):
     user_id = message.from_user.id
-    await message.answer("Проверяю подключение к VM... ⏳")
+    reply = ProgressReply(message)
+    await reply.update("Проверяю подключение к VM... ⏳")
 
     vm_config = await vm_config_manager.get_vm_config(user_id)
     if not vm_config:
-        await message.answer("⚠️ Данные для подключения не найдены. Сначала используйте /vmpath.")
+        await reply.answer("⚠️ Данные для подключения не найдены. Сначала используйте /vmpath.")
         return
 
+    async def check():
+        async with ssh_pool.connection(user_id, vm_config) as ssh:
+            return await ssh.execute_command("echo Connection test successful")
+
     try:
-        async with SSHConnection(**vm_config) as ssh:
-            stdout, stderr, status = await ssh.execute_command("echo Connection test successful")
-            if status == 0:
-                await message.answer(f"✅ Успешное подключение к {vm_config['host']}.\nСервер ответил: <code>{stdout}</code>")
-            else:
-                await message.answer(f"⚠️ Подключение установлено, но тестовая команда провалилась.\nОшибка: <code>{stderr}</code>")
+        stdout, stderr, status = await run_scheduled(reply, user_id, vm_config, check, key="check")
+        if status == 0:
+            await reply.answer(f"✅ Успешное подключение к {vm_config.host}.\nСервер ответил: <code>{stdout}</code>")
+        else:
+            await reply.answer(f"⚠️ Подключение установлено, но тестовая команда провалилась.\nОшибка: <code>{stderr}</code>")
+    except QueueFull:
+        await reply.answer(QUEUE_FULL_TEXT)
     except paramiko.AuthenticationException:
-        await message.answer("❌ Ошибка аутентификации. Неверное имя пользователя или пароль.")
+        await reply.answer("❌ Ошибка аутентификации. Неверное имя пользователя, пароль или ключ.")
     except Exception as e:
-        logger.error(f"User {user_id} SSH check error: {e}")
-        await message.answer(f"❌ Не удалось подключиться: {e}")
+        logger.error("User %s SSH check error: %s", user_id, e)
+        await reply.answer(f"❌ Не удалось подключиться: {e}")
+
+async def load_listing(user_id: int, vm_config: VMConfig, path: str,
+                       reply: Optional[ProgressReply] = None) -> ListingSnapshot:
+    """
+    Возвращает листинг директории из кэша, а при истечении TTL сверяет mtime
+    директории и перечитывает ее только если она изменилась.
+    """
+    cached = listing_cache.get(user_id, path)
+    if cached and cached.is_fresh(listing_cache.ttl):
+        return cached
+
+    async def fetch():
+        async with ssh_pool.connection(user_id, vm_config) as ssh:
+            file_ops = FileOperations(ssh)
+            attrs = await file_ops.stat(path)
+            if not stat.S_ISDIR(attrs.st_mode):
+                raise NotADirectoryError(path)
+            if cached and cached.dir_mtime == attrs.st_mtime:
+                cached.touch()
+                return cached
+            entries = await file_ops.list_directory(path)
+        return listing_cache.put(user_id, path, entries, attrs.st_mtime)
+
+    return await run_scheduled(reply, user_id, vm_config, fetch, key=("ls", path))
+
+
+def get_listing_keyboard(view: ListView, page: int, pages: int, sort_key: str) -> InlineKeyboardMarkup:
+    def data(target_page: int, target_sort: str) -> str:
+        return f"ls:{view.view_id}:{target_page}:{target_sort}"
+
+    sort_titles = {"name": "Имя", "size": "Размер", "mtime": "Дата"}
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="◀️", callback_data=data(max(page - 1, 0), sort_key)),
+            InlineKeyboardButton(text=f"{page + 1}/{pages}", callback_data=data(page, sort_key)),
+            InlineKeyboardButton(text="▶️", callback_data=data(min(page + 1, pages - 1), sort_key)),
+        ],
+        [
+            InlineKeyboardButton(text=("• " if key == sort_key else "") + title, callback_data=data(0, key))
+            for key, title in sort_titles.items()
+        ],
+    ])
+
+
+def format_listing(view: ListView, page: int, sort_key: str):
+    """Текст страницы, клавиатура и число страниц просмотра /ls."""
+    body, page, pages = view.render_page(page, sort_key)
+    header = f"📁 <code>{html.escape(view.path)}</code>"
+    if view.pattern:
+        header += f" (фильтр <code>{html.escape(view.pattern)}</code>)"
+    if not body:
+        return f"{header}\n\nНичего не найдено.", None, pages
+    return f"{header}\n<pre>{body}</pre>", get_listing_keyboard(view, page, pages, sort_key), pages
+
 
 @router.message(Command("ls"))
 async def ls_handler(message: Message):
     user_id = message.from_user.id
     args = message.text.split(maxsplit=1)
-    path = args[1] if len(args) > 1 else "."
+    path = args[1].strip() if len(args) > 1 else "."
+    pattern = None
+    # Последний аргумент с символами шаблона считается фильтром: /ls /var/log *.log
+    if " " in path and any(ch in path.rsplit(" ", 1)[1] for ch in "*?["):
+        path, pattern = path.rsplit(" ", 1)
+    elif any(ch in path for ch in "*?["):
+        path, pattern = ".", path
+    path = FileOperations.normalize_path(path.strip())
 
     vm_config = await vm_config_manager.get_vm_config(user_id)
     if not vm_config:
         await message.answer("⚠️ Данные для подключения не найдены. Сначала используйте /vmpath.")
         return
 
-    await message.answer(f"Получаю содержимое директории <code>{path}</code>...")
+    reply = ProgressReply(message)
+    try:
+        snapshot = await load_listing(user_id, vm_config, path, reply)
+        view = listing_cache.register_view(user_id, path, pattern, snapshot)
+        text, keyboard, pages = format_listing(view, 0, "name")
+        if not snapshot.entries:
+            text = f"Директория <code>{html.escape(path)}</code> пуста."
+        if pages > LS_DOCUMENT_PAGES:
+            listing = render_text(view.entries("name")).encode()
+            document = buffered_document(listing, "ls.txt")
+            await reply.answer_document(document, caption=text.split("\n", 1)[0])
+            return
+        await reply.answer(text, reply_markup=keyboard)
+    except QueueFull:
+        await reply.answer(QUEUE_FULL_TEXT)
+    except NotADirectoryError:
+        await reply.answer(f"<code>{html.escape(path)}</code> - это файл. Используйте /cat.")
+    except FileNotFoundError:
+        await reply.answer(f"❌ Директория <code>{html.escape(path)}</code> не найдена.")
+    except Exception as e:
+        logger.error("User %s ls error: %s", user_id, e)
+        await reply.answer(f"❌ Ошибка при выполнении команды: {html.escape(str(e))}")
+
+
+@router.callback_query(F.data.startswith("ls:"))
+async def ls_page_callback(query: CallbackQuery):
+    user_id = query.from_user.id
+    try:
+        _, view_id, page_str, sort_key = query.data.split(":")
+        page = int(page_str)
+    except ValueError:
+        await query.answer()
+        return
+
+    view = listing_cache.get_view(user_id, view_id)
+    if view is None or sort_key not in SORT_KEYS:
+        await query.answer("Список устарел, повторите /ls", show_alert=True)
+        return
 
+    # Листание показывает тот же снимок, что и сообщение: к ВМ не обращаемся
     try:
-        async with SSHConnection(**vm_config) as ssh:
-            stdout, stderr, status = await ssh.execute_command(f"ls -la {path}")
-            if status == 0:
-                if not stdout:
-                    await message.answer(f"Директория <code>{path}</code> пуста.")
-                else:
-                    await message.answer(f"<pre>{stdout[:4000]}</pre>")
-            else:
-                await message.answer(f"❌ Ошибка выполнения команды ls:\n<pre>{stderr}</pre>")
+        text, keyboard, _ = format_listing(view, page, sort_key)
+        await query.message.edit_text(text, reply_markup=keyboard)
+        await query.answer()
+    except TelegramBadRequest:
+        # Страница не изменилась (например, нажата кнопка с номером страницы)
+        await query.answer()
     except Exception as e:
-        logger.error(f"User {user_id} ls error: {e}")
-        await message.answer(f"❌ Ошибка при выполнении команды: {e}")
+        logger.error("User %s ls page error: %s", user_id, e)
+        await query.answer(f"Ошибка: {e}", show_alert=True)
 
 @router.message(Command("cat"))
 async def cat_handler(message: Message):
     user_id = message.from_user.id
     
     args = message.text.split()
-    if len(args) != 2:
-        await message.answer("Неверный формат. Используйте: <code>/cat путь_к_файлу</code>")
+    usage = "Неверный формат. Используйте: <code>/cat путь_к_файлу [смещение] [длина]</code>"
+    if not 2 <= len(args) <= 4:
+        await message.answer(usage)
         return
     
     file_path = args[1]
+    try:
+        offset = int(args[2]) if len(args) > 2 else 0
+        length = int(args[3]) if len(args) > 3 else None
+    except ValueError:
+        await message.answer(usage)
+        return
+    if offset < 0 or (length is not None and length <= 0):
+        await message.answer(usage)
+        return
+    limit = min(length or CAT_MAX_BYTES, CAT_MAX_BYTES)
 
     vm_config = await vm_config_manager.get_vm_config(user_id)
     if not vm_config:
         await message.answer("⚠️ Данные для подключения не найдены. Сначала используйте /vmpath.")
         return
         
-    await message.answer(f"Читаю файл <code>{file_path}</code>...")
+    reply = ProgressReply(message)
+    await reply.update(f"Читаю файл <code>{html.escape(file_path)}</code>...")
+
+    async def send_document(file_ops: FileOperations, size: int, wanted: int):
+        """Отправляет фрагмент файла одним документом, читая его по SFTP во время загрузки."""
+        limit = min(wanted, DOCUMENT_MAX_BYTES)
+        sample = b""
+        async with aclosing(file_ops.read_file_chunks(file_path, offset, min(limit, FileOperations.CHUNK_SIZE))) as chunks:
+            async for chunk in chunks:
+                sample += chunk
+        if b"\x00" in sample[:1024]:
+            raise ValueError("File is not a text file")
+
+        compress = worth_compressing(sample, limit)
+        filename = os.path.basename(file_path.rstrip("/")) or "output"
+        document = StreamedInputFile(lambda: file_ops.read_file_chunks(file_path, offset, limit),
+                                     filename, compress=compress)
+        caption = f"📄 <code>{html.escape(file_path)}</code>: {limit} байт"
+        if compress:
+            caption += " (gzip)"
+        if size > offset + limit:
+            caption += (f" из {size}. Продолжение:\n"
+                        f"<code>/cat {html.escape(file_path)} {offset + limit}</code>")
+        await reply.answer_document(document, caption=caption)
+
+    async def stream_file():
+        async with ssh_pool.connection(user_id, vm_config) as ssh:
+            file_ops = FileOperations(ssh)
+            attrs = await file_ops.stat(file_path)
+            if stat.S_ISDIR(attrs.st_mode):
+                await reply.answer(f"<code>{html.escape(file_path)}</code> - это директория. Используйте /ls.")
+                return
+
+            # Больше нескольких страниц текста удобнее получить одним файлом
+            remaining = max(attrs.st_size - offset, 0)
+            wanted = remaining if length is None else min(length, remaining)
+            if wanted > DOCUMENT_THRESHOLD:
+                await send_document(file_ops, attrs.st_size, wanted)
+                return
+
+            pages_sent = 0
+            pages = iter_html_pages(file_ops.read_text_file(file_path, offset, limit))
+            async with aclosing(pages):
+                async for page in pages:
+                    await reply.notice(f"<pre>{page}</pre>")
+                    pages_sent += 1
+
+            if not pages_sent:
+                await reply.notice(f"Файл <code>{html.escape(file_path)}</code> пуст.")
+            elif attrs.st_size > offset + limit:
+                await reply.notice(
+                    f"✂️ Показано {limit} байт из {attrs.st_size}. Продолжение:\n"
+                    f"<code>/cat {html.escape(file_path)} {offset + limit}</code>"
+                )
+
+    try:
+        await run_scheduled(reply, user_id, vm_config, stream_file)
+    except QueueFull:
+        await reply.answer(QUEUE_FULL_TEXT)
+    except ValueError:
+        await reply.answer("❌ Файл не является текстовым.")
+    except FileNotFoundError:
+        await reply.answer(f"❌ Файл <code>{html.escape(file_path)}</code> не найден.")
+    except Exception as e:
+        logger.error("User %s cat error: %s", user_id, e)
+        await reply.answer(f"❌ Ошибка при выполнении команды: {html.escape(str(e))}")
+
+
+@router.message(Command("get"))
+async def get_handler(message: Message):
+    user_id = message.from_user.id
+    args = _split_args(message)
+    if not args or len(args) != 1:
+        await message.answer("Используйте: <code>/get путь_к_файлу</code>\n"
+                             "<i>Пример: /get ~/lab1/report.pdf</i>")
+        return
+    file_path = args[0]
+
+    vm_config = await vm_config_manager.get_vm_config(user_id)
+    if not vm_config:
+        await message.answer("⚠️ Данные для подключения не найдены. Сначала используйте /vmpath.")
+        return
+
+    reply = ProgressReply(message)
+    await reply.update(f"📥 Передаю файл <code>{html.escape(file_path)}</code>...")
+
+    async def send_file():
+        async with ssh_pool.connection(user_id, vm_config) as ssh:
+            file_ops = FileOperations(ssh)
+            attrs = await file_ops.stat(file_path)
+            if stat.S_ISDIR(attrs.st_mode):
+                await reply.answer(f"<code>{html.escape(file_path)}</code> - это директория. Используйте /ls.")
+                return
+            if attrs.st_size > DOCUMENT_MAX_BYTES:
+                await reply.answer(f"❌ Файл больше {format_size(DOCUMENT_MAX_BYTES)}: "
+                                   f"{format_size(attrs.st_size)}.")
+                return
+
+            # Файл читается по SFTP прямо во время загрузки в Telegram
+            meter = TransferMeter("get")
+            filename = os.path.basename(file_path.rstrip("/")) or "file"
+            document = StreamedInputFile(lambda: meter.count(file_ops.read_file_prefetched(file_path)), filename)
+            caption = f"📄 <code>{html.escape(file_path)}</code>"
+            with ssh_phase("sftp_get", vm_config.host):
+                sent = await reply.answer_document(document, caption=caption)
+
+        logger.info("User %s downloaded %s: %s bytes in %.2fs", user_id, file_path, meter.bytes, meter.elapsed)
+        try:
+            await sent.edit_caption(caption=f"{caption}\n{meter.summary()}")
+        except TelegramBadRequest as e:
+            logger.warning("Cannot add transfer stats to the document caption: %s", e)
+
+    try:
+        await run_scheduled(reply, user_id, vm_config, send_file)
+    except QueueFull:
+        await reply.answer(QUEUE_FULL_TEXT)
+    except FileNotFoundError:
+        await reply.answer(f"❌ Файл <code>{html.escape(file_path)}</code> не найден.")
+    except Exception as e:
+        logger.error("User %s get error: %s", user_id, e)
+        await reply.answer(f"❌ Ошибка при передаче файла: {html.escape(str(e))}")
+
+
+async def put_target(file_ops: FileOperations, path: Optional[str], filename: str) -> str:
+    """
+    Путь на ВМ для /put: по умолчанию домашняя директория; если путь - директория
+    (с "/" на конце или существующая на ВМ), файл сохраняется в нее под исходным именем.
+    """
+    if not path:
+        return filename
+    if path.endswith("/"):
+        return path + filename
+    try:
+        attrs = await file_ops.stat(path)
+    except FileNotFoundError:
+        return path
+    return f"{path}/{filename}" if stat.S_ISDIR(attrs.st_mode) else path
+
+
+@router.message(Command("put"))
+async def put_handler(message: Message):
+    user_id = message.from_user.id
+    args = _split_args(message)
+    # Документ приходит с подписью /put или команда отправляется ответом на документ
+    document = message.document or (message.reply_to_message and message.reply_to_message.document)
+    if document is None or args is None or len(args) > 1:
+        await message.answer("Отправьте файл с подписью <code>/put [путь]</code> "
+                             "или ответьте этой командой на сообщение с файлом.\n"
+                             "<i>Пример: /put ~/lab1/</i> - сохранить в ~/lab1 под исходным именем")
+        return
+    if document.file_size and document.file_size > PUT_MAX_BYTES:
+        await message.answer(f"❌ Telegram позволяет боту скачивать файлы не больше "
+                             f"{format_size(PUT_MAX_BYTES)}.")
+        return
+    filename = os.path.basename(document.file_name or "") or "upload.bin"
+    file_path = args[0] if args else filename
+
+    vm_config = await vm_config_manager.get_vm_config(user_id)
+    if not vm_config:
+        await message.answer("⚠️ Данные для подключения не найдены. Сначала используйте /vmpath.")
+        return
+
+    reply = ProgressReply(message)
+    await reply.update(f"📤 Сохраняю файл в <code>{html.escape(file_path)}</code>...")
+
+    async def receive_file():
+        nonlocal file_path
+        file = await message.bot.get_file(document.file_id)
+        async with ssh_pool.connection(user_id, vm_config) as ssh:
+            file_ops = FileOperations(ssh)
+            file_path = await put_target(file_ops, args[0] if args else None, filename)
+            # Скачивание из Telegram идет параллельно с записью на ВМ, через ограниченную очередь
+            meter = TransferMeter("put")
+            chunks = read_ahead(meter.count(telegram_file_chunks(message.bot, file.file_path)), PUT_READ_AHEAD)
+            with ssh_phase("sftp_put", vm_config.host):
+                await file_ops.write_file(file_path, chunks)
+
+        logger.info("User %s uploaded %s: %s bytes in %.2fs", user_id, file_path, meter.bytes, meter.elapsed)
+        await reply.answer(f"✅ Файл сохранен: <code>{html.escape(file_path)}</code>\n{meter.summary()}")
 
     try:
-        async with SSHConnection(**vm_config) as ssh:
-            stdout, stderr, status = await ssh.execute_command(f"cat {file_path}")
-            if status == 0:
-                if not stdout:
-                    await message.answer(f"Файл <code>{file_path}</code> пуст.")
-                else:
-                    for i in range(0, len(stdout), 4000):
-                        await message.answer(f"<pre>{stdout[i:i+4000]}</pre>")
+        await run_scheduled(reply, user_id, vm_config, receive_file)
+    except QueueFull:
+        await reply.answer(QUEUE_FULL_TEXT)
+    except FileNotFoundError:
+        await reply.answer(f"❌ Директория для <code>{html.escape(file_path)}</code> не найдена.")
+    except PermissionError:
+        await reply.answer(f"❌ Нет прав на запись в <code>{html.escape(file_path)}</code>.")
+    except Exception as e:
+        logger.error("User %s put error: %s", user_id, e)
+        await reply.answer(f"❌ Ошибка при передаче файла: {html.escape(str(e))}")
+
+def parse_batch(text: str) -> List[Tuple[str, str]]:
+    """
+    Разбирает операции /batch: по одной на строку или через ";".
+
+    Raises:
+        ValueError: Операция не ls/cat или у cat не указан файл
+    """
+    ops = []
+    for line in text.splitlines():
+        for part in line.split(";"):
+            part = part.strip()
+            if not part:
+                continue
+            verb, _, path = part.partition(" ")
+            path = path.strip()
+            if verb not in ("ls", "cat") or (verb == "cat" and not path):
+                raise ValueError(f"Unsupported batch operation: {part}")
+            ops.append((verb, path or "."))
+    return ops
+
+
+def batch_command(verb: str, path: str) -> str:
+    """Команда оболочки для операции /batch; путь экранируется."""
+    quoted = shlex.quote(FileOperations.normalize_path(path))
+    if verb == "ls":
+        return f"ls -la -- {quoted}"
+    return f"head -c {BATCH_CAT_BYTES} -- {quoted}"
+
+
+@router.message(Command("batch"))
+async def batch_handler(message: Message):
+    user_id = message.from_user.id
+    usage = (
+        f"Используйте: <code>/batch ls путь; cat файл</code> - до {BATCH_MAX_OPS} операций "
+        "через \";\" или с новой строки."
+    )
+    args = message.text.split(maxsplit=1)
+    try:
+        ops = parse_batch(args[1]) if len(args) > 1 else []
+    except ValueError:
+        ops = []
+    if not ops or len(ops) > BATCH_MAX_OPS:
+        await message.answer(usage)
+        return
+
+    vm_config = await vm_config_manager.get_vm_config(user_id)
+    if not vm_config:
+        await message.answer("⚠️ Данные для подключения не найдены. Сначала используйте /vmpath.")
+        return
+
+    reply = ProgressReply(message)
+    await reply.update(f"Выполняю операций: {len(ops)}... ⏳")
+
+    async def run_batch():
+        async with ssh_pool.connection(user_id, vm_config) as ssh:
+            return await ssh.execute_batch([batch_command(verb, path) for verb, path in ops])
+
+    try:
+        results = await run_scheduled(reply, user_id, vm_config, run_batch)
+    except QueueFull:
+        await reply.answer(QUEUE_FULL_TEXT)
+        return
+    except paramiko.AuthenticationException:
+        await reply.answer("❌ Ошибка аутентификации. Неверное имя пользователя, пароль или ключ.")
+        return
+    except Exception as e:
+        logger.error("User %s batch error: %s", user_id, e)
+        await reply.answer(f"❌ Ошибка при выполнении команды: {html.escape(str(e))}")
+        return
+
+    sections = []
+    for (verb, path), result in zip(ops, results):
+        if isinstance(result, Exception):
+            ok, output = False, f"Ошибка: {result}"
+        else:
+            stdout, stderr, status = result
+            ok, output = status == 0, stdout if status == 0 else (stderr or f"exit status {status}")
+        sections.append((f"{verb} {path}", ok, output))
+
+    text = "\n\n".join(
+        f"{'✅' if ok else '❌'} <code>{html.escape(title)}</code>\n"
+        + (f"<pre>{html.escape(output)}</pre>" if output else "<i>(пусто)</i>")
+        for title, ok, output in sections
+    )
+    if len(text) <= PAGE_SIZE:
+        await reply.answer(text)
+        return
+    plain = "\n\n".join(f"$ {title}\n{output}" for title, _, output in sections)
+    failed = sum(1 for _, ok, _ in sections if not ok)
+    await reply.answer_document(buffered_document(plain.encode(), "batch.txt"),
+                                caption=f"Операций: {len(sections)}, с ошибкой: {failed}")
+
+
+def _quote_path(path: str) -> str:
+    path = FileOperations.normalize_path(path)
+    # Путь, начинающийся с "-", find принял бы за выражение
+    if path.startswith("-"):
+        path = "./" + path
+    return shlex.quote(path)
+
+
+def find_command(path: str, pattern: str) -> str:
+    return f"find {_quote_path(path)} -name {shlex.quote(pattern)} 2>/dev/null"
+
+
+def grep_command(pattern: str, path: str) -> str:
+    # -I пропускает двоичные файлы, -s скрывает ошибки доступа
+    return f"grep -rnIs -e {shlex.quote(pattern)} -- {_quote_path(path)}"
+
+
+class SearchCap:
+    """Ограничивает поток строк результатов по количеству и объему."""
+
+    def __init__(self, max_results: int = SEARCH_MAX_RESULTS, max_bytes: int = SEARCH_MAX_BYTES):
+        self.max_results = max_results
+        self.max_bytes = max_bytes
+        self.results = 0
+        self.size = 0
+        self.truncated = False
+
+    async def apply(self, lines):
+        async with aclosing(lines):
+            async for line in lines:
+                if len(line) > SEARCH_MAX_LINE:
+                    line = line[:SEARCH_MAX_LINE] + "…"
+                if self.results >= self.max_results or self.size + len(line) + 1 > self.max_bytes:
+                    # Дальше не читаем: закрытие потока останавливает поиск на ВМ
+                    self.truncated = True
+                    return
+                self.results += 1
+                self.size += len(line) + 1
+                yield line + "\n"
+
+
+async def run_search(message: Message, title: str, command: str):
+    """Выполняет поиск на ВМ и отправляет результаты страницами по мере их поступления."""
+    user_id = message.from_user.id
+    vm_config = await vm_config_manager.get_vm_config(user_id)
+    if not vm_config:
+        await message.answer("⚠️ Данные для подключения не найдены. Сначала используйте /vmpath.")
+        return
+
+    reply = ProgressReply(message)
+    await reply.update(f"🔎 <code>{html.escape(title)}</code> ⏳")
+    cap = SearchCap()
+
+    async def search():
+        async with ssh_pool.connection(user_id, vm_config) as ssh:
+            async with ssh.stream_command(command) as proc:
+                pages = iter_html_pages(cap.apply(proc.lines()), by_lines=True)
+                async with aclosing(pages):
+                    async for page in pages:
+                        await reply.notice(f"<pre>{page}</pre>")
+
+    try:
+        await run_scheduled(reply, user_id, vm_config, search)
+    except QueueFull:
+        await reply.answer(QUEUE_FULL_TEXT)
+        return
+    except paramiko.AuthenticationException:
+        await reply.answer("❌ Ошибка аутентификации. Неверное имя пользователя, пароль или ключ.")
+        return
+    except Exception as e:
+        logger.error("User %s search error: %s", user_id, e)
+        await reply.answer(f"❌ Ошибка при выполнении команды: {html.escape(str(e))}")
+        return
+
+    if not cap.results:
+        await reply.notice("Ничего не найдено.")
+    elif cap.truncated:
+        await reply.notice(f"✂️ Показаны первые {cap.results} результатов, поиск остановлен. Уточните запрос.")
+    else:
+        await reply.notice(f"Найдено: {cap.results}")
+
+
+def _split_args(message: Message) -> Optional[List[str]]:
+    try:
+        # Команда может прийти подписью к документу (/put)
+        return shlex.split(message.text or message.caption or "")[1:]
+    except ValueError:
+        return None
+
+
+@router.message(Command("find"))
+async def find_handler(message: Message):
+    args = _split_args(message)
+    if not args or len(args) > 2:
+        await message.answer("Используйте: <code>/find [путь] шаблон</code>\n"
+                             "<i>Пример: /find ~/lab1 '*.py'</i>")
+        return
+    path, pattern = (args[0], args[1]) if len(args) == 2 else (".", args[0])
+    await run_search(message, f"find {path} -name {pattern}", find_command(path, pattern))
+
+
+@router.message(Command("grep"))
+async def grep_handler(message: Message):
+    args = _split_args(message)
+    if not args or len(args) > 2:
+        await message.answer("Используйте: <code>/grep шаблон [путь]</code>\n"
+                             "<i>Пример: /grep 'def main' ~/lab1</i>")
+        return
+    pattern, path = (args[0], args[1]) if len(args) == 2 else (args[0], ".")
+    await run_search(message, f"grep {pattern} {path}", grep_command(pattern, path))
+
+
+async def load_tree(user_id: int, vm_config: VMConfig, path: str, depth: int,
+                    reply: Optional[ProgressReply] = None) -> Tuple[TreeIndex, str]:
+    """
+    Возвращает индекс дерева, покрывающий path на depth уровней вглубь, и путь path внутри него.
+
+    Свежий индекс пользователя используется без обращения к ВМ; устаревший
+    обновляется по mtime директорий, а для пути вне индекса строится новый.
+    """
+    index = tree_cache.get(user_id)
+    rel = index.relative(path) if index else None
+    covers = rel is not None and index.depth_of(rel) + depth <= index.max_depth
+    if covers and index.is_fresh() and index.find(rel) is not None:
+        return index, rel
+
+    async def fetch():
+        async with ssh_pool.connection(user_id, vm_config) as ssh:
+            if covers:
+                fresh = await refresh_index(ssh, index)
             else:
-                await message.answer(f"❌ Ошибка чтения файла:\n<pre>{stderr}</pre>")
+                fresh = await build_index(ssh, path)
+        tree_cache.put(user_id, fresh)
+        return fresh
+
+    index = await run_scheduled(reply, user_id, vm_config, fetch, key=("tree", path))
+    return index, index.relative(path)
+
+
+@router.message(Command("tree"))
+async def tree_handler(message: Message):
+    user_id = message.from_user.id
+    args = _split_args(message)
+    usage = (f"Используйте: <code>/tree [путь] [глубина]</code> (глубина до {TREE_MAX_DEPTH})\n"
+             "<i>Пример: /tree ~/lab1 3</i>")
+    if args is None or len(args) > 2 or (len(args) == 2 and not args[1].isdigit()):
+        await message.answer(usage)
+        return
+    path = args[0] if args else "~"
+    depth = min(max(int(args[1]), 1), TREE_MAX_DEPTH) if len(args) == 2 else TREE_SHOW_DEPTH
+    normalized = posixpath.normpath(FileOperations.normalize_path(path))
+
+    vm_config = await vm_config_manager.get_vm_config(user_id)
+    if not vm_config:
+        await message.answer("⚠️ Данные для подключения не найдены. Сначала используйте /vmpath.")
+        return
+
+    reply = ProgressReply(message)
+    try:
+        index, rel = await load_tree(user_id, vm_config, normalized, depth, reply)
+    except QueueFull:
+        await reply.answer(QUEUE_FULL_TEXT)
+        return
+    except FileNotFoundError:
+        await reply.answer(f"❌ Директория <code>{html.escape(path)}</code> не найдена.")
+        return
     except Exception as e:
-        logger.error(f"User {user_id} cat error: {e}")
-        await message.answer(f"❌ Ошибка при выполнении команды: {e}")
\ No newline at end of file
+        logger.error("User %s tree error: %s", user_id, e)
+        await reply.answer(f"❌ Ошибка при выполнении команды: {html.escape(str(e))}")
+        return
+
+    node = index.find(rel)
+    if node is None or not node.is_dir:
+        await reply.answer(f"❌ Директория <code>{html.escape(path)}</code> не найдена.")
+        return
+    files, dirs, size = index.summary(rel)
+    text = (f"🌳 <code>{html.escape(path)}</code>: файлов {files}, директорий {dirs}, "
+            f"{format_size(size)}")
+    if index.truncated:
+        text += f"\n⚠️ Показаны первые {TREE_MAX_ENTRIES} записей."
+    text += f"\n<pre>{render_tree(index, rel, depth) or '(пусто)'}</pre>"
+    await reply.answer(text)
+
+def tail_command(path: str, lines: int) -> str:
+    # -F продолжает следить за файлом после ротации и ждет его появления
+    return f"tail -n {lines} -F -- {_quote_path(path)}"
+
+
+@router.message(Command("tail"))
+async def tail_handler(message: Message):
+    user_id = message.from_user.id
+    args = _split_args(message)
+    usage = ("Используйте: <code>/tail путь [строк]</code>\n"
+             "<i>Пример: /tail ~/app/build.log 40</i>. Остановить: /stop")
+    if not args or len(args) > 2 or (len(args) == 2 and not args[1].isdigit()):
+        await message.answer(usage)
+        return
+    path = args[0]
+    lines = min(max(int(args[1]), 1), TAIL_MAX_LINES) if len(args) == 2 else TAIL_LINES
+
+    vm_config = await vm_config_manager.get_vm_config(user_id)
+    if not vm_config:
+        await message.answer("⚠️ Данные для подключения не найдены. Сначала используйте /vmpath.")
+        return
+
+    header = f"📡 <code>tail -f {html.escape(path)}</code>"
+    # Сообщение потом редактируется, поэтому его нельзя объединять с соседними
+    status = await exclusive(message.answer(f"{header}\n⏳ Подключаюсь..."))
+
+    @asynccontextmanager
+    async def open_stream():
+        # Планировщик не используется: поток занимает только канал SSH, а не очередь
+        # команд пользователя, и ждет данных без потока исполнителя
+        async with ssh_pool.connection(user_id, vm_config) as ssh:
+            async with ssh.stream_command(tail_command(path, lines), combine_stderr=True) as proc:
+                yield proc
+
+    async def publish(window: str, reason: Optional[str]) -> bool:
+        if reason is None:
+            footer = f"🕒 {time.strftime('%H:%M:%S')} · остановить: /stop"
+        else:
+            footer = f"⏹ Остановлено: {STOP_REASONS.get(reason, reason)}"
+        try:
+            await status.edit_text(f"{header}\n<pre>{window or '…'}</pre>\n{footer}")
+        except TelegramBadRequest as e:
+            if "not modified" in str(e):
+                return True
+            logger.info("User %s tail message cannot be edited: %s", user_id, e)
+            return False
+        return True
+
+    logger.info("User %s started tail of %s", user_id, path)
+    tail_sessions.start(user_id, TailSession(open_stream, publish, lines=lines))
+
+
+@router.message(Command("stop"))
+async def stop_handler(message: Message):
+    # Сообщение /tail само покажет, что наблюдение остановлено
+    if not tail_sessions.stop(message.from_user.id):
+        await message.answer("Нет активного /tail.")
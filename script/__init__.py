@@ -3,6 +3,7 @@
 """
 
 import sys
+import importlib
 from pathlib import Path
 
 # Добавляем корневую директорию проекта в sys.path
@@ -10,10 +11,31 @@ from pathlib import Path
 project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
 
-from .classes import FileOperations, VMConfigManager, SSHConnection
-from .db import init_db, get_db_session, User
+# Имя -> модуль пакета. Модули импортируются при первом обращении к имени
+# (PEP 562), поэтому "import script.db" не тянет paramiko и aiogram
+_EXPORTS = {
+    'FileOperations': 'classes', 'VMConfig': 'classes', 'VMConfigManager': 'classes', 'SSHConnection': 'classes',
+    'SSHConnectionPool': 'pool', 'ssh_pool': 'pool',
+    'SSHExecutor': 'executor', 'ssh_executor': 'executor',
+    'init_db': 'db', 'get_db_session': 'db', 'User': 'db',
+    'UserCache': 'users', 'UserProfile': 'users', 'user_cache': 'users',
+}
 
 __all__ = [
-    'FileOperations', 'VMConfigManager', 'SSHConnection',
-    'init_db', 'get_db_session', 'User'
-] 
\ No newline at end of file
+    'FileOperations', 'VMConfig', 'VMConfigManager', 'SSHConnection',
+    'SSHConnectionPool', 'ssh_pool', 'SSHExecutor', 'ssh_executor',
+    'init_db', 'get_db_session', 'User',
+    'UserCache', 'UserProfile', 'user_cache'
+]
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
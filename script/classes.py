@@ -1,24 +1,222 @@
-import paramiko
+import os
+import time
+import codecs
 import logging
+import functools
 import asyncio
-from typing import List, Dict, Optional
+import stat
+from dataclasses import dataclass, field
+from contextlib import aclosing, asynccontextmanager
+from typing import TYPE_CHECKING, Any, AsyncIterator, List, Dict, Optional, Tuple
 from pathlib import Path
 from .db import User
+from .executor import ssh_executor
+from .streaming import decode_utf8_stream, read_ahead
+from .cache import MISSING, TTLCache
+from .metrics import db_duration, ssh_errors, ssh_phase, ssh_phase_duration
+from .logs import shorten
+from .lazy import LazyModule
+from .keys import key_cache, load_private_key
+from . import db
 from sqlalchemy.future import select
 from sqlalchemy.exc import SQLAlchemyError
 
+if TYPE_CHECKING:
+    import paramiko
+else:
+    # paramiko с криптографией импортируется при первом подключении к ВМ
+    paramiko = LazyModule("paramiko")
+
 logger = logging.getLogger(__name__)
 
+VM_CONFIG_CACHE_SIZE = int(os.getenv("VM_CONFIG_CACHE_SIZE", "1024"))
+VM_CONFIG_CACHE_TTL = float(os.getenv("VM_CONFIG_CACHE_TTL", "300"))
+# Сколько секунд потоковая команда может молчать, прежде чем чтение прервется
+STREAM_IDLE_TIMEOUT = float(os.getenv("STREAM_IDLE_TIMEOUT", "60"))
+# Передача файлов по SFTP: сколько блоков запрашивается сразу, не дожидаясь ответов,
+# и сколько таких окон может ждать отправки (память на передачу - примерно окно * (очередь + 2))
+SFTP_WINDOW_CHUNKS = int(os.getenv("SFTP_WINDOW_CHUNKS", "16"))
+SFTP_QUEUE_WINDOWS = int(os.getenv("SFTP_QUEUE_WINDOWS", "2"))
+
+
+class CommandStream:
+    """
+    Вывод удаленной команды, читаемый построчно по мере поступления.
+
+    Строки stdout отдаются сразу, не дожидаясь завершения команды; stderr
+    накапливается не больше stderr_limit байт. Закрытие потока закрывает
+    канал, и удаленная команда завершается (SIGPIPE при следующей записи).
+
+    Ожидание вывода идет в event loop, а не в потоке SSHExecutor: молчащая
+    команда (долгий find или grep) не занимает слот хоста.
+    """
+
+    def __init__(self, connection: "SSHConnection", channel: "paramiko.Channel",
+                 chunk_size: int = 32768, stderr_limit: int = 4096,
+                 idle_timeout: Optional[float] = STREAM_IDLE_TIMEOUT):
+        self.connection = connection
+        self.channel = channel
+        self.chunk_size = chunk_size
+        self.stderr_limit = stderr_limit
+        self.idle_timeout = idle_timeout
+        self._stderr = b""
+        self.exit_status: Optional[int] = None
+
+    @property
+    def stderr(self) -> str:
+        return self._stderr.decode('utf-8', errors='replace').strip()
+
+    def _recv(self) -> bytes:
+        data = self.channel.recv(self.chunk_size)
+        # stderr вычитываем попутно, иначе он займет окно канала и stdout остановится
+        self._recv_stderr()
+        return data
+
+    def _recv_stderr(self):
+        while self.channel.recv_stderr_ready():
+            err = self.channel.recv_stderr(self.chunk_size)
+            if len(self._stderr) < self.stderr_limit:
+                self._stderr += err[:self.stderr_limit - len(self._stderr)]
+
+    async def lines(self) -> AsyncIterator[str]:
+        """
+        Строки stdout без завершающего перевода строки.
+
+        После того как команда закончила вывод, заполняется exit_status.
+
+        Raises:
+            asyncio.TimeoutError: Команда молчала дольше idle_timeout секунд
+        """
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        buffer = ""
+        while True:
+            # Канал готов, поэтому recv не блокирует event loop
+            data = self._recv() if await self._wait_ready(self.idle_timeout) else b""
+            if not data:
+                break
+            buffer += decoder.decode(data)
+            *complete, buffer = buffer.split("\n")
+            for line in complete:
+                yield line
+        buffer += decoder.decode(b"", final=True)
+        if buffer:
+            yield buffer
+        if self.channel.exit_status_ready():
+            self.exit_status = self.channel.recv_exit_status()
+        else:
+            self.exit_status = await self.connection.run_blocking(self.channel.recv_exit_status)
+
+    async def _wait_ready(self, timeout: Optional[float]) -> bool:
+        """
+        Ждет данных в канале по channel.fileno() через event loop.
+
+        Returns:
+            bool: True - есть данные для recv, False - команда закончила вывод
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            self._recv_stderr()
+            if self.channel.recv_ready():
+                return True
+            if self.channel.eof_received or self.channel.closed:
+                return False
+            ready = loop.create_future()
+            fd = self.channel.fileno()
+            loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+            try:
+                await asyncio.wait_for(ready, timeout)
+            finally:
+                loop.remove_reader(fd)
+
+    async def read_available(self, timeout: Optional[float] = None, limit: int = 262144) -> bytes:
+        """
+        Ждет вывода, не занимая поток исполнителя, и возвращает все, что уже пришло.
+
+        Готовность канала отслеживается event loop по channel.fileno(), поэтому
+        долгое ожидание (как у tail -F) не держит поток пула SSHExecutor.
+
+        Args:
+            timeout (float | None): Сколько секунд ждать новых данных
+            limit (int): Максимум байт за один вызов
+
+        Returns:
+            bytes: Новые данные; b"" - команда закончила вывод
+
+        Raises:
+            asyncio.TimeoutError: Данных не было timeout секунд
+        """
+        if not await self._wait_ready(timeout):
+            return b""
+        data = b""
+        while len(data) < limit and self.channel.recv_ready():
+            data += self._recv()
+        return data
+
+    async def close(self):
+        await self.connection.run_blocking(self.channel.close)
+
+
+@functools.lru_cache(maxsize=None)
+def _timed_transport_class():
+    """Класс Transport создается при первом подключении, чтобы не импортировать paramiko заранее."""
+
+    def timed(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self.auth_seconds += time.perf_counter() - started
+        return wrapper
+
+    class _TimedTransport(paramiko.Transport):
+        """Transport, суммирующий длительность попыток аутентификации внутри SSHClient.connect()."""
+        auth_seconds = 0.0
+
+    for name in ("auth_none", "auth_password", "auth_publickey", "auth_interactive", "auth_interactive_dumb"):
+        setattr(_TimedTransport, name, timed(getattr(paramiko.Transport, name)))
+    return _TimedTransport
+
+
 class SSHConnection:
-    def __init__(self, host, port=22, username=None, password=None, key_filepath=None, key_password=None):
+    def __init__(self, host, port=22, username=None, password=None, key_filepath=None, key_password=None,
+                 keepalive_interval=0, executor=None, key_data=None, key_type=None):
         self.host = host
         self.port = port
         self.username = username
         self.password = password
         self.key_filepath = key_filepath
-        self.key_password = key_password
+        self.key_password = key_password  # пароль (passphrase) закрытого ключа
+        self.key_data = key_data          # текст закрытого ключа; альтернатива key_filepath
+        self.key_type = key_type          # тип ключа из script.keys.KEY_CLASSES, если известен
+        self.keepalive_interval = keepalive_interval
+        self.executor = executor or ssh_executor
         self.client = None
         self.transport = None
+        self.sftp = None
+        self._sftp_lock = None
+
+    async def run_blocking(self, func, *args, **kwargs):
+        """Выполняет блокирующий вызов paramiko в SSH-исполнителе с учетом лимита хоста."""
+        return await self.executor.run(self.host, func, *args, **kwargs)
+
+    def is_alive(self) -> bool:
+        """Проверяет, что SSH-транспорт установлен и активен."""
+        return bool(self.client and self.transport and self.transport.is_active())
+
+    async def get_sftp(self) -> "paramiko.SFTPClient":
+        """Возвращает SFTP-клиент подключения, открывая его при первом обращении."""
+        if not self.is_alive():
+            raise paramiko.SSHException("Not connected to SSH server. Please connect first.")
+        if self._sftp_lock is None:
+            self._sftp_lock = asyncio.Lock()
+        async with self._sftp_lock:
+            if self.sftp is None or self.sftp.sock.closed:
+                logger.info("Opening SFTP session to %s", self.host)
+                with ssh_phase("sftp_open", self.host):
+                    self.sftp = await self.run_blocking(self.client.open_sftp)
+        return self.sftp
 
     def _connect_with_password(self):
         self.client.connect(
@@ -26,64 +224,78 @@ class SSHConnection:
             port=self.port,
             username=self.username,
             password=self.password,
-            timeout=10
+            timeout=10,
+            transport_factory=_timed_transport_class()
         )
 
-    def _connect_with_key(self):
-        pkey = None
-        if self.key_filepath:
-            key_types = [paramiko.RSAKey, paramiko.DSSKey, paramiko.ECDSAKey, paramiko.Ed25519Key]
-            for key_type in key_types:
-                try:
-                    pkey = key_type.from_private_key_file(self.key_filepath, password=self.key_password)
-                    break
-                except paramiko.SSHException:
-                    continue
-            if not pkey:
-                raise paramiko.SSHException(f"Unable to load private key: {self.key_filepath}")
-        
+    async def _private_key(self) -> "paramiko.PKey":
+        """
+        Закрытый ключ подключения. Разобранные ключи берутся из script.keys.key_cache,
+        поэтому повторные подключения не перебирают форматы и не расшифровывают ключ заново.
+        """
+        data = self.key_data
+        if data is None:
+            data = await self.run_blocking(Path(self.key_filepath).read_text)
+
+        async def load():
+            with ssh_phase("key_load", self.host):
+                return await self.run_blocking(load_private_key, data, self.key_type, self.key_password)
+
+        return await key_cache.get(data, self.key_password, load)
+
+    def _connect_with_key(self, pkey: "paramiko.PKey"):
         self.client.connect(
             hostname=self.host,
             port=self.port,
             username=self.username,
             pkey=pkey,
-            timeout=10
+            timeout=10,
+            look_for_keys=False,
+            allow_agent=False,
+            transport_factory=_timed_transport_class()
         )
 
     async def connect(self):
         if self.client and self.client.get_transport() and self.client.get_transport().is_active():
-            logger.info(f"Already connected to {self.host}")
+            logger.info("Already connected to %s", self.host)
             return True
 
         self.client = paramiko.SSHClient()
         self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
 
         try:
-            logger.info(f"Attempting to connect to {self.host}:{self.port} as {self.username}")
-            if self.password:
-                logger.info(f"Connecting to {self.host} using password authentication.")
-                await asyncio.to_thread(self._connect_with_password)
-            elif self.key_filepath:
-                logger.info(f"Connecting to {self.host} using key authentication.")
-                await asyncio.to_thread(self._connect_with_key)
-            else:
-                raise ValueError("Password must be provided for authentication as per project requirements (key_filepath is optional).")
-            
+            logger.info("Attempting to connect to %s:%s as %s", self.host, self.port, self.username)
+            # connect - полное время подключения, auth - его часть, ушедшая на аутентификацию
+            with ssh_phase("connect", self.host):
+                if self.password:
+                    logger.info("Connecting to %s using password authentication.", self.host)
+                    await self.run_blocking(self._connect_with_password)
+                elif self.key_data or self.key_filepath:
+                    logger.info("Connecting to %s using key authentication.", self.host)
+                    pkey = await self._private_key()
+                    await self.run_blocking(self._connect_with_key, pkey)
+                else:
+                    raise ValueError("Password or private key must be provided for authentication.")
             self.transport = self.client.get_transport()
-            logger.info(f"Successfully connected to {self.host}")
+            ssh_phase_duration.observe(self.transport.auth_seconds, phase="auth", host=self.host)
+
+            if self.keepalive_interval:
+                self.transport.set_keepalive(self.keepalive_interval)
+            logger.info("Successfully connected to %s", self.host)
             return True
         except paramiko.AuthenticationException:
-            logger.error(f"Authentication failed for {self.username}@{self.host}")
+            logger.error("Authentication failed for %s@%s", self.username, self.host)
+            ssh_errors.inc(phase="auth", host=self.host)
             self.client = None
             self.transport = None
             raise
         except paramiko.SSHException as e:
-            logger.error(f"SSH connection failed for {self.host}: {e}")
+            logger.error("SSH connection failed for %s: %s", self.host, e)
             self.client = None
             self.transport = None
             raise
         except Exception as e:
-            logger.error(f"An unexpected error occurred during connection to {self.host}: {e}")
+            logger.error("An unexpected error occurred during connection to %s: %s", self.host, e)
             if self.client:
                 self.client.close()
             self.client = None
@@ -91,44 +303,118 @@ class SSHConnection:
             raise
 
     def disconnect(self):
+        if self.sftp:
+            try:
+                self.sftp.close()
+            except Exception as e:
+                logger.warning("Error while closing SFTP session to %s: %s", self.host, e)
+            self.sftp = None
         if self.client:
-            logger.info(f"Disconnecting from {self.host}")
+            logger.info("Disconnecting from %s", self.host)
             self.client.close()
             self.client = None
             self.transport = None
         else:
             logger.info("Not connected, no need to disconnect.")
 
-    async def execute_command(self, command):
+    def _ensure_connected(self):
         if not self.client or not self.transport or not self.transport.is_active():
             logger.error("Cannot execute command: Not connected.")
             raise paramiko.SSHException("Not connected to SSH server. Please connect first.")
 
+    def _exec(self, command: str):
+        """Выполняет команду в отдельном канале (блокирующий вызов, только вне event loop)."""
+        stdin, stdout, stderr = self.client.exec_command(command, timeout=15)
+        # Сначала вычитываем вывод: иначе при большом выводе канал упрется в окно и
+        # recv_exit_status() будет ждать вечно
+        stdout_data = stdout.read().decode('utf-8', errors='replace').strip()
+        stderr_data = stderr.read().decode('utf-8', errors='replace').strip()
+        exit_status = stdout.channel.recv_exit_status()
+        return stdout_data, stderr_data, exit_status
+
+    async def _timed_exec(self, command: str):
+        with ssh_phase("exec", self.host):
+            return await self.run_blocking(self._exec, command)
+
+    async def execute_command(self, command):
+        self._ensure_connected()
+
         try:
-            logger.info(f"Executing command on {self.host}: {command}")
-            def _exec():
-                stdin, stdout, stderr = self.client.exec_command(command, timeout=15)
-                exit_status = stdout.channel.recv_exit_status()
-                return (
-                    stdout.read().decode('utf-8', errors='replace').strip(),
-                    stderr.read().decode('utf-8', errors='replace').strip(),
-                    exit_status
-                )
-            
-            stdout_data, stderr_data, exit_status = await asyncio.to_thread(_exec)
+            logger.info("Executing command on %s: %s", self.host, shorten(command))
+            stdout_data, stderr_data, exit_status = await self._timed_exec(command)
             
-            logger.debug(f"Command '{command}' exit_status: {exit_status}")
-            logger.debug(f"Command '{command}' STDOUT: {stdout_data}")
-            logger.debug(f"Command '{command}' STDERR: {stderr_data}")
+            logger.debug("Command '%s' exit_status: %s", shorten(command), exit_status)
+            logger.debug("Command '%s' STDOUT: %s", shorten(command), shorten(stdout_data))
+            logger.debug("Command '%s' STDERR: %s", shorten(command), shorten(stderr_data))
 
             return stdout_data, stderr_data, exit_status
         except paramiko.SSHException as e:
-            logger.error(f"Failed to execute command '{command}' on {self.host}: {e}")
+            logger.error("Failed to execute command '%s' on %s: %s", shorten(command), self.host, e)
             raise
         except Exception as e:
-            logger.error(f"An unexpected error occurred while executing command '{command}' on {self.host}: {e}")
+            logger.error("An unexpected error occurred while executing command '%s' on %s: %s",
+                         shorten(command), self.host, e)
             raise
 
+    async def execute_batch(self, commands: List[str]) -> List[Tuple[str, str, int] | Exception]:
+        """
+        Выполняет несколько команд одновременно в отдельных каналах одного SSH-транспорта.
+        
+        Каналы открываются параллельно (не больше лимита исполнителя на хост),
+        поэтому общее время близко к времени самой долгой команды, а не к сумме.
+        
+        Args:
+            commands (List[str]): Команды
+            
+        Returns:
+            List[Tuple[str, str, int] | Exception]: Для каждой команды (stdout, stderr, код
+                возврата) или ошибка, с которой она завершилась, в порядке commands
+        """
+        self._ensure_connected()
+        logger.info("Executing batch of %s commands on %s", len(commands), self.host)
+        results = await asyncio.gather(*(self._timed_exec(command) for command in commands),
+                                       return_exceptions=True)
+        for command, result in zip(commands, results):
+            if isinstance(result, BaseException) and not isinstance(result, Exception):
+                raise result
+            if isinstance(result, Exception):
+                logger.error("Batch command '%s' failed on %s: %s", shorten(command), self.host, result)
+        return list(results)
+
+    @asynccontextmanager
+    async def stream_command(self, command: str, idle_timeout: float = STREAM_IDLE_TIMEOUT,
+                             combine_stderr: bool = False):
+        """
+        Запускает команду и отдает ее вывод построчно, не собирая его целиком.
+        
+        Пример:
+            async with ssh.stream_command("find . -name '*.py'") as proc:
+                async for line in proc.lines():
+                    ...
+        
+        Args:
+            command (str): Команда (аргументы должны быть уже экранированы)
+            idle_timeout (float): Сколько секунд можно ждать очередной порции вывода
+            combine_stderr (bool): Отдавать stderr вместе с stdout, в порядке поступления
+        """
+        self._ensure_connected()
+        logger.info("Streaming command on %s: %s", self.host, shorten(command))
+
+        def _open():
+            channel = self.transport.open_session()
+            channel.settimeout(idle_timeout)
+            channel.set_combine_stderr(combine_stderr)
+            channel.exec_command(command)
+            return channel
+
+        with ssh_phase("exec_open", self.host):
+            channel = await self.run_blocking(_open)
+        stream = CommandStream(self, channel, idle_timeout=idle_timeout)
+        try:
+            yield stream
+        finally:
+            await stream.close()
+
     async def __aenter__(self):
         await self.connect()
         return self
@@ -136,80 +422,192 @@ class SSHConnection:
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         self.disconnect()
 
+@dataclass(frozen=True, slots=True)
+class VMConfig:
+    """Параметры подключения пользователя к ВМ: пароль или закрытый ключ."""
+    host: str
+    port: int
+    username: str
+    password: Optional[str]
+    key: Optional[str] = field(default=None, repr=False)
+    key_type: Optional[str] = None
+    key_passphrase: Optional[str] = field(default=None, repr=False)
+
+    @classmethod
+    def from_row(cls, row) -> Optional["VMConfig"]:
+        """VMConfig из строки запроса с полями vm_* таблицы users или None, если данных нет."""
+        if not row.vm_host or not row.vm_username:
+            return None
+        return cls(row.vm_host, row.vm_port or 22, row.vm_username, row.vm_password,
+                   row.vm_key, row.vm_key_type, row.vm_key_passphrase)
+
+    def as_dict(self) -> dict:
+        """Аргументы для SSHConnection(**config.as_dict())."""
+        args = {"host": self.host, "port": self.port, "username": self.username, "password": self.password}
+        if self.key:
+            args.update(key_data=self.key, key_type=self.key_type, key_password=self.key_passphrase)
+        return args
+
+
+# Колонки users, из которых собирается VMConfig.from_row
+VM_CONFIG_COLUMNS = (User.vm_host, User.vm_port, User.vm_username, User.vm_password,
+                     User.vm_key, User.vm_key_type, User.vm_key_passphrase)
+
+
 class VMConfigManager:
-    def __init__(self, session_maker):
-        self.async_session = session_maker
+    def __init__(self, session_maker=None, ssh_pool=None, user_cache=None, cache_size: int = VM_CONFIG_CACHE_SIZE,
+                 cache_ttl: float = VM_CONFIG_CACHE_TTL):
+        # None - script.db.async_session на момент вызова (БД инициализируется после импорта модулей)
+        self._session_maker = session_maker
+        self.ssh_pool = ssh_pool
+        self.user_cache = user_cache
+        # user_id -> VMConfig | None (None тоже кэшируется, чтобы не ходить в БД за отсутствующими данными)
+        self.cache = TTLCache(cache_size, cache_ttl)
+
+    @property
+    def async_session(self):
+        return self._session_maker or db.async_session
 
     async def save_vm_config(self, user_id: int, host: str, port: int, username: str, password: str) -> bool:
         """Saves or updates VM connection parameters for a given user_id."""
+        with db_duration.time(operation="save_vm_config"):
+            return await self._save_vm_config(user_id, VMConfig(host, port or 22, username, password))
+
+    async def save_vm_key(self, user_id: int, host: str, port: int, username: str, key: str, key_type: str,
+                          passphrase: Optional[str] = None) -> bool:
+        """
+        Сохраняет подключение по закрытому ключу; пароль ВМ при этом сбрасывается.
+
+        Args:
+            user_id (int): ID пользователя
+            host (str): Хост ВМ
+            port (int): Порт SSH
+            username (str): Пользователь на ВМ
+            key (str): Текст закрытого ключа
+            key_type (str): Тип ключа из script.keys.KEY_CLASSES
+            passphrase (str | None): Пароль ключа, если он зашифрован
+
+        Returns:
+            bool: Удалось ли сохранить
+        """
+        with db_duration.time(operation="save_vm_key"):
+            config = VMConfig(host, port or 22, username, None, key, key_type, passphrase)
+            return await self._save_vm_config(user_id, config)
+
+    async def _save_vm_config(self, user_id: int, config: VMConfig) -> bool:
         async with self.async_session() as session:
             async with session.begin():
                 try:
                     user = await session.get(User, user_id)
                     if not user:
-                        logger.error(f"User with ID {user_id} not found. Cannot save VM config.")
+                        logger.error("User with ID %s not found. Cannot save VM config.", user_id)
                         return False
 
-                    user.vm_host = host
-                    user.vm_port = port
-                    user.vm_username = username
-                    user.vm_password = password
-                    
+                    credentials_changed = VMConfig.from_row(user) != config
+                    user.vm_host = config.host
+                    user.vm_port = config.port
+                    user.vm_username = config.username
+                    user.vm_password = config.password
+                    user.vm_key = config.key
+                    user.vm_key_type = config.key_type
+                    user.vm_key_passphrase = config.key_passphrase
+
                     session.add(user)
                     await session.commit()
-                    logger.info(f"VM configuration saved for user ID {user_id}.")
+                    logger.info("VM configuration saved for user ID %s.", user_id)
+                    self.cache.set(user_id, config)
+                    if self.user_cache is not None:
+                        self.user_cache.invalidate(user_id)
+                    if credentials_changed and self.ssh_pool is not None:
+                        await self.ssh_pool.invalidate_user(user_id)
                     return True
                 except SQLAlchemyError as e:
                     await session.rollback()
-                    logger.error(f"Database error while saving VM config for user {user_id}: {e}")
+                    self.cache.pop(user_id)
+                    logger.error("Database error while saving VM config for user %s: %s", user_id, e)
                     return False
                 except Exception as e:
                     await session.rollback()
-                    logger.error(f"Unexpected error while saving VM config for user {user_id}: {e}")
+                    self.cache.pop(user_id)
+                    logger.error("Unexpected error while saving VM config for user %s: %s", user_id, e)
                     return False
 
-    async def get_vm_config(self, user_id: int) -> dict | None:
-        """Retrieves VM connection parameters for a given user_id."""
-        async with self.async_session() as session:
-            try:
-                result = await session.execute(select(User).where(User.userid == user_id))
-                user = result.scalar_one_or_none()
-
-                if user and user.vm_host and user.vm_username:
-                    logger.info(f"VM configuration retrieved for user ID {user_id}.")
-                    return {
-                        "host": user.vm_host,
-                        "port": user.vm_port or 22,
-                        "username": user.vm_username,
-                        "password": user.vm_password
-                    }
-                else:
-                    logger.warning(f"VM configuration not found or incomplete for user ID {user_id}.")
+    async def get_vm_config(self, user_id: int) -> VMConfig | None:
+        """Retrieves VM connection parameters for a given user_id (read-through cache)."""
+        cached = self.cache.get(user_id)
+        if cached is not MISSING:
+            return cached
+
+        with db_duration.time(operation="get_vm_config"):
+            async with self.async_session() as session:
+                try:
+                    result = await session.execute(
+                        select(*VM_CONFIG_COLUMNS).where(User.userid == user_id)
+                    )
+                    row = result.one_or_none()
+
+                    config = VMConfig.from_row(row) if row else None
+                    if config:
+                        logger.info("VM configuration retrieved for user ID %s.", user_id)
+                    else:
+                        logger.warning("VM configuration not found or incomplete for user ID %s.", user_id)
+                        config = None
+                    self.cache.set(user_id, config)
+                    return config
+                except SQLAlchemyError as e:
+                    logger.error("Database error while retrieving VM config for user %s: %s", user_id, e)
+                    return None
+                except Exception as e:
+                    logger.error("Unexpected error while retrieving VM config for user %s: %s", user_id, e)
                     return None
-            except SQLAlchemyError as e:
-                logger.error(f"Database error while retrieving VM config for user {user_id}: {e}")
-                return None
-            except Exception as e:
-                logger.error(f"Unexpected error while retrieving VM config for user {user_id}: {e}")
-                return None
+
+    def invalidate(self, user_id: int):
+        """Сбрасывает закэшированные данные ВМ пользователя (например, после регистрации)."""
+        self.cache.pop(user_id)
 
 class FileOperations:
     """
     Класс для работы с файловой системой через SSH.
     Обеспечивает функционал для просмотра содержимого директорий и чтения текстовых файлов.
     """
+
+    CHUNK_SIZE = 32768
     
-    def __init__(self, ssh_client: paramiko.SSHClient):
+    def __init__(self, connection: SSHConnection):
         """
         Инициализация класса FileOperations.
         
         Args:
-            ssh_client (paramiko.SSHClient): Клиент SSH для подключения к удаленной машине
+            connection (SSHConnection): Установленное SSH-подключение к удаленной машине
         """
-        self.ssh = ssh_client
+        self.connection = connection
         self.logger = logging.getLogger(__name__)
+
+    @staticmethod
+    def normalize_path(path: str) -> str:
+        """SFTP не раскрывает "~", а относительные пути и так считаются от домашней директории."""
+        if path == "~":
+            return "."
+        if path.startswith("~/"):
+            return path[2:] or "."
+        return path
+
+    @staticmethod
+    def _entry(attr: "paramiko.SFTPAttributes") -> Dict[str, Any]:
+        return {
+            'name': attr.filename,
+            'type': 'directory' if stat.S_ISDIR(attr.st_mode) else 'file',
+            'size': attr.st_size,
+            'mtime': attr.st_mtime,
+            'mode': attr.st_mode,
+        }
+
+    async def _run_sftp(self, method: str, *args):
+        """Вызывает метод общего SFTP-клиента подключения вне event loop."""
+        sftp = await self.connection.get_sftp()
+        return await self.connection.run_blocking(getattr(sftp, method), *args)
         
-    async def list_directory(self, path: str = ".") -> List[Dict[str, str]]:
+    async def list_directory(self, path: str = ".") -> List[Dict[str, Any]]:
         """
         Получение списка файлов в указанной директории.
         
@@ -217,44 +615,262 @@ class FileOperations:
             path (str): Путь к директории (по умолчанию текущая)
             
         Returns:
-            List[Dict[str, str]]: Список словарей с информацией о файлах
+            List[Dict[str, Any]]: Список словарей с информацией о файлах
+                (name, type, size, mtime, mode)
         """
         try:
-            sftp = self.ssh.open_sftp()
-            files = []
-            for attr in sftp.listdir_attr(path):
-                files.append({
-                    'name': attr.filename,
-                    'type': 'directory' if paramiko.sftp_client.S_ISDIR(attr.st_mode) else 'file',
-                    'size': str(attr.st_size),
-                })
-            sftp.close()
-            return files
-            
+            attrs = await self._run_sftp('listdir_attr', self.normalize_path(path))
+            return [self._entry(attr) for attr in attrs]
         except Exception as e:
-            self.logger.error(f"Error in list_directory: {str(e)}")
+            self.logger.error("Error in list_directory: %s", e)
             raise
+
+    async def stat(self, path: str) -> "paramiko.SFTPAttributes":
+        """
+        Получение атрибутов файла (размер, тип, время изменения).
+        
+        Args:
+            path (str): Путь к файлу
+            
+        Returns:
+            paramiko.SFTPAttributes: Атрибуты файла
+        """
+        return await self._run_sftp('stat', self.normalize_path(path))
+
+    async def stat_many(self, paths: List[str]) -> Dict[str, Optional["paramiko.SFTPAttributes"]]:
+        """
+        Получение атрибутов нескольких файлов за один вызов.
+        
+        Args:
+            paths (List[str]): Пути к файлам
+            
+        Returns:
+            Dict[str, Optional[paramiko.SFTPAttributes]]: Атрибуты по каждому пути
+                (None, если файл недоступен)
+        """
+        results = await asyncio.gather(*(self.stat(path) for path in paths), return_exceptions=True)
+        stats = {}
+        for path, result in zip(paths, results):
+            if isinstance(result, OSError):
+                stats[path] = None
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                stats[path] = result
+        return stats
+
+    async def list_directories(self, paths: List[str]) -> Dict[str, List[Dict[str, Any]] | Exception]:
+        """
+        Получение содержимого нескольких директорий за один вызов.
+        
+        Args:
+            paths (List[str]): Пути к директориям
+            
+        Returns:
+            Dict[str, List[Dict[str, Any]] | Exception]: Содержимое каждой директории
+                или ошибка, из-за которой ее не удалось прочитать
+        """
+        results = await asyncio.gather(*(self.list_directory(path) for path in paths), return_exceptions=True)
+        listings = {}
+        for path, result in zip(paths, results):
+            if isinstance(result, BaseException) and not isinstance(result, OSError):
+                raise result
+            listings[path] = result
+        return listings
+
+    async def read_file_chunks(self, file_path: str, offset: int = 0, length: Optional[int] = None,
+                               chunk_size: int = CHUNK_SIZE) -> AsyncIterator[bytes]:
+        """
+        Потоковое чтение файла по SFTP блоками фиксированного размера.
+        
+        Args:
+            file_path (str): Путь к файлу
+            offset (int): Смещение от начала файла в байтах
+            length (Optional[int]): Сколько байт прочитать (None - до конца файла)
+            chunk_size (int): Размер блока чтения
             
-    async def read_text_file(self, file_path: str) -> str:
+        Yields:
+            bytes: Очередной блок данных
         """
-        Чтение содержимого текстового файла.
+        run = self.connection.run_blocking
+        f = await self._run_sftp('open', self.normalize_path(file_path), 'rb')
+        try:
+            if offset:
+                f.seek(offset)
+            remaining = length
+            while remaining is None or remaining > 0:
+                size = chunk_size if remaining is None else min(chunk_size, remaining)
+                data = await run(f.read, size)
+                if not data:
+                    break
+                if remaining is not None:
+                    remaining -= len(data)
+                yield data
+        finally:
+            await run(f.close)
+            
+    async def read_file_prefetched(self, file_path: str, offset: int = 0, length: Optional[int] = None,
+                                   chunk_size: int = CHUNK_SIZE,
+                                   window: int = SFTP_WINDOW_CHUNKS) -> AsyncIterator[bytes]:
+        """
+        Потоковое чтение файла по SFTP с упреждающими запросами.
+        
+        Запросы на window блоков отправляются сразу, не дожидаясь ответов (readv),
+        а следующее окно читается, пока предыдущее передается дальше. Очередь окон
+        ограничена SFTP_QUEUE_WINDOWS, поэтому память не зависит от размера файла.
         
         Args:
             file_path (str): Путь к файлу
+            offset (int): Смещение от начала файла в байтах
+            length (Optional[int]): Сколько байт прочитать (None - до конца файла)
+            chunk_size (int): Размер одного запроса SFTP
+            window (int): Число запросов в одном окне
+            
+        Yields:
+            bytes: Очередное окно данных (до chunk_size * window байт)
+        """
+        async def windows():
+            run = self.connection.run_blocking
+            f = await self._run_sftp('open', self.normalize_path(file_path), 'rb')
+            try:
+                # Запросы за концом файла SFTP-сервер отклоняет, поэтому читаем до его размера
+                end = (await run(f.stat)).st_size
+                if length is not None:
+                    end = min(end, offset + length)
+                position = offset
+                while position < end:
+                    stop = min(position + chunk_size * window, end)
+                    chunks = [(start, min(chunk_size, stop - start))
+                              for start in range(position, stop, chunk_size)]
+                    # Одно обращение к исполнителю на окно, а не на каждый блок
+                    data = await run(lambda: b"".join(f.readv(chunks)))
+                    if not data:
+                        break
+                    position += len(data)
+                    yield data
+            finally:
+                await run(f.close)
+
+        async with aclosing(read_ahead(windows(), SFTP_QUEUE_WINDOWS)) as data:
+            async for piece in data:
+                yield piece
+
+    async def write_file(self, file_path: str, chunks: AsyncIterator[bytes]) -> int:
+        """
+        Потоковая запись файла по SFTP.
+        
+        Данные пишутся во временный файл "<путь>.part" без ожидания подтверждения
+        каждого запроса (pipelined); подтверждения собираются при закрытии файла,
+        после чего он переименовывается в file_path. При ошибке временный файл
+        удаляется, а прежнее содержимое file_path не меняется.
+        
+        Args:
+            file_path (str): Путь к файлу
+            chunks (AsyncIterator[bytes]): Источник данных
             
         Returns:
-            str: Содержимое файла
+            int: Число записанных байт
         """
+        run = self.connection.run_blocking
+        sftp = await self.connection.get_sftp()
+        path = self.normalize_path(file_path)
+        partial = path + ".part"
+        f = await run(sftp.open, partial, 'wb')
+        written = 0
+        closed = False
         try:
-            sftp = self.ssh.open_sftp()
-            with sftp.open(file_path, 'r') as f:
-                # Проверяем, что файл текстовый, прежде чем читать
-                if not f.read(1024).isascii():
-                     raise ValueError("File is not a text file")
-                f.seek(0)
-                content = f.read().decode('utf-8')
-            sftp.close()
-            return content
+            f.set_pipelined(True)
+            async with aclosing(chunks):
+                async for chunk in chunks:
+                    await run(f.write, chunk)
+                    written += len(chunk)
+            # Повторный close после ошибки подтверждений ничего не даст
+            closed = True
+            await run(f.close)
+            await self._replace(partial, path)
+        except BaseException as e:
+            self.logger.error("Error writing file %s: %s", file_path, e)
+            cleanups = [functools.partial(sftp.remove, partial)]
+            if not closed:
+                cleanups.insert(0, f.close)
+            for cleanup in cleanups:
+                try:
+                    await run(cleanup)
+                except Exception as cleanup_error:
+                    self.logger.warning("Cannot clean up %s: %s", partial, cleanup_error)
+            raise
+        return written
+
+    async def _replace(self, source: str, target: str):
+        """
+        Переименовывает source в target, заменяя существующий файл.
+        
+        Если сервер не поддерживает расширение posix-rename, target сначала
+        переименовывается в "<source>.old" (SFTPv3 не переименовывает поверх
+        файла), а после успешного rename удаляется. Если rename не удался,
+        прежний target возвращается на место.
+        """
+        try:
+            await self._run_sftp('posix_rename', source, target)
+            return
+        except IOError as e:
+            # Неподдерживаемая операция приходит без errno, только с текстом статуса
+            if e.errno is not None or "unsupported" not in str(e).lower():
+                raise
+            self.logger.info("Server has no posix-rename, falling back to rename via backup: %s", e)
+        backup = source + ".old"
+        try:
+            # Остаток прошлой неудачной попытки
+            await self._run_sftp('remove', backup)
+        except FileNotFoundError:
+            pass
+        try:
+            await self._run_sftp('rename', target, backup)
+            has_backup = True
+        except FileNotFoundError:
+            has_backup = False
+        try:
+            await self._run_sftp('rename', source, target)
+        except BaseException:
+            if has_backup:
+                try:
+                    await self._run_sftp('rename', backup, target)
+                except Exception as restore_error:
+                    self.logger.error("Cannot restore %s from %s: %s", target, backup, restore_error)
+            raise
+        if has_backup:
+            try:
+                await self._run_sftp('remove', backup)
+            except Exception as e:
+                self.logger.warning("Cannot remove backup %s: %s", backup, e)
+
+    async def read_text_file(self, file_path: str, offset: int = 0,
+                             length: Optional[int] = None) -> AsyncIterator[str]:
+        """
+        Потоковое чтение текстового файла.
+        
+        Args:
+            file_path (str): Путь к файлу
+            offset (int): Смещение от начала файла в байтах
+            length (Optional[int]): Сколько байт прочитать (None - до конца файла)
+            
+        Yields:
+            str: Очередной фрагмент содержимого файла
+        """
+        async def _checked_chunks():
+            first = True
+            async with aclosing(self.read_file_chunks(file_path, offset, length)) as chunks:
+                async for chunk in chunks:
+                    # Проверяем, что файл текстовый, прежде чем читать дальше
+                    if first and b"\x00" in chunk[:1024]:
+                        raise ValueError("File is not a text file")
+                    first = False
+                    yield chunk
+
+        try:
+            async with aclosing(decode_utf8_stream(_checked_chunks())) as pieces:
+                async for piece in pieces:
+                    yield piece
         except Exception as e:
-            self.logger.error(f"Error reading file {file_path}: {e}")
-            raise 
\ No newline at end of file
+            self.logger.error("Error reading file %s: %s", file_path, e)
+            raise
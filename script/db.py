@@ -1,42 +1,132 @@
-from sqlalchemy import Column, Integer, String
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+import logging
+from sqlalchemy import Column, ForeignKey, Index, Integer, String, Text, event
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
 
+logger = logging.getLogger(__name__)
+
 Base = declarative_base()
 
 class User(Base):
     __tablename__ = 'users'
-    
+
     # Поля из первого задания
     userid = Column(Integer, primary_key=True)
     username = Column(String)
     role = Column(String)  # 'teacher' или 'student'
-    tutorcode = Column(String, nullable=True, unique=True) # Уникальный код для преподавателя
+    tutorcode = Column(String, nullable=True, unique=True) # Уникальный код для преподавателя (UNIQUE дает индекс)
     subscribe = Column(String, nullable=True) # Имя пользователя преподавателя, на которого подписан студент
     extra = Column(String, nullable=True)
-    
+
     # Поля из второго задания
     vm_host = Column(String, nullable=True)
     vm_port = Column(Integer, nullable=True)
     vm_username = Column(String, nullable=True)
     vm_password = Column(String, nullable=True)
+    # Подключение по ключу: текст закрытого ключа, его тип и пароль (если ключ зашифрован)
+    vm_key = Column(Text, nullable=True)
+    vm_key_type = Column(String, nullable=True)
+    vm_key_passphrase = Column(String, nullable=True)
+
+    # ID преподавателя, на которого подписан студент (subscribe хранит только имя)
+    teacher_id = Column(Integer, ForeignKey('users.userid'), nullable=True, index=True)
+
+    __table_args__ = (
+        Index('ix_users_subscribe', 'subscribe'),
+    )
+
+class FSMRecord(Base):
+    """Состояние диалога aiogram (FSM) для одного ключа чат/пользователь; см. script.fsm."""
+    __tablename__ = 'fsm_states'
+
+    key = Column(String, primary_key=True)  # bot_id:chat_id:user_id[:thread][:business][:destiny]
+    state = Column(String, nullable=True)
+    data = Column(Text, nullable=True)  # JSON
+    expires_at = Column(Integer, nullable=False, index=True)  # unix-время, после которого запись устарела
+
+# Настройки SQLite, применяемые к каждому новому подключению
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",        # читатели не блокируют писателя
+    "synchronous": "NORMAL",      # в режиме WAL безопасно и намного быстрее FULL
+    "busy_timeout": 5000,         # мс ожидания блокировки вместо мгновенного "database is locked"
+    "cache_size": -16000,         # ~16 МБ страничного кэша (отрицательное значение - в КБ)
+    "mmap_size": 128 * 1024 * 1024,
+    "temp_store": "MEMORY",
+    "foreign_keys": "ON",
+}
 
 engine = None
 async_session = None
 
+def _apply_sqlite_pragmas(pragmas: dict):
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+    return on_connect
+
+def create_engine_with_profile(database_url: str, pragmas: dict | None = None) -> AsyncEngine:
+    """Создает движок; для SQLite на каждое подключение применяются SQLITE_PRAGMAS."""
+    new_engine = create_async_engine(database_url, echo=False) # Отключаем echo для чистоты логов
+    if new_engine.dialect.name == "sqlite":
+        event.listen(new_engine.sync_engine, "connect", _apply_sqlite_pragmas(pragmas or SQLITE_PRAGMAS))
+    return new_engine
+
 def initialize_db(database_url: str):
     global engine, async_session
     if engine is None:
-        engine = create_async_engine(database_url, echo=False) # Отключаем echo для чистоты логов
+        engine = create_engine_with_profile(database_url)
         async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
     return engine, async_session
 
+def _migrate_teacher_id(conn):
+    columns = {row[1] for row in conn.exec_driver_sql("PRAGMA table_info(users)")}
+    if 'teacher_id' not in columns:
+        conn.exec_driver_sql("ALTER TABLE users ADD COLUMN teacher_id INTEGER REFERENCES users(userid)")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_users_teacher_id ON users (teacher_id)")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_users_subscribe ON users (subscribe)")
+    # Переносим существующие подписки по имени преподавателя в teacher_id
+    conn.exec_driver_sql(
+        "UPDATE users SET teacher_id = ("
+        "  SELECT t.userid FROM users AS t"
+        "  WHERE t.username = users.subscribe AND t.role = 'teacher' LIMIT 1"
+        ") WHERE subscribe IS NOT NULL AND teacher_id IS NULL"
+    )
+
+def _migrate_vm_key(conn):
+    columns = {row[1] for row in conn.exec_driver_sql("PRAGMA table_info(users)")}
+    for name, sql_type in (("vm_key", "TEXT"), ("vm_key_type", "VARCHAR"), ("vm_key_passphrase", "VARCHAR")):
+        if name not in columns:
+            conn.exec_driver_sql(f"ALTER TABLE users ADD COLUMN {name} {sql_type}")
+
+# (версия схемы, шаг миграции); шаги должны быть идемпотентными
+MIGRATIONS = [
+    (1, _migrate_teacher_id),
+    (2, _migrate_vm_key),
+]
+
+def run_migrations(conn):
+    """Доводит схему существующей SQLite-базы до текущей версии (PRAGMA user_version)."""
+    if conn.dialect.name != "sqlite":
+        return
+    version = conn.exec_driver_sql("PRAGMA user_version").scalar()
+    for target, step in MIGRATIONS:
+        if version < target:
+            logger.info("Applying schema migration %s: %s", target, step.__name__)
+            step(conn)
+            conn.exec_driver_sql(f"PRAGMA user_version = {target}")
+            version = target
+
 async def init_db():
     if not engine:
         raise RuntimeError("Database not initialized. Call initialize_db() first.")
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(run_migrations)
 
 async def get_db_session() -> AsyncSession:
     async with async_session() as session:
-        yield session 
\ No newline at end of file
+        yield session
@@ -0,0 +1,274 @@
+"""
+Доставка исходящих сообщений Telegram: ограничение частоты, повтор при flood control
+и объединение подряд идущих коротких сообщений в один чат.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import weakref
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.methods import Response, SendMessage, TelegramMethod
+from aiogram.types import InputFile, Message
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "30"))   # сообщений в секунду на бота
+CHAT_RATE = float(os.getenv("TG_CHAT_RATE", "1"))        # сообщений в секунду в один чат
+CHAT_BURST = int(os.getenv("TG_CHAT_BURST", "3"))
+MAX_RETRIES = int(os.getenv("TG_MAX_RETRIES", "3"))
+MESSAGE_LIMIT = 4096
+_SEPARATOR = "\n"
+
+# Запросы, которые разрешено объединять с соседними, по id(). Объединенные сообщения
+# получают один общий Message, поэтому объединяются только уведомления, ответ на
+# которые отправитель не сохраняет (не редактирует и не удаляет). Методы aiogram
+# не хешируются, поэтому ключ - id(), а слабая ссылка убирает запись вместе с
+# объектом: id, повторно выданный новому запросу, не считается помеченным
+_marked_mergeable: "weakref.WeakValueDictionary[int, TelegramMethod]" = weakref.WeakValueDictionary()
+
+
+def mergeable(method: TelegramMethod) -> TelegramMethod:
+    """Разрешает объединить сообщение с соседними; возвращенный Message будет общим для всех."""
+    _marked_mergeable[id(method)] = method
+    return method
+
+
+def exclusive(method: TelegramMethod) -> TelegramMethod:
+    """Явно запрещает объединение (по умолчанию сообщения и так не объединяются)."""
+    _marked_mergeable.pop(id(method), None)
+    return method
+
+
+def is_mergeable(method: TelegramMethod) -> bool:
+    return _marked_mergeable.get(id(method)) is method
+
+
+class TokenBucket:
+    """Классический token bucket: rate токенов в секунду, не больше capacity в запасе."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+    async def acquire(self):
+        async with self._lock:
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+class _Pending:
+    __slots__ = ("make_request", "method", "future")
+
+    def __init__(self, make_request: NextRequestMiddlewareType, method: TelegramMethod, future: asyncio.Future):
+        self.make_request = make_request
+        self.method = method
+        self.future = future
+
+
+class _ChatState:
+    __slots__ = ("bucket", "queue", "worker")
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self.queue: Deque[_Pending] = deque()
+        self.worker: Optional[asyncio.Task] = None
+
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    """
+    Middleware сессии бота, через которую проходят все запросы к Bot API.
+
+    Запросы в конкретный чат выстраиваются в очередь этого чата и отправляются
+    с учетом token bucket чата и общего token bucket бота. Если в очереди
+    скопилось несколько коротких текстовых сообщений подряд, помеченных
+    mergeable(), они уходят одним сообщением. На TelegramRetryAfter запрос повторяется после паузы.
+    """
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, chat_rate: float = CHAT_RATE,
+                 chat_burst: int = CHAT_BURST, max_retries: int = MAX_RETRIES, max_chats: int = 10000):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self._chats: Dict[Any, _ChatState] = {}
+        self.sent = 0
+        self.merged = 0
+        self.retried = 0
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot,
+                       method: TelegramMethod) -> Response:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            await self.global_bucket.acquire()
+            return await self._send_with_retry(make_request, bot, method)
+
+        state = self._chat_state(chat_id)
+        future = asyncio.get_running_loop().create_future()
+        state.queue.append(_Pending(make_request, method, future))
+        if state.worker is None or state.worker.done():
+            state.worker = asyncio.create_task(self._drain(chat_id, state, bot))
+        return await future
+
+    def _chat_state(self, chat_id) -> _ChatState:
+        state = self._chats.get(chat_id)
+        if state is None:
+            if len(self._chats) >= self.max_chats:
+                self._prune()
+            state = self._chats[chat_id] = _ChatState(TokenBucket(self.chat_rate, self.chat_burst))
+        return state
+
+    def _prune(self):
+        for chat_id, state in list(self._chats.items()):
+            if not state.queue and (state.worker is None or state.worker.done()) and state.bucket.is_full():
+                del self._chats[chat_id]
+
+    async def _drain(self, chat_id, state: _ChatState, bot: Bot):
+        while state.queue:
+            await state.bucket.acquire()
+            batch = self._take_batch(state.queue)
+            await self.global_bucket.acquire()
+            head = batch[0]
+            method = head.method if len(batch) == 1 else self._merge(batch)
+            try:
+                response = await self._send_with_retry(head.make_request, bot, method)
+            except Exception as e:
+                for item in batch:
+                    if not item.future.done():
+                        item.future.set_exception(e)
+                continue
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_result(response)
+
+    @staticmethod
+    def _mergeable(method: TelegramMethod) -> bool:
+        return (
+            isinstance(method, SendMessage)
+            and is_mergeable(method)
+            and method.reply_markup is None
+            and method.reply_to_message_id is None
+            and method.entities is None
+        )
+
+    def _take_batch(self, queue: Deque[_Pending]) -> List[_Pending]:
+        """Забирает из очереди первый запрос и подряд идущие совместимые с ним сообщения."""
+        head = queue.popleft()
+        batch = [head]
+        if not self._mergeable(head.method):
+            return batch
+        length = len(head.method.text)
+        while queue and self._mergeable(queue[0].method):
+            candidate = queue[0].method
+            if (candidate.parse_mode != head.method.parse_mode
+                    or candidate.disable_web_page_preview != head.method.disable_web_page_preview
+                    or length + len(_SEPARATOR) + len(candidate.text) > MESSAGE_LIMIT):
+                break
+            length += len(_SEPARATOR) + len(candidate.text)
+            batch.append(queue.popleft())
+        for item in batch:
+            exclusive(item.method)
+        if len(batch) > 1:
+            self.merged += len(batch) - 1
+        return batch
+
+    @staticmethod
+    def _merge(batch: List[_Pending]) -> SendMessage:
+        head = batch[0].method
+        text = _SEPARATOR.join(item.method.text for item in batch)
+        return head.model_copy(update={"text": text})
+
+    async def _send_with_retry(self, make_request: NextRequestMiddlewareType, bot: Bot,
+                               method: TelegramMethod) -> Response:
+        attempt = 0
+        while True:
+            try:
+                response = await make_request(bot, method)
+                self.sent += 1
+                return response
+            except TelegramRetryAfter as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                self.retried += 1
+                logger.warning("Flood control on %s, retry in %ss (attempt %s/%s)",
+                               method.__api_method__, e.retry_after, attempt, self.max_retries)
+                await asyncio.sleep(e.retry_after)
+
+
+class ProgressReply:
+    """
+    Ответ пользователю с сообщением о ходе выполнения: вместо того чтобы
+    отправлять "Выполняю..." и затем отдельный результат, первое сообщение
+    редактируется на месте.
+    """
+
+    def __init__(self, message: Message):
+        self.message = message
+        self.progress: Optional[Message] = None
+
+    async def update(self, text: str):
+        """Показывает (или обновляет) сообщение о ходе выполнения."""
+        if self.progress is None:
+            self.progress = await exclusive(self.message.answer(text))
+            return
+        try:
+            self.progress = await self.progress.edit_text(text)
+        except TelegramBadRequest:
+            # Текст не изменился
+            pass
+
+    async def answer(self, text: str, **kwargs) -> Message:
+        """Отправляет результат, заменяя им сообщение о ходе выполнения, если оно есть."""
+        if self.progress is None:
+            return await self.message.answer(text, **kwargs)
+        progress, self.progress = self.progress, None
+        try:
+            result = await progress.edit_text(text, **kwargs)
+            return result if isinstance(result, Message) else progress
+        except TelegramBadRequest as e:
+            logger.warning("Cannot edit progress message, sending a new one: %s", e)
+            return await self.message.answer(text, **kwargs)
+
+    async def notice(self, text: str, **kwargs):
+        """
+        Как answer(), но для сообщений, которые больше не меняются: новое сообщение
+        можно объединить с соседними, поэтому Message не возвращается.
+        """
+        if self.progress is not None:
+            await self.answer(text, **kwargs)
+            return
+        await mergeable(self.message.answer(text, **kwargs))
+
+    async def answer_document(self, document: InputFile, **kwargs) -> Message:
+        """Отправляет результат документом и убирает сообщение о ходе выполнения."""
+        result = await self.message.answer_document(document, **kwargs)
+        if self.progress is not None:
+            progress, self.progress = self.progress, None
+            try:
+                await progress.delete()
+            except TelegramBadRequest:
+                pass
+        return result
@@ -0,0 +1,83 @@
+"""
+Отправка большого вывода одним документом вместо десятков сообщений,
+с необязательным сжатием gzip.
+"""
+
+import os
+import gzip
+import zlib
+from contextlib import aclosing
+from typing import AsyncIterator, Callable
+
+from aiogram import Bot
+from aiogram.types import BufferedInputFile, InputFile
+
+from .streaming import PAGE_SIZE
+
+# Вывод больше этого объема (в байтах) отправляется документом, а не страницами
+DOCUMENT_THRESHOLD = int(os.getenv("DOCUMENT_THRESHOLD", str(3 * PAGE_SIZE)))
+# Максимальный объем, который отправляется одним документом (лимит Bot API - 50 МБ)
+DOCUMENT_MAX_BYTES = int(os.getenv("DOCUMENT_MAX_BYTES", str(20 * 1024 * 1024)))
+# Сжимаем только если данных не меньше GZIP_MIN_SIZE и gzip экономит хотя бы GZIP_MIN_SAVING
+GZIP_MIN_SIZE = int(os.getenv("GZIP_MIN_SIZE", "4096"))
+GZIP_MIN_SAVING = float(os.getenv("GZIP_MIN_SAVING", "0.2"))
+GZIP_LEVEL = 6
+
+
+def worth_compressing(sample: bytes, total_size: int) -> bool:
+    """
+    Оценивает по образцу данных, стоит ли сжимать весь поток.
+
+    Args:
+        sample (bytes): Начало данных
+        total_size (int): Полный объем данных
+
+    Returns:
+        bool: True, если gzip сэкономит не меньше GZIP_MIN_SAVING
+    """
+    if total_size < GZIP_MIN_SIZE or not sample:
+        return False
+    return len(zlib.compress(sample, GZIP_LEVEL)) <= len(sample) * (1 - GZIP_MIN_SAVING)
+
+
+async def gzip_chunks(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Сжимает поток байтов в формат gzip на лету."""
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    async with aclosing(chunks):
+        async for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+    yield compressor.flush()
+
+
+class StreamedInputFile(InputFile):
+    """
+    Документ, содержимое которого читается из асинхронного источника прямо
+    во время загрузки в Telegram, не собираясь целиком в памяти.
+
+    source вызывается на каждую попытку отправки, поэтому повтор запроса
+    (например, после flood control) читает данные заново.
+    """
+
+    def __init__(self, source: Callable[[], AsyncIterator[bytes]], filename: str, compress: bool = False):
+        super().__init__(filename=filename + ".gz" if compress else filename)
+        self.source = source
+        self.compress = compress
+
+    async def read(self, bot: Bot) -> AsyncIterator[bytes]:
+        chunks = self.source()
+        if self.compress:
+            chunks = gzip_chunks(chunks)
+        async with aclosing(chunks):
+            async for chunk in chunks:
+                yield chunk
+
+
+def buffered_document(data: bytes, filename: str) -> BufferedInputFile:
+    """Документ из данных в памяти; сжимается, если это выгодно."""
+    if len(data) >= GZIP_MIN_SIZE:
+        compressed = gzip.compress(data, GZIP_LEVEL, mtime=0)
+        if len(compressed) <= len(data) * (1 - GZIP_MIN_SAVING):
+            return BufferedInputFile(compressed, filename=filename + ".gz")
+    return BufferedInputFile(data, filename=filename)
@@ -0,0 +1,172 @@
+import os
+import time
+import asyncio
+import logging
+import contextvars
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_WORKERS = int(os.getenv("SSH_EXECUTOR_WORKERS", "32"))
+DEFAULT_PER_HOST_LIMIT = int(os.getenv("SSH_PER_HOST_LIMIT", "4"))
+
+executor_wait = registry.histogram(
+    "ssh_executor_wait_seconds", "Ожидание слота хоста и потока SSH-исполнителя", ("host",))
+
+
+class ExecutorStats:
+    """Счетчики нагрузки на SSH-исполнитель."""
+
+    __slots__ = ("queue_depth", "active", "completed", "failed", "total_wait", "max_wait")
+
+    def __init__(self):
+        self.queue_depth = 0  # задачи, ожидающие слота хоста или свободного потока
+        self.active = 0       # задачи, выполняющиеся в потоке прямо сейчас
+        self.completed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record_wait(self, wait: float):
+        self.total_wait += wait
+        if wait > self.max_wait:
+            self.max_wait = wait
+
+    def snapshot(self) -> Dict[str, float]:
+        started = self.completed + self.failed + self.active
+        return {
+            "queue_depth": self.queue_depth,
+            "active": self.active,
+            "completed": self.completed,
+            "failed": self.failed,
+            "avg_wait": self.total_wait / started if started else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+
+class SSHExecutor:
+    """
+    Исполнитель блокирующих вызовов paramiko.
+
+    Использует собственный пул потоков фиксированного размера (а не пул
+    по умолчанию из asyncio.to_thread) и ограничивает число одновременных
+    операций на один хост, чтобы зависший сервер не занимал все потоки.
+    """
+
+    def __init__(self, max_workers: int = DEFAULT_MAX_WORKERS, per_host_limit: int = DEFAULT_PER_HOST_LIMIT):
+        """
+        Args:
+            max_workers (int): Размер пула потоков
+            per_host_limit (int): Максимум одновременных операций на один хост
+        """
+        self.max_workers = max_workers
+        self.per_host_limit = per_host_limit
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ssh-worker")
+        self._host_limits: Dict[str, asyncio.Semaphore] = {}
+        self.stats = ExecutorStats()
+        self.host_stats: Dict[str, ExecutorStats] = {}
+
+    def _host_state(self, host: str):
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.per_host_limit)
+            self.host_stats[host] = ExecutorStats()
+        return self._host_limits[host], self.host_stats[host]
+
+    async def run(self, host: str, func: Callable, *args, **kwargs):
+        """
+        Выполняет блокирующую функцию в пуле потоков с учетом лимита хоста.
+
+        Args:
+            host (str): Хост, к которому относится операция
+            func (Callable): Блокирующая функция
+
+        Returns:
+            Результат func(*args, **kwargs)
+        """
+        limit, host_stats = self._host_state(host)
+        counters = (self.stats, host_stats)
+        loop = asyncio.get_running_loop()
+        enqueued = time.monotonic()
+        started = False
+
+        # Счетчики и слот хоста меняются только в потоке event loop и только из
+        # обратных вызовов задачи пула: отмена ожидающей корутины не освобождает
+        # слот, пока поток еще занят вызовом
+        def _on_start(wait: float):
+            nonlocal started
+            started = True
+            for s in counters:
+                s.queue_depth -= 1
+                s.active += 1
+                s.record_wait(wait)
+            executor_wait.observe(wait, host=host)
+
+        def _on_done(future: concurrent.futures.Future):
+            limit.release()
+            for s in counters:
+                if not started:
+                    # Задачу отменили до запуска (например, при shutdown)
+                    s.queue_depth -= 1
+                elif future.exception() is None:
+                    s.active -= 1
+                    s.completed += 1
+                else:
+                    s.active -= 1
+                    s.failed += 1
+
+        def _call():
+            loop.call_soon_threadsafe(_on_start, time.monotonic() - enqueued)
+            return func(*args, **kwargs)
+
+        def _notify_done(future: concurrent.futures.Future):
+            # Вызывается в потоке пула; _on_start этого потока уже в очереди loop
+            try:
+                loop.call_soon_threadsafe(_on_done, future)
+            except RuntimeError:
+                pass  # event loop уже закрыт
+
+        for s in counters:
+            s.queue_depth += 1
+        try:
+            await limit.acquire()
+        except BaseException:
+            for s in counters:
+                s.queue_depth -= 1
+            raise
+        try:
+            # Контекст (например, correlation_id для логов) переносится в поток
+            future = self._pool.submit(contextvars.copy_context().run, _call)
+        except BaseException:
+            limit.release()
+            for s in counters:
+                s.queue_depth -= 1
+            raise
+        future.add_done_callback(_notify_done)
+        # Отмена корутины отменяет задачу пула, только если та еще не запущена
+        return await asyncio.wrap_future(future)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Текущие счетчики: общие и по хостам."""
+        data = {"total": self.stats.snapshot()}
+        for host, stats in self.host_stats.items():
+            data[host] = stats.snapshot()
+        return data
+
+    def shutdown(self, wait: bool = False):
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+
+
+ssh_executor = SSHExecutor()
+
+registry.callback("ssh_executor_queue_depth", "Вызовы, ожидающие слота хоста или потока", "gauge",
+                  lambda: ssh_executor.stats.queue_depth)
+registry.callback("ssh_executor_active", "Вызовы, выполняющиеся в потоках", "gauge",
+                  lambda: ssh_executor.stats.active)
+registry.callback("ssh_executor_max_wait_seconds", "Самое долгое ожидание слота с запуска", "gauge",
+                  lambda: ssh_executor.stats.max_wait)
+registry.callback("ssh_executor_failed_total", "Вызовы, завершившиеся ошибкой", "counter",
+                  lambda: ssh_executor.stats.failed)
@@ -0,0 +1,261 @@
+"""
+Выполнение одной команды на ВМ всех студентов преподавателя с общим отчетом.
+"""
+
+import os
+import html
+import time
+import asyncio
+import difflib
+import logging
+from collections import OrderedDict
+from contextlib import aclosing
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy import and_, or_
+from sqlalchemy.future import select
+
+from . import db
+from .db import User
+from .classes import VM_CONFIG_COLUMNS, FileOperations, SSHConnection, VMConfig
+from .scheduler import QueueFull, command_scheduler
+
+logger = logging.getLogger(__name__)
+
+FANOUT_CONCURRENCY = int(os.getenv("FANOUT_CONCURRENCY", "10"))
+FANOUT_TIMEOUT = float(os.getenv("FANOUT_TIMEOUT", "20"))
+# Сколько байт файла читается с каждой ВМ в задаче "cat"
+FANOUT_READ_BYTES = int(os.getenv("FANOUT_READ_BYTES", str(8 * 1024)))
+
+
+@dataclass(frozen=True, slots=True)
+class Student:
+    """Студент преподавателя и его данные для подключения (None, если не заданы)."""
+    userid: int
+    username: Optional[str]
+    vm_config: Optional[VMConfig]
+
+    @property
+    def label(self) -> str:
+        return f"@{self.username}" if self.username else str(self.userid)
+
+
+@dataclass(slots=True)
+class HostResult:
+    """Результат выполнения задачи на ВМ одного студента."""
+    student: Student
+    ok: bool
+    output: str = ""
+    error: Optional[str] = None
+    elapsed: float = 0.0
+
+
+def shell_task(command: str) -> Callable[[SSHConnection, Optional[str]], Awaitable[str]]:
+    """Задача, выполняющая фиксированную команду оболочки."""
+    async def run(ssh: SSHConnection, arg: Optional[str]) -> str:
+        stdout, stderr, status = await ssh.execute_command(command)
+        if status != 0:
+            raise RuntimeError(stderr or f"exit status {status}")
+        return stdout
+    return run
+
+
+async def _ls_task(ssh: SSHConnection, path: Optional[str]) -> str:
+    entries = await FileOperations(ssh).list_directory(path or ".")
+    names = sorted(e['name'] + ("/" if e['type'] == 'directory' else "") for e in entries)
+    return "\n".join(names)
+
+
+async def _cat_task(ssh: SSHConnection, path: Optional[str]) -> str:
+    pieces = FileOperations(ssh).read_text_file(path, 0, FANOUT_READ_BYTES)
+    async with aclosing(pieces):
+        return "".join([piece async for piece in pieces]).rstrip("\n")
+
+
+@dataclass(frozen=True, slots=True)
+class FanoutTask:
+    """Разрешенная для массового запуска задача."""
+    description: str
+    run: Callable[[SSHConnection, Optional[str]], Awaitable[str]]
+    needs_path: bool = False
+
+
+# Белый список задач: произвольные команды на ВМ студентов не выполняются,
+# а путь для ls/cat передается через SFTP, а не через оболочку
+FANOUT_TASKS: Dict[str, FanoutTask] = {
+    "check": FanoutTask("проверить подключение", shell_task("echo ok")),
+    "uptime": FanoutTask("время работы и нагрузка", shell_task("uptime")),
+    "df": FanoutTask("свободное место в домашней директории", shell_task("df -h ~")),
+    "ps": FanoutTask("самые загруженные процессы",
+                     shell_task("ps -eo pid,comm,%cpu,%mem --sort=-%cpu | head -n 10")),
+    "ls": FanoutTask("содержимое директории", _ls_task, needs_path=True),
+    "cat": FanoutTask(f"первые {FANOUT_READ_BYTES} байт файла", _cat_task, needs_path=True),
+}
+
+
+async def load_students(teacher_id: int, teacher_username: Optional[str] = None,
+                        session_maker=None) -> List[Student]:
+    """
+    Загружает студентов преподавателя одним запросом.
+
+    Args:
+        teacher_id (int): ID преподавателя
+        teacher_username (Optional[str]): Имя преподавателя - для старых записей,
+            где заполнено только поле subscribe
+        session_maker: Фабрика сессий; по умолчанию script.db.async_session
+
+    Returns:
+        List[Student]: Студенты в порядке имен
+    """
+    condition = User.teacher_id == teacher_id
+    if teacher_username:
+        condition = or_(condition, and_(User.teacher_id.is_(None), User.subscribe == teacher_username))
+    query = (
+        select(User.userid, User.username, *VM_CONFIG_COLUMNS)
+        .where(User.role == 'student', condition)
+        .order_by(User.username)
+    )
+    async with (session_maker or db.async_session)() as session:
+        rows = (await session.execute(query)).all()
+    return [Student(row.userid, row.username, VMConfig.from_row(row)) for row in rows]
+
+
+async def fan_out(students: List[Student], task: FanoutTask, arg: Optional[str], pool,
+                  concurrency: int = FANOUT_CONCURRENCY,
+                  timeout: float = FANOUT_TIMEOUT, scheduler=None) -> AsyncIterator[HostResult]:
+    """
+    Выполняет задачу на ВМ всех студентов, не больше concurrency одновременно.
+
+    Задача на ВМ студента проходит через его очередь в планировщике команд,
+    как и собственные команды студента, поэтому соблюдаются лимит на хост и
+    очередность его команд.
+
+    Args:
+        students (List[Student]): Студенты
+        task (FanoutTask): Задача из FANOUT_TASKS
+        arg (Optional[str]): Путь для задач ls/cat
+        pool: Пул SSH-подключений (SSHConnectionPool)
+        concurrency (int): Максимум одновременно обрабатываемых ВМ
+        timeout (float): Ограничение времени на одну ВМ с начала выполнения, включая подключение (сек)
+        scheduler: Планировщик команд; по умолчанию script.scheduler.command_scheduler
+
+    Yields:
+        HostResult: Результаты в порядке готовности
+    """
+    slots = asyncio.Semaphore(concurrency)
+    scheduler = scheduler or command_scheduler
+
+    async def run_one(student: Student) -> HostResult:
+        if student.vm_config is None:
+            return HostResult(student, False, error="ВМ не указана")
+        async with slots:
+            started = time.monotonic()
+            connection = None
+
+            async def work():
+                nonlocal connection, started
+                started = time.monotonic()
+                async with pool.connection(student.userid, student.vm_config) as ssh:
+                    connection = ssh
+                    return await task.run(ssh, arg)
+
+            try:
+                output = await scheduler.run(student.userid, student.vm_config.host,
+                                             lambda: asyncio.wait_for(work(), timeout))
+                return HostResult(student, True, output=output, elapsed=time.monotonic() - started)
+            except asyncio.TimeoutError:
+                # Подключение могло зависнуть посреди команды - в следующий раз откроем новое
+                if connection is not None:
+                    await pool.discard(connection)
+                return HostResult(student, False, error=f"таймаут {timeout:g} с",
+                                  elapsed=time.monotonic() - started)
+            except QueueFull:
+                return HostResult(student, False, error="очередь команд студента заполнена")
+            except Exception as e:
+                logger.info("Fan-out to %s for user %s failed: %s", student.vm_config.host, student.userid, e)
+                return HostResult(student, False, error=str(e) or type(e).__name__,
+                                  elapsed=time.monotonic() - started)
+
+    tasks = [asyncio.create_task(run_one(student)) for student in students]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for pending in tasks:
+            pending.cancel()
+
+
+class FanoutReport:
+    """
+    Сводный отчет по результатам: таблица успехов и ошибок и сгруппированные
+    выводы - одинаковые объединяются, отличающиеся показываются как diff
+    относительно самого частого варианта.
+    """
+
+    def __init__(self, title: str, students: List[Student]):
+        self.title = title
+        self.students = students
+        self.results: Dict[int, HostResult] = {}
+
+    def add(self, result: HostResult):
+        self.results[result.student.userid] = result
+
+    @property
+    def done(self) -> bool:
+        return len(self.results) == len(self.students)
+
+    def _groups(self) -> "OrderedDict[str, List[HostResult]]":
+        groups: Dict[str, List[HostResult]] = {}
+        for result in self.results.values():
+            if result.ok:
+                groups.setdefault(result.output, []).append(result)
+        return OrderedDict(sorted(groups.items(), key=lambda item: -len(item[1])))
+
+    def render_summary(self, limit: int = 3500) -> str:
+        """Короткий отчет в HTML-разметке Telegram: счетчики, таблица и группы выводов."""
+        ok = sum(1 for r in self.results.values() if r.ok)
+        failed = len(self.results) - ok
+        waiting = len(self.students) - len(self.results)
+        lines = [f"<b>{html.escape(self.title)}</b>",
+                 f"✅ {ok}  ❌ {failed}" + (f"  ⏳ {waiting}" if waiting else "")]
+
+        groups = self._groups()
+        if groups:
+            lines.append(f"Вариантов вывода: {len(groups)}")
+        table = []
+        for student in self.students:
+            result = self.results.get(student.userid)
+            if result is None:
+                table.append(f"⏳ {student.label}")
+            elif result.ok:
+                variant = list(groups).index(result.output) + 1
+                table.append(f"✅ {student.label} — вариант {variant}, {result.elapsed:.1f} с")
+            else:
+                table.append(f"❌ {student.label} — {result.error}")
+        body = "\n".join(html.escape(line) for line in table)
+        if len(body) > limit:
+            body = body[:limit].rsplit("\n", 1)[0] + "\n…"
+        lines.append(f"<pre>{body}</pre>")
+        return "\n".join(lines)
+
+    def render_document(self) -> str:
+        """Полный отчет обычным текстом: выводы по группам и diff отличающихся вариантов."""
+        out = [self.title, ""]
+        groups = self._groups()
+        reference = next(iter(groups), None)
+        for number, (output, results) in enumerate(groups.items(), start=1):
+            who = ", ".join(r.student.label for r in results)
+            out.append(f"=== Вариант {number} ({len(results)}): {who}")
+            if number == 1 or reference is None:
+                out.append(output)
+            else:
+                diff = difflib.unified_diff(reference.splitlines(), output.splitlines(),
+                                            "вариант 1", f"вариант {number}", lineterm="")
+                out.extend(diff)
+            out.append("")
+        failures = [r for r in self.results.values() if not r.ok]
+        if failures:
+            out.append("=== Ошибки")
+            out.extend(f"{r.student.label}: {r.error}" for r in failures)
+        return "\n".join(out)
@@ -0,0 +1,249 @@
+"""
+Хранилище состояний FSM aiogram в базе бота (таблица fsm_states).
+
+Записи копятся в памяти и сбрасываются в БД пачкой одной транзакцией;
+чтение идет через небольшой локальный кэш. Несколько процессов бота видят
+общие состояния с задержкой не больше FSM_FLUSH_INTERVAL + FSM_CACHE_TTL.
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import delete
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.future import select
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+
+from . import db
+from .db import FSMRecord
+from .cache import MISSING, TTLCache
+from .metrics import db_duration, registry
+
+logger = logging.getLogger(__name__)
+
+# Сколько хранится состояние, которое никто не трогал (сек)
+FSM_STATE_TTL = int(os.getenv("FSM_STATE_TTL", str(7 * 24 * 3600)))
+# Задержка, за которую копятся записи перед сбросом в БД, и размер пачки для немедленного сброса
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "0.2"))
+FSM_FLUSH_BATCH = int(os.getenv("FSM_FLUSH_BATCH", "200"))
+# Локальный кэш чтения: сколько записей и как долго (сек) доверять им без БД
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "2048"))
+FSM_CACHE_TTL = float(os.getenv("FSM_CACHE_TTL", "5"))
+# Как часто удаляются устаревшие записи (сек)
+FSM_CLEANUP_INTERVAL = float(os.getenv("FSM_CLEANUP_INTERVAL", "600"))
+
+# (state, data) - то, что хранится по одному ключу
+Record = Tuple[Optional[str], Dict[str, Any]]
+
+
+def build_key(key: StorageKey) -> str:
+    """Компактный строковый ключ; необязательные части добавляются только если заданы."""
+    parts = [str(key.bot_id), str(key.chat_id), str(key.user_id)]
+    thread_id = key.thread_id
+    business_connection_id = getattr(key, "business_connection_id", None)
+    if thread_id or business_connection_id or key.destiny != "default":
+        parts += [str(thread_id or ""), business_connection_id or "", key.destiny]
+    return ":".join(parts)
+
+
+class SQLAlchemyStorage(BaseStorage):
+    """
+    BaseStorage aiogram поверх async-движка SQLAlchemy из script.db.
+
+    Args:
+        session_maker: Фабрика сессий; по умолчанию script.db.async_session на момент вызова
+        state_ttl (int): Время жизни состояния без изменений (сек)
+        flush_interval (float): Задержка перед сбросом накопленных записей (сек)
+        flush_batch (int): Число измененных ключей, при котором сброс выполняется сразу
+        cache_size (int): Размер локального кэша чтения
+        cache_ttl (float): Время жизни записи в локальном кэше (сек)
+    """
+
+    def __init__(self, session_maker=None, state_ttl: int = FSM_STATE_TTL,
+                 flush_interval: float = FSM_FLUSH_INTERVAL, flush_batch: int = FSM_FLUSH_BATCH,
+                 cache_size: int = FSM_CACHE_SIZE, cache_ttl: float = FSM_CACHE_TTL,
+                 cleanup_interval: float = FSM_CLEANUP_INTERVAL):
+        self._session_maker = session_maker
+        self.state_ttl = state_ttl
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.cleanup_interval = cleanup_interval
+        self.cache = TTLCache(cache_size, cache_ttl)
+        # Ключ -> измененные поля ("state", "data") еще не записанные в БД
+        self._dirty: Dict[str, Dict[str, Any]] = {}
+        # То же для пачки, которая записывается прямо сейчас
+        self._inflight: Dict[str, Dict[str, Any]] = {}
+        # Меняется после каждой записи: чтение, начатое до нее, не попадает в кэш
+        self._generation = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._last_cleanup = time.monotonic()
+        self.flushes = 0
+        self.written = 0
+
+    @property
+    def session_maker(self):
+        return self._session_maker or db.async_session
+
+    # --- API BaseStorage ---
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        self._write(build_key(key), "state", state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._read(build_key(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        # Проверяем сериализуемость сразу, чтобы ошибка возникла в обработчике, а не при сбросе
+        json.dumps(data)
+        self._write(build_key(key), "data", dict(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._read(build_key(key))
+        return dict(data)
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+
+    # --- запись ---
+
+    def _write(self, key: str, field: str, value: Any):
+        self._dirty.setdefault(key, {})[field] = value
+        if self._flusher is None or self._flusher.done():
+            self._wakeup = asyncio.Event()
+            self._flusher = asyncio.create_task(self._flush_loop())
+        self._wakeup.set()
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.cleanup_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._dirty and len(self._dirty) < self.flush_batch:
+                # Даем накопиться записям соседних апдейтов
+                await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.monotonic() - self._last_cleanup >= self.cleanup_interval:
+                    await self.cleanup()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("FSM storage flush failed: %s", e)
+
+    async def flush(self):
+        """Записывает накопленные изменения одной транзакцией."""
+        if not self._dirty:
+            return
+        batch, self._dirty = self._dirty, {}
+        self._inflight = batch
+        try:
+            with db_duration.time(operation="fsm_flush"):
+                await self._write_batch(batch)
+        except BaseException:
+            # Возвращаем пачку, не затирая изменения, сделанные во время записи
+            for key, fields in batch.items():
+                self._dirty[key] = {**fields, **self._dirty.get(key, {})}
+            raise
+        finally:
+            self._inflight = {}
+        self._generation += 1
+        self.flushes += 1
+        self.written += len(batch)
+        for key, fields in batch.items():
+            cached = self.cache.get(key)
+            if cached is not MISSING:
+                self.cache.set(key, (fields.get("state", cached[0]), fields.get("data", cached[1])))
+
+    async def _write_batch(self, batch: Dict[str, Dict[str, Any]]):
+        """
+        Одна транзакция: удаление очищенных ключей одним DELETE и upsert остальных,
+        сгруппированных по набору измененных полей (по executemany на группу).
+        """
+        expires_at = int(time.time()) + self.state_ttl
+        deleted = []
+        groups: Dict[Tuple[str, ...], list] = defaultdict(list)
+        for key, fields in batch.items():
+            # Пустое состояние без данных (state.clear()) просто удаляется
+            if fields.get("state", "") is None and fields.get("data") == {}:
+                deleted.append(key)
+                continue
+            groups[tuple(sorted(fields))].append({
+                "key": key,
+                "state": fields.get("state"),
+                "data": json.dumps(fields.get("data", {}), ensure_ascii=False),
+                "expires_at": expires_at,
+            })
+
+        async with self.session_maker() as session:
+            async with session.begin():
+                if deleted:
+                    await session.execute(delete(FSMRecord).where(FSMRecord.key.in_(deleted)))
+                insert = postgresql.insert if session.bind.dialect.name == "postgresql" else sqlite.insert
+                for changed, rows in groups.items():
+                    stmt = insert(FSMRecord)
+                    # Поля, которые не менялись, при конфликте остаются как есть
+                    updates = {name: stmt.excluded[name] for name in changed + ("expires_at",)}
+                    stmt = stmt.on_conflict_do_update(index_elements=[FSMRecord.key], set_=updates)
+                    await session.execute(stmt, rows)
+
+    async def cleanup(self) -> int:
+        """Удаляет устаревшие записи; возвращает их число."""
+        self._last_cleanup = time.monotonic()
+        async with self.session_maker() as session:
+            async with session.begin():
+                result = await session.execute(delete(FSMRecord).where(FSMRecord.expires_at < int(time.time())))
+        if result.rowcount:
+            logger.info("Removed %s expired FSM states", result.rowcount)
+        return result.rowcount
+
+    # --- чтение ---
+
+    async def _read(self, key: str) -> Record:
+        record = self.cache.get(key)
+        if record is MISSING:
+            generation = self._generation
+            record = await self._load(key)
+            if generation == self._generation:
+                self.cache.set(key, record)
+        state, data = record
+        for fields in (self._inflight.get(key), self._dirty.get(key)):
+            if fields:
+                state = fields.get("state", state)
+                data = fields.get("data", data)
+        return state, data
+
+    async def _load(self, key: str) -> Record:
+        with db_duration.time(operation="fsm_get"):
+            async with self.session_maker() as session:
+                row = (await session.execute(
+                    select(FSMRecord.state, FSMRecord.data)
+                    .where(FSMRecord.key == key, FSMRecord.expires_at >= int(time.time()))
+                )).one_or_none()
+        if row is None:
+            return None, {}
+        return row.state, json.loads(row.data) if row.data else {}
+
+
+fsm_storage = SQLAlchemyStorage()
+
+registry.callback("fsm_flushes_total", "Сбросы состояний FSM в БД", "counter", lambda: fsm_storage.flushes)
+registry.callback("fsm_written_total", "Записанные в БД состояния FSM", "counter", lambda: fsm_storage.written)
+registry.callback("fsm_pending", "Состояния FSM, ожидающие записи в БД", "gauge", lambda: len(fsm_storage._dirty))
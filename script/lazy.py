@@ -0,0 +1,40 @@
+"""
+Отложенный импорт тяжелых зависимостей (paramiko и его криптографии),
+чтобы они загружались при первой команде к ВМ, а не при старте бота.
+"""
+
+import importlib
+from types import ModuleType
+from typing import Any, Optional
+
+
+class LazyModule:
+    """
+    Заместитель модуля: настоящий импорт выполняется при первом обращении к атрибуту.
+
+    Пример:
+        paramiko = LazyModule("paramiko")
+        ...
+        except paramiko.SSHException:  # здесь paramiko и импортируется
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module: Optional[ModuleType] = None
+
+    def _load(self) -> ModuleType:
+        # import_module потокобезопасен: гонка здесь приводит лишь к повторному поиску в sys.modules
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self._load(), attr)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
@@ -0,0 +1,173 @@
+"""
+Кэш содержимого директорий ВМ и постраничный вывод для /ls.
+"""
+
+import os
+import html
+import stat
+import time
+import hashlib
+from collections import OrderedDict
+from datetime import datetime
+from fnmatch import fnmatch
+from typing import Any, Dict, List, Optional, Tuple
+
+DEFAULT_TTL = float(os.getenv("LS_CACHE_TTL", "60"))
+DEFAULT_MAX_ENTRIES = int(os.getenv("LS_CACHE_MAX_ENTRIES", "500"))
+PAGE_ENTRIES = 40
+
+SORT_KEYS = ("name", "size", "mtime")
+
+
+class ListingSnapshot:
+    """Снимок содержимого директории вместе с ее mtime на момент чтения."""
+
+    __slots__ = ("path", "entries", "dir_mtime", "fetched_at")
+
+    def __init__(self, path: str, entries: List[Dict[str, Any]], dir_mtime: Optional[int]):
+        self.path = path
+        self.entries = entries
+        self.dir_mtime = dir_mtime
+        self.fetched_at = time.monotonic()
+
+    def is_fresh(self, ttl: float) -> bool:
+        return time.monotonic() - self.fetched_at < ttl
+
+    def touch(self):
+        """Продлевает жизнь снимка после того, как mtime директории подтвердился."""
+        self.fetched_at = time.monotonic()
+
+
+class ListView:
+    """
+    Параметры просмотра, на которые ссылаются кнопки под сообщением /ls.
+
+    Просмотр держит снимок, показанный в сообщении: листание и сортировка
+    работают с ним без обращений к ВМ, а отфильтрованные и отсортированные
+    записи вычисляются один раз на способ сортировки.
+    """
+
+    __slots__ = ("view_id", "path", "pattern", "snapshot", "_sorted")
+
+    def __init__(self, view_id: str, path: str, pattern: Optional[str], snapshot: ListingSnapshot):
+        self.view_id = view_id
+        self.path = path
+        self.pattern = pattern
+        self.snapshot = snapshot
+        self._sorted: Dict[str, List[Dict[str, Any]]] = {}
+
+    def entries(self, sort_key: str) -> List[Dict[str, Any]]:
+        if sort_key not in self._sorted:
+            self._sorted[sort_key] = _filter_sorted(self.snapshot.entries, sort_key, self.pattern)
+        return self._sorted[sort_key]
+
+    def render_page(self, page: int, sort_key: str) -> Tuple[str, int, int]:
+        return paginate(self.entries(sort_key), page)
+
+
+class ListingCache:
+    """
+    LRU-кэш листингов по ключу (user_id, path) с TTL.
+
+    По истечении TTL снимок не выбрасывается сразу: вызывающий код может
+    сверить mtime директории и продлить снимок вместо полного перечитывания.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_TTL, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._snapshots: "OrderedDict[Tuple[int, str], ListingSnapshot]" = OrderedDict()
+        self._views: "OrderedDict[Tuple[int, str], ListView]" = OrderedDict()
+
+    def get(self, user_id: int, path: str) -> Optional[ListingSnapshot]:
+        snapshot = self._snapshots.get((user_id, path))
+        if snapshot is not None:
+            self._snapshots.move_to_end((user_id, path))
+        return snapshot
+
+    def put(self, user_id: int, path: str, entries: List[Dict[str, Any]],
+            dir_mtime: Optional[int]) -> ListingSnapshot:
+        snapshot = ListingSnapshot(path, entries, dir_mtime)
+        self._snapshots[(user_id, path)] = snapshot
+        self._snapshots.move_to_end((user_id, path))
+        while len(self._snapshots) > self.max_entries:
+            self._snapshots.popitem(last=False)
+        return snapshot
+
+    def invalidate_user(self, user_id: int):
+        for key in [key for key in self._snapshots if key[0] == user_id]:
+            del self._snapshots[key]
+        # Кнопки старых сообщений не должны показывать листинг прежней ВМ
+        for key in [key for key in self._views if key[0] == user_id]:
+            del self._views[key]
+
+    def register_view(self, user_id: int, path: str, pattern: Optional[str],
+                      snapshot: ListingSnapshot) -> ListView:
+        """Запоминает путь, фильтр и снимок под коротким id, который помещается в callback_data."""
+        view_id = hashlib.blake2s(f"{path}\0{pattern or ''}".encode(), digest_size=4).hexdigest()
+        view = ListView(view_id, path, pattern, snapshot)
+        self._views[(user_id, view_id)] = view
+        self._views.move_to_end((user_id, view_id))
+        while len(self._views) > self.max_entries:
+            self._views.popitem(last=False)
+        return view
+
+    def get_view(self, user_id: int, view_id: str) -> Optional[ListView]:
+        return self._views.get((user_id, view_id))
+
+
+def _human_size(size: int) -> str:
+    for unit in ("B", "K", "M", "G"):
+        if size < 1024:
+            return f"{size}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}T"
+
+
+def sort_entries(entries: List[Dict[str, Any]], sort_key: str) -> List[Dict[str, Any]]:
+    """Сортирует записи: по имени (директории первыми), размеру или дате (по убыванию)."""
+    if sort_key == "size":
+        return sorted(entries, key=lambda e: (-(e['size'] or 0), e['name']))
+    if sort_key == "mtime":
+        return sorted(entries, key=lambda e: (-(e['mtime'] or 0), e['name']))
+    return sorted(entries, key=lambda e: (e['type'] != 'directory', e['name'].lower()))
+
+
+def _format_entry(entry: Dict[str, Any], escape: bool = True) -> str:
+    mode = stat.filemode(entry['mode']) if entry.get('mode') is not None else "?" * 10
+    mtime = datetime.fromtimestamp(entry['mtime']).strftime("%Y-%m-%d %H:%M") if entry['mtime'] else "-"
+    name = entry['name'] + ("/" if entry['type'] == 'directory' else "")
+    return f"{mode} {_human_size(entry['size'] or 0):>7} {mtime} {html.escape(name) if escape else name}"
+
+
+def _filter_sorted(entries: List[Dict[str, Any]], sort_key: str, pattern: Optional[str]) -> List[Dict[str, Any]]:
+    if pattern:
+        entries = [e for e in entries if fnmatch(e['name'], pattern)]
+    return sort_entries(entries, sort_key)
+
+
+def render_page(entries: List[Dict[str, Any]], page: int, sort_key: str = "name",
+                pattern: Optional[str] = None, page_size: int = PAGE_ENTRIES) -> Tuple[str, int, int]:
+    """
+    Формирует одну страницу листинга в HTML-разметке Telegram.
+
+    Returns:
+        Tuple[str, int, int]: Текст страницы, номер страницы (после нормализации), число страниц
+    """
+    return paginate(_filter_sorted(entries, sort_key, pattern), page, page_size)
+
+
+def paginate(entries: List[Dict[str, Any]], page: int, page_size: int = PAGE_ENTRIES) -> Tuple[str, int, int]:
+    """Страница уже отфильтрованного и отсортированного листинга (результат как у render_page)."""
+    pages = max(1, (len(entries) + page_size - 1) // page_size)
+    page = min(max(page, 0), pages - 1)
+    lines = [_format_entry(entry) for entry in entries[page * page_size:(page + 1) * page_size]]
+    return "\n".join(lines), page, pages
+
+
+def render_text(entries: List[Dict[str, Any]], sort_key: str = "name", pattern: Optional[str] = None) -> str:
+    """Весь листинг обычным текстом (без HTML) - для отправки документом."""
+    return "\n".join(_format_entry(entry, escape=False) for entry in _filter_sorted(entries, sort_key, pattern))
+
+
+listing_cache = ListingCache()
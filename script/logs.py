@@ -0,0 +1,202 @@
+"""
+Журналирование бота: запись в файл в фоновом потоке (QueueHandler/QueueListener),
+ротация logs/bot.log по размеру и по времени, обрезка больших сообщений,
+текстовый или JSON-формат и идентификатор апдейта (correlation id) в каждой записи.
+"""
+
+import os
+import copy
+import json
+import time
+import queue
+import atexit
+import logging
+import logging.handlers
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional, Union
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()  # "text" или "json"
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))  # 0 - без ротации по размеру
+LOG_ROTATE_HOURS = float(os.getenv("LOG_ROTATE_HOURS", "24"))  # 0 - без ротации по времени
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+# Сколько символов выводить из stdout/stderr и прочих больших значений
+LOG_MAX_PAYLOAD = int(os.getenv("LOG_MAX_PAYLOAD", "2000"))
+# Предел для сообщения целиком, на случай если большое значение попало в лог без shorten()
+LOG_MAX_MESSAGE = int(os.getenv("LOG_MAX_MESSAGE", "16384"))
+
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(name)s - [%(correlation_id)s] %(message)s"
+
+# Идентификатор апдейта, в рамках которого пишется запись; "-" вне обработки апдейтов
+correlation_id: ContextVar[str] = ContextVar("correlation_id", default="-")
+
+
+def _cut(text: str, limit: int) -> str:
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... [+{len(text) - limit} chars]"
+
+
+class shorten:
+    """
+    Аргумент лог-записи, который обрезается только при форматировании.
+
+    Пример:
+        logger.debug("STDOUT: %s", shorten(stdout))
+
+    Если уровень DEBUG выключен, строка не собирается и не обрезается вовсе.
+    """
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value: Any, limit: Optional[int] = None):
+        self.value = value
+        self.limit = LOG_MAX_PAYLOAD if limit is None else limit
+
+    def __str__(self) -> str:
+        value = self.value.decode(errors="replace") if isinstance(self.value, bytes) else str(self.value)
+        return _cut(value, self.limit)
+
+    def __repr__(self) -> str:
+        return _cut(repr(self.value), self.limit)
+
+
+class CorrelationFilter(logging.Filter):
+    """Добавляет в запись correlation_id текущего контекста."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "correlation_id"):
+            record.correlation_id = correlation_id.get()
+        return True
+
+
+class TruncatingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler, который собирает сообщение в вызывающем потоке (аргументы
+    могут измениться после вызова), обрезает его и передает в очередь уже без args.
+    """
+
+    def __init__(self, log_queue: queue.Queue, max_message: int = LOG_MAX_MESSAGE):
+        super().__init__(log_queue)
+        self.max_message = max_message
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        message = _cut(record.getMessage(), self.max_message)
+        record = copy.copy(record)
+        record.message = message
+        record.msg = message
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "correlation_id": getattr(record, "correlation_id", "-"),
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        if record.stack_info:
+            data["stack"] = record.stack_info
+        return json.dumps(data, ensure_ascii=False)
+
+
+class RotatingLogFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    Ротация по размеру (как RotatingFileHandler) и дополнительно раз в interval секунд.
+    Архивы нумеруются одинаково в обоих случаях: bot.log.1, bot.log.2, ...
+    """
+
+    def __init__(self, filename: Union[str, Path], max_bytes: int = LOG_MAX_BYTES,
+                 backup_count: int = LOG_BACKUP_COUNT, interval: float = LOG_ROTATE_HOURS * 3600):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True)
+        self.interval = interval
+        self.rollover_at = time.time() + interval if interval else None
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self.rollover_at is not None and time.time() >= self.rollover_at:
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self):
+        super().doRollover()
+        if self.interval:
+            self.rollover_at = time.time() + self.interval
+
+
+class LogListener(logging.handlers.QueueListener):
+    """QueueListener, который можно останавливать повторно (явно и из atexit)."""
+
+    def stop(self):
+        if self._thread is not None:
+            super().stop()
+
+
+class CorrelationMiddleware:
+    """
+    Внешняя middleware апдейтов: выставляет correlation_id на время обработки.
+    Как и HandlerMetricsMiddleware, не наследует BaseMiddleware, чтобы не импортировать aiogram.
+    """
+
+    async def __call__(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+                       event: Any, data: Dict[str, Any]) -> Any:
+        update_id = getattr(event, "update_id", None)
+        token = correlation_id.set(f"u{update_id}" if update_id is not None else "-")
+        try:
+            return await handler(event, data)
+        finally:
+            correlation_id.reset(token)
+
+
+def setup_logging(log_file: Union[str, Path], level: str = LOG_LEVEL, fmt: str = LOG_FORMAT,
+                  force: bool = False) -> Optional[LogListener]:
+    """
+    Настраивает корневой логгер: записи уходят в очередь, а в файл их пишет
+    отдельный поток QueueListener, поэтому event loop не ждет диска.
+
+    Как и logging.basicConfig, ничего не делает, если у корневого логгера уже
+    есть обработчики (например, их настроил тест или нагрузочный стенд).
+
+    Args:
+        log_file (str | Path): Путь к файлу журнала
+        level (str): Уровень корневого логгера
+        fmt (str): "text" или "json"
+        force (bool): Заменить уже настроенные обработчики
+
+    Returns:
+        Запущенный LogListener или None, если журналирование уже настроено
+    """
+    root = logging.getLogger()
+    if root.handlers and not force:
+        return None
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+
+    Path(log_file).parent.mkdir(parents=True, exist_ok=True)
+    file_handler = RotatingLogFileHandler(log_file)
+    file_handler.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+
+    log_queue: queue.Queue = queue.Queue(-1)
+    queue_handler = TruncatingQueueHandler(log_queue)
+    # Фильтр работает в вызывающем потоке, где виден контекст апдейта
+    queue_handler.addFilter(CorrelationFilter())
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = LogListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
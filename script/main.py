@@ -3,82 +3,289 @@ import sys
 import asyncio
 import logging
 from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
 
 project_root = Path(__file__).resolve().parent.parent
 sys.path.insert(0, str(project_root))
 
 from dotenv import load_dotenv
 
-from script.db import initialize_db, init_db as create_tables_if_not_exist, engine as db_engine
+if TYPE_CHECKING:
+    from aiogram import Bot, Dispatcher
 
 DATABASE_URL = f"sqlite+aiosqlite:///{project_root}/bot.db"
 LOG_FILE_PATH = project_root / "logs" / "bot.log"
+ENV_FILE_PATH = project_root / ".env"
 
-initialize_db(DATABASE_URL)
+logger = logging.getLogger(__name__)
 
-from handlers import start, help, status, vm_commands
+# Импорт модуля ничего не настраивает и не подключает: aiogram, обработчики и
+# движок БД загружаются в create_app(), а paramiko - при первой команде к ВМ
 
-from aiogram import Bot, Dispatcher
-from aiogram.enums import ParseMode
-from aiogram.client.default import DefaultBotProperties
-from aiogram.types import BotCommand
 
-LOG_FILE_PATH.parent.mkdir(parents=True, exist_ok=True)
-logging.basicConfig(
-    filename=str(LOG_FILE_PATH),
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(name)s - %(message)s"
-)
+def webhook_settings() -> Dict[str, Any]:
+    """Параметры run_webhook из окружения (читаются после load_dotenv)."""
+    return {
+        "listen_host": os.getenv("WEBHOOK_LISTEN_HOST", "0.0.0.0"),
+        "listen_port": int(os.getenv("WEBHOOK_LISTEN_PORT", "8080")),
+        "path": os.getenv("WEBHOOK_PATH", "/webhook"),
+        "base_url": os.getenv("WEBHOOK_BASE_URL"),  # публичный адрес, например https://bot.example.com
+        "secret_token": os.getenv("WEBHOOK_SECRET"),
+        "max_concurrent": int(os.getenv("WEBHOOK_MAX_CONCURRENT", "32")),
+    }
 
-logger = logging.getLogger(__name__)
 
-load_dotenv(dotenv_path=project_root / '.env')
-TOKEN = os.getenv("BOT_TOKEN")
-if not TOKEN:
-    logger.critical("BOT_TOKEN не найден. Убедитесь, что файл .env существует в корне проекта и содержит BOT_TOKEN.")
-    sys.exit("BOT_TOKEN not configured. Exiting.")
+def create_dispatcher() -> "Dispatcher":
+    """Dispatcher со всеми middleware и роутерами. БД должна быть уже инициализирована."""
+    from aiogram import Dispatcher
+    from handlers import start, help, status, vm_commands, teacher
+    from script.fsm import fsm_storage
+    from script.logs import CorrelationMiddleware
+    from script.metrics import HandlerMetricsMiddleware
+
+    # Состояния диалогов хранятся в БД: переживают перезапуск и общие для всех процессов бота
+    dp = Dispatcher(storage=fsm_storage)
+    dp.update.outer_middleware(CorrelationMiddleware())
+    dp.message.middleware(HandlerMetricsMiddleware())
+    dp.callback_query.middleware(HandlerMetricsMiddleware())
+
+    dp.include_router(start.router)
+    dp.include_router(help.router)
+    dp.include_router(status.router)
+    dp.include_router(vm_commands.router)
+    dp.include_router(teacher.router)
+    return dp
+
+
+def create_bot(token: str) -> "Bot":
+    from aiogram import Bot
+    from aiogram.enums import ParseMode
+    from aiogram.client.default import DefaultBotProperties
+    from script.delivery import RateLimitMiddleware
+    from script.metrics import registry
+
+    bot = Bot(
+        token=token,
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+    )
+    # Все исходящие запросы проходят через ограничитель частоты с повтором при flood control
+    rate_limiter = RateLimitMiddleware()
+    bot.session.middleware(rate_limiter)
+    registry.callback("telegram_requests_total", "Запросы к Bot API", "counter", lambda: rate_limiter.sent)
+    registry.callback("telegram_merged_messages_total", "Сообщения, объединенные с соседними", "counter",
+                      lambda: rate_limiter.merged)
+    registry.callback("telegram_retries_total", "Повторы после flood control", "counter",
+                      lambda: rate_limiter.retried)
+    return bot
+
+
+def create_app(token: Optional[str] = None, database_url: str = DATABASE_URL) -> Tuple["Bot", "Dispatcher"]:
+    """
+    Собирает приложение: окружение из .env, журнал, движок БД, бот и Dispatcher.
+
+    Args:
+        token (str | None): Токен бота; по умолчанию BOT_TOKEN из окружения
+        database_url (str): Адрес БД для SQLAlchemy
 
-bot = Bot(
-    token=TOKEN,
-    default=DefaultBotProperties(parse_mode=ParseMode.HTML)
-)
-dp = Dispatcher()
+    Returns:
+        Tuple[Bot, Dispatcher]: Бот и Dispatcher с подключенными роутерами
+    """
+    # .env загружается до импорта модулей script, чтобы их настройки тоже читались из него
+    load_dotenv(dotenv_path=ENV_FILE_PATH)
+    from script.logs import setup_logging
+    from script.db import initialize_db
 
-dp.include_router(start.router)
-dp.include_router(help.router)
-dp.include_router(status.router)
-dp.include_router(vm_commands.router)
+    setup_logging(LOG_FILE_PATH)
+    token = token or os.getenv("BOT_TOKEN")
+    if not token:
+        logger.critical("BOT_TOKEN не найден. Убедитесь, что файл .env существует в корне проекта и содержит BOT_TOKEN.")
+        sys.exit("BOT_TOKEN not configured. Exiting.")
+
+    initialize_db(database_url)
+    return create_bot(token), create_dispatcher()
+
+async def set_bot_commands(bot_instance: "Bot"):
+    from aiogram.types import BotCommand
 
-async def set_bot_commands(bot_instance: Bot):
     commands = [
         BotCommand(command="start", description="Запустить бота"),
         BotCommand(command="help", description="Помощь"),
         BotCommand(command="status", description="Информация о тебе"),
         BotCommand(command="vmpath", description="Указать данные ВМ (host user pass)"),
+        BotCommand(command="vmkey", description="Подключаться к ВМ по SSH-ключу"),
         BotCommand(command="check", description="Проверить подключение к ВМ"),
         BotCommand(command="ls", description="Список файлов на ВМ (опц. путь)"),
-        BotCommand(command="cat", description="Показать файл с ВМ (путь_к_файлу)"),
+        BotCommand(command="tree", description="Дерево директорий на ВМ ([путь] [глубина])"),
+        BotCommand(command="cat", description="Показать файл с ВМ (путь [смещение] [длина])"),
+        BotCommand(command="get", description="Скачать файл с ВМ (путь)"),
+        BotCommand(command="put", description="Сохранить файл на ВМ (подпись к файлу: /put [путь])"),
+        BotCommand(command="batch", description="Несколько ls/cat на ВМ за один раз"),
+        BotCommand(command="find", description="Найти файлы на ВМ ([путь] шаблон)"),
+        BotCommand(command="grep", description="Найти строки в файлах на ВМ (шаблон [путь])"),
+        BotCommand(command="tail", description="Следить за файлом на ВМ (путь [строк])"),
+        BotCommand(command="stop", description="Остановить /tail"),
+        BotCommand(command="class", description="Преподавателю: выполнить задачу на ВМ всех студентов"),
     ]
     await bot_instance.set_my_commands(commands)
 
-async def main_async():
-    await create_tables_if_not_exist()
+async def main_async(bot: "Bot", dp: "Dispatcher"):
+    from script import db
+    from script.pool import ssh_pool
+    from script.executor import ssh_executor
+    from script.tail import tail_sessions
+    from script.webhook import run_webhook
+    from script.metrics import start_metrics_server
+
+    await db.init_db()
     logger.info("Database tables initialized/checked.")
 
     await set_bot_commands(bot)
     logger.info("Bot commands set.")
-    logger.info("Starting bot polling...")
-    await dp.start_polling(bot, close_bot_session=True)
+    ssh_pool.start()
+    metrics_runner = await start_metrics_server()
+    try:
+        # Режим получения обновлений: "polling" (по умолчанию) или "webhook"
+        if os.getenv("BOT_MODE", "polling").lower() == "webhook":
+            logger.info("Starting bot in webhook mode...")
+            await run_webhook(dp, bot, **webhook_settings())
+        else:
+            logger.info("Starting bot polling...")
+            # Если раньше бот работал через webhook, getUpdates без этого вернет конфликт
+            await bot.delete_webhook()
+            await dp.start_polling(bot, close_bot_session=True)
+    finally:
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await tail_sessions.close()
+        await ssh_pool.close()
+        ssh_executor.shutdown()
+        logger.info("SSH connection pool and executor closed.")
+        # Движок закрывается в том же event loop, в котором создавались подключения
+        if db.engine:
+            logger.info("Disposing database engine.")
+            await db.engine.dispose()
+
+def worker_limits(workers: int) -> Dict[str, str]:
+    """
+    Доли общих лимитов на один рабочий процесс.
+
+    Лимит частоты отправки на бота и лимиты одновременных команд на один хост ВМ
+    каждый процесс соблюдает сам, поэтому они делятся на число процессов, чтобы в
+    сумме не превышать настроенных значений. Лимиты на чат и на пользователя не
+    делятся: пользователя и его чат обслуживает один процесс.
+
+    Args:
+        workers (int): Число рабочих процессов
+
+    Returns:
+        Dict[str, str]: Переменные окружения для рабочих процессов
+    """
+    from script.delivery import GLOBAL_RATE
+    from script.scheduler import DEFAULT_HOST_LIMIT
+    from script.executor import DEFAULT_PER_HOST_LIMIT
+
+    # Меньше одной команды на хост быть не может: при лимите меньше числа
+    # процессов на один хост одновременно идет до workers команд
+    return {
+        "TG_GLOBAL_RATE": str(GLOBAL_RATE / workers),
+        "SCHED_HOST_LIMIT": str(max(1, DEFAULT_HOST_LIMIT // workers)),
+        "SSH_PER_HOST_LIMIT": str(max(1, DEFAULT_PER_HOST_LIMIT // workers)),
+    }
+
+
+async def main_supervisor(bot: "Bot", dp: "Dispatcher", workers: int):
+    """
+    Многопроцессный режим: этот процесс только получает обновления и раздает их
+    workers рабочим процессам по пользователю (см. script.supervisor).
+    """
+    from script import db
+    from script.metrics import start_metrics_server
+    from script.supervisor import Supervisor, build_supervisor_app, poll_updates
+    from script.webhook import serve_webhook_app
+
+    # Таблицы и миграции создаются один раз, до запуска процессов
+    await db.init_db()
+    database_url = db.engine.url.render_as_string(hide_password=False)
+    await db.engine.dispose()
+    await set_bot_commands(bot)
+
+    supervisor = Supervisor(worker_main, workers, args=(bot.token, database_url, worker_limits(workers)))
+    supervisor.start()
+    logger.info("Started %s worker processes.", workers)
+    metrics_runner = await start_metrics_server()
+    try:
+        if os.getenv("BOT_MODE", "polling").lower() == "webhook":
+            settings = webhook_settings()
+            logger.info("Starting supervisor in webhook mode...")
+            app = build_supervisor_app(supervisor, path=settings["path"], secret_token=settings["secret_token"])
+            await serve_webhook_app(app, bot, **settings)
+        else:
+            logger.info("Starting supervisor polling...")
+            await bot.delete_webhook()
+            await poll_updates(bot, supervisor, allowed_updates=dp.resolve_used_update_types())
+    finally:
+        await supervisor.stop()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await bot.session.close()
+
+
+def worker_main(index: int, inbox, outbox, token: str, database_url: str = DATABASE_URL,
+                limits: Optional[Dict[str, str]] = None):
+    """Точка входа рабочего процесса многопроцессного режима (запускается через spawn)."""
+    import signal
+
+    # Ctrl+C получает вся группа процессов; рабочие останавливаются по команде супервизора
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    load_dotenv(dotenv_path=ENV_FILE_PATH)
+    # Доля общих лимитов (worker_limits) - до импорта модулей, читающих их при загрузке
+    os.environ.update(limits or {})
+    from script.logs import setup_logging
+    from script.db import initialize_db
+
+    # У каждого процесса свой файл: ротация одного файла из нескольких процессов ломается
+    setup_logging(LOG_FILE_PATH.with_name(f"bot.worker{index}.log"))
+    initialize_db(database_url)
+    asyncio.run(worker_async(index, inbox, outbox, create_bot(token), create_dispatcher()))
+
+
+async def worker_async(index: int, inbox, outbox, bot: "Bot", dp: "Dispatcher"):
+    from script import db
+    from script.pool import ssh_pool
+    from script.executor import ssh_executor
+    from script.tail import tail_sessions
+    from script.supervisor import serve_worker
+    from script.metrics import METRICS_PORT, start_metrics_server
+
+    ssh_pool.start()
+    # Метрики обработчиков каждого процесса - на соседних портах: METRICS_PORT + 1 + index
+    metrics_runner = await start_metrics_server(port=METRICS_PORT + 1 + index if METRICS_PORT else 0)
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    try:
+        await serve_worker(index, inbox, outbox, lambda update: dp.feed_raw_update(bot, update))
+    finally:
+        # Закрывает в том числе хранилище FSM, сбрасывая накопленные записи
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await tail_sessions.close()
+        await bot.session.close()
+        await ssh_pool.close()
+        ssh_executor.shutdown()
+        if db.engine:
+            await db.engine.dispose()
 
 if __name__ == "__main__":
+    bot, dp = create_app()
+    from script.supervisor import BOT_WORKERS
     try:
-        asyncio.run(main_async())
+        if BOT_WORKERS > 1:
+            asyncio.run(main_supervisor(bot, dp, BOT_WORKERS))
+        else:
+            asyncio.run(main_async(bot, dp))
     except KeyboardInterrupt:
         logger.info("Bot stopped manually")
     except Exception as e:
-        logger.critical(f"Critical error during bot execution: {e}", exc_info=True)
+        logger.critical("Critical error during bot execution: %s", e, exc_info=True)
     finally:
-        if db_engine:
-            logger.info("Disposing database engine.")
-            asyncio.run(db_engine.dispose())
         logger.info("Bot shutdown complete.") 
\ No newline at end of file
@@ -0,0 +1,242 @@
+"""
+Метрики бота в формате Prometheus: счетчики, гистограммы задержек и
+локальный HTTP-эндпоинт /metrics на aiohttp.
+"""
+
+import os
+import time
+import bisect
+import logging
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Пустой METRICS_PORT - эндпоинт не запускается
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0") or 0)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Iterable[str], values: Iterable[Any], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Монотонно растущий счетчик с метками."""
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels: Any) -> float:
+        return self.values.get(tuple(str(labels[name]) for name in self.labelnames), 0)
+
+    def collect(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in self.values.items()]
+
+
+class Gauge(Counter):
+    """Значение с метками, которое выставляется целиком (например, данные из другого процесса)."""
+    type = "gauge"
+
+    def set(self, value: float, **labels: Any):
+        self.values[tuple(str(labels[name]) for name in self.labelnames)] = value
+
+
+class Histogram:
+    """Гистограмма значений (обычно длительностей в секундах) с метками."""
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # метки -> [счетчики по корзинам (не накопительные), сумма, количество]
+        self.values: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, **labels: Any):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        series = self.values.get(key)
+        if series is None:
+            series = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    @contextmanager
+    def time(self, **labels: Any):
+        """Замеряет длительность блока with (в том числе с await внутри)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels: Any) -> int:
+        series = self.values.get(tuple(str(labels[name]) for name in self.labelnames))
+        return series[2] if series else 0
+
+    def collect(self) -> List[str]:
+        lines = []
+        for key, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class CallbackMetric:
+    """Метрика, значение которой читается из существующего объекта в момент выгрузки."""
+
+    def __init__(self, name: str, documentation: str, metric_type: str, func: Callable[[], float]):
+        self.name = name
+        self.documentation = documentation
+        self.type = metric_type
+        self.func = func
+
+    def collect(self) -> List[str]:
+        try:
+            return [f"{self.name} {_format_value(self.func())}"]
+        except Exception as e:
+            logger.warning("Metric %s callback failed: %s", self.name, e)
+            return []
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Any] = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name: str, documentation: str, metric_type: str, func: Callable[[], float]):
+        return self.register(CallbackMetric(name, documentation, metric_type, func))
+
+    def render(self) -> str:
+        """Текст в формате Prometheus text exposition 0.0.4."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+handler_duration = registry.histogram(
+    "bot_handler_duration_seconds", "Время обработки апдейта обработчиком", ("handler",))
+handler_errors = registry.counter(
+    "bot_handler_errors_total", "Необработанные исключения в обработчиках", ("handler",))
+ssh_phase_duration = registry.histogram(
+    "ssh_phase_duration_seconds", "Длительность этапов работы с SSH", ("phase", "host"))
+ssh_errors = registry.counter(
+    "ssh_errors_total", "Ошибки SSH по этапам", ("phase", "host"))
+db_duration = registry.histogram(
+    "db_operation_duration_seconds", "Длительность обращений к БД", ("operation",))
+
+
+@contextmanager
+def ssh_phase(phase: str, host: str):
+    """Замеряет этап работы с SSH и считает ошибки этого этапа."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ssh_errors.inc(phase=phase, host=host)
+        raise
+    finally:
+        ssh_phase_duration.observe(time.perf_counter() - started, phase=phase, host=host)
+
+
+class HandlerMetricsMiddleware:
+    """
+    Внутренняя middleware aiogram: время и ошибки каждого обработчика.
+
+    aiogram принимает любой вызываемый объект с сигнатурой BaseMiddleware.__call__;
+    наследование не используется, чтобы модуль метрик не импортировал aiogram.
+    """
+
+    async def __call__(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+                       event: Any, data: Dict[str, Any]) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(handler=name)
+            raise
+        finally:
+            handler_duration.observe(time.perf_counter() - started, handler=name)
+
+
+def build_metrics_app(metrics_registry: Registry = registry) -> "web.Application":
+    from aiohttp import web
+
+    async def metrics(request: web.Request) -> web.Response:
+        return web.Response(text=metrics_registry.render(), content_type="text/plain",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    return app
+
+
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> Optional["web.AppRunner"]:
+    """Запускает эндпоинт /metrics; при port=0 ничего не делает."""
+    if not port:
+        return None
+    from aiohttp import web
+
+    runner = web.AppRunner(build_metrics_app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Metrics endpoint listening on http://%s:%s/metrics", host, port)
+    return runner
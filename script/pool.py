@@ -0,0 +1,234 @@
+import os
+import time
+import asyncio
+import logging
+import weakref
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Optional, Tuple
+
+from .classes import SSHConnection, VMConfig
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Ключ пула: (user_id, host, port, username)
+PoolKey = Tuple[int, str, int, str]
+
+DEFAULT_MAX_SIZE = int(os.getenv("SSH_POOL_MAX_SIZE", "50"))
+DEFAULT_IDLE_TTL = float(os.getenv("SSH_POOL_IDLE_TTL", "300"))
+DEFAULT_KEEPALIVE = int(os.getenv("SSH_POOL_KEEPALIVE", "30"))
+
+
+class _PoolEntry:
+    __slots__ = ("connection", "config", "last_used", "in_use", "discarded")
+
+    def __init__(self, connection: SSHConnection, config: VMConfig):
+        self.connection = connection
+        self.config = config
+        self.last_used = time.monotonic()
+        self.in_use = 0
+        self.discarded = False
+
+
+class SSHConnectionPool:
+    """
+    Пул постоянных SSH-подключений пользователей.
+
+    Подключения переиспользуются между командами, пока транспорт жив.
+    Простаивающие подключения закрываются по TTL, а при достижении лимита
+    вытесняется давно не использовавшееся (LRU) свободное подключение.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE, idle_ttl: float = DEFAULT_IDLE_TTL,
+                 keepalive_interval: int = DEFAULT_KEEPALIVE):
+        """
+        Args:
+            max_size (int): Максимальное число одновременно открытых подключений
+            idle_ttl (float): Время простоя (сек), после которого подключение закрывается
+            keepalive_interval (int): Интервал SSH keepalive-пакетов (сек), 0 - отключить
+        """
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.keepalive_interval = keepalive_interval
+        self._entries: "OrderedDict[PoolKey, _PoolEntry]" = OrderedDict()
+        # Блокировка живет, пока ее кто-то держит или ждет: ключи ушедших пользователей не копятся
+        self._key_locks: "weakref.WeakValueDictionary[PoolKey, asyncio.Lock]" = weakref.WeakValueDictionary()
+        self._slots = asyncio.Condition()
+        self._pending = 0
+        self._reaper: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(user_id: int, vm_config: VMConfig) -> PoolKey:
+        return (user_id, vm_config.host, int(vm_config.port or 22), vm_config.username)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @asynccontextmanager
+    async def connection(self, user_id: int, vm_config: VMConfig):
+        """
+        Выдает живое подключение из пула (или открывает новое).
+
+        Пример:
+            async with ssh_pool.connection(user_id, vm_config) as ssh:
+                await ssh.execute_command("ls")
+        """
+        key = self.make_key(user_id, vm_config)
+        entry = await self._acquire(key, vm_config)
+        try:
+            yield entry.connection
+        finally:
+            entry.in_use -= 1
+            entry.last_used = time.monotonic()
+            if not entry.connection.is_alive():
+                self._forget(key, entry)
+                entry.discarded = True
+            if entry.discarded and entry.in_use == 0:
+                await self._close(entry)
+            async with self._slots:
+                self._slots.notify_all()
+
+    async def _acquire(self, key: PoolKey, vm_config: VMConfig) -> _PoolEntry:
+        lock = self._key_locks.get(key)
+        if lock is None:
+            lock = self._key_locks[key] = asyncio.Lock()
+        async with lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry.config != vm_config or not entry.connection.is_alive()):
+                logger.info("Dropping stale pooled connection for %s@%s:%s", key[3], key[1], key[2])
+                self._forget(key, entry)
+                entry.discarded = True
+                if entry.in_use == 0:
+                    await self._close(entry)
+                entry = None
+
+            if entry is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                entry.in_use += 1
+                return entry
+
+            self.misses += 1
+            await self._reserve_slot()
+            try:
+                connection = SSHConnection(**vm_config.as_dict(), keepalive_interval=self.keepalive_interval)
+                await connection.connect()
+                entry = _PoolEntry(connection, vm_config)
+                entry.in_use = 1
+                self._entries[key] = entry
+                return entry
+            finally:
+                async with self._slots:
+                    self._pending -= 1
+                    self._slots.notify_all()
+
+    async def _reserve_slot(self):
+        async with self._slots:
+            while len(self._entries) + self._pending >= self.max_size:
+                victim = self._pop_lru_idle()
+                if victim is not None:
+                    self.evictions += 1
+                    await self._close(victim)
+                    continue
+                logger.warning("SSH pool is full (%s), waiting for a free slot", self.max_size)
+                await self._slots.wait()
+            self._pending += 1
+
+    def _pop_lru_idle(self) -> Optional[_PoolEntry]:
+        for key, entry in self._entries.items():
+            if entry.in_use == 0:
+                del self._entries[key]
+                return entry
+        return None
+
+    def _forget(self, key: PoolKey, entry: _PoolEntry):
+        if self._entries.get(key) is entry:
+            del self._entries[key]
+
+    async def _close(self, entry: _PoolEntry):
+        try:
+            await entry.connection.run_blocking(entry.connection.disconnect)
+        except Exception as e:
+            logger.warning("Error while closing pooled connection to %s: %s", entry.connection.host, e)
+
+    async def evict_expired(self) -> int:
+        """Закрывает простаивающие дольше TTL и мертвые подключения."""
+        now = time.monotonic()
+        expired = [
+            (key, entry) for key, entry in self._entries.items()
+            if entry.in_use == 0 and (now - entry.last_used > self.idle_ttl or not entry.connection.is_alive())
+        ]
+        for key, entry in expired:
+            self._forget(key, entry)
+            self.evictions += 1
+            await self._close(entry)
+        if expired:
+            logger.info("Evicted %s idle SSH connections", len(expired))
+            async with self._slots:
+                self._slots.notify_all()
+        return len(expired)
+
+    async def invalidate_user(self, user_id: int):
+        """Удаляет из пула все подключения пользователя (например, после смены данных ВМ)."""
+        for key, entry in list(self._entries.items()):
+            if key[0] != user_id:
+                continue
+            self._forget(key, entry)
+            entry.discarded = True
+            if entry.in_use == 0:
+                await self._close(entry)
+        async with self._slots:
+            self._slots.notify_all()
+
+    async def discard(self, connection: SSHConnection):
+        """
+        Удаляет из пула одно подключение (например, зависшее посреди команды).
+        Занятое подключение закрывается, когда его вернут.
+        """
+        for key, entry in list(self._entries.items()):
+            if entry.connection is not connection:
+                continue
+            self._forget(key, entry)
+            entry.discarded = True
+            if entry.in_use == 0:
+                await self._close(entry)
+            async with self._slots:
+                self._slots.notify_all()
+            return
+
+    async def _reap_loop(self):
+        interval = max(1.0, self.idle_ttl / 2)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.evict_expired()
+            except Exception as e:
+                logger.error("SSH pool reaper error: %s", e)
+
+    def start(self):
+        """Запускает фоновую задачу очистки простаивающих подключений."""
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap_loop())
+
+    async def close(self):
+        """Останавливает очистку и закрывает все подключения пула."""
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        entries = list(self._entries.values())
+        self._entries.clear()
+        for entry in entries:
+            await self._close(entry)
+
+
+ssh_pool = SSHConnectionPool()
+
+registry.callback("ssh_pool_connections", "Открытые подключения в пуле", "gauge", lambda: len(ssh_pool))
+registry.callback("ssh_pool_hits_total", "Подключения, выданные из пула", "counter", lambda: ssh_pool.hits)
+registry.callback("ssh_pool_misses_total", "Новые подключения, открытые пулом", "counter", lambda: ssh_pool.misses)
+registry.callback("ssh_pool_evictions_total", "Подключения, вытесненные из пула", "counter",
+                  lambda: ssh_pool.evictions)
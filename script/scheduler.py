@@ -0,0 +1,157 @@
+"""
+Планировщик команд к ВМ: очереди пользователей, справедливость и обратное давление.
+"""
+
+import os
+import asyncio
+import logging
+from collections import Counter, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Optional, Set
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_USER_QUEUE = int(os.getenv("SCHED_USER_QUEUE", "5"))
+DEFAULT_HOST_LIMIT = int(os.getenv("SCHED_HOST_LIMIT", "4"))
+
+
+class QueueFull(Exception):
+    """Очередь пользователя переполнена, команда отклонена."""
+
+
+class _Job:
+    __slots__ = ("user_id", "host", "factory", "key", "future")
+
+    def __init__(self, user_id: int, host: str, factory: Callable[[], Awaitable[Any]],
+                 key: Optional[Hashable], future: asyncio.Future):
+        self.user_id = user_id
+        self.host = host
+        self.factory = factory
+        self.key = key
+        self.future = future
+
+
+class CommandScheduler:
+    """
+    Распределяет команды пользователей по хостам.
+
+    У каждого пользователя своя FIFO-очередь, и одновременно выполняется не
+    больше одной его команды. Между пользователями очереди обходятся по кругу
+    (round-robin), так что один активный пользователь не задерживает остальных.
+    На один хост одновременно выполняется не больше host_limit команд.
+    Одинаковые команды (по ключу), ожидающие в очереди, объединяются.
+    """
+
+    def __init__(self, user_queue_size: int = DEFAULT_USER_QUEUE, host_limit: int = DEFAULT_HOST_LIMIT):
+        """
+        Args:
+            user_queue_size (int): Максимум ожидающих команд одного пользователя
+            host_limit (int): Максимум одновременно выполняющихся команд на один хост
+        """
+        self.user_queue_size = user_queue_size
+        self.host_limit = host_limit
+        self._queues: Dict[int, Deque[_Job]] = {}
+        self._ready: Deque[int] = deque()
+        self._running_users: Set[int] = set()
+        self._host_active: Counter = Counter()
+        self.rejected = 0
+        self.coalesced = 0
+
+    def queue_length(self, user_id: int) -> int:
+        return len(self._queues.get(user_id, ()))
+
+    async def run(self, user_id: int, host: str, factory: Callable[[], Awaitable[Any]],
+                  key: Optional[Hashable] = None,
+                  on_queued: Optional[Callable[[int], Awaitable[Any]]] = None) -> Any:
+        """
+        Ставит команду в очередь пользователя и ждет ее результата.
+
+        Args:
+            user_id (int): Пользователь
+            host (str): Хост ВМ, на котором выполняется команда
+            factory (Callable): Функция, возвращающая корутину с самой работой
+            key (Optional[Hashable]): Ключ для объединения одинаковых ожидающих команд
+            on_queued (Optional[Callable]): Вызывается с числом команд впереди, если команде придется ждать
+
+        Returns:
+            Результат корутины
+
+        Raises:
+            QueueFull: В очереди пользователя уже user_queue_size команд
+        """
+        queue = self._queues.setdefault(user_id, deque())
+        if key is not None:
+            for job in queue:
+                if job.key == key:
+                    self.coalesced += 1
+                    return await asyncio.shield(job.future)
+        if len(queue) >= self.user_queue_size:
+            self.rejected += 1
+            logger.warning("Queue of user %s is full, rejecting command", user_id)
+            raise QueueFull(f"Too many queued commands for user {user_id}")
+
+        job = _Job(user_id, host, factory, key, asyncio.get_running_loop().create_future())
+        queue.append(job)
+        if user_id not in self._running_users and user_id not in self._ready:
+            self._ready.append(user_id)
+        self._dispatch()
+
+        if not job.future.done() and job in queue and on_queued is not None:
+            ahead = list(queue).index(job) + (1 if user_id in self._running_users else 0)
+            await on_queued(ahead)
+        return await asyncio.shield(job.future)
+
+    def _dispatch(self):
+        for _ in range(len(self._ready)):
+            user_id = self._ready.popleft()
+            queue = self._queues.get(user_id)
+            if not queue:
+                continue
+            job = queue[0]
+            if self._host_active[job.host] >= self.host_limit:
+                self._ready.append(user_id)
+                continue
+            queue.popleft()
+            self._start(job)
+
+    def _start(self, job: _Job):
+        self._running_users.add(job.user_id)
+        self._host_active[job.host] += 1
+        task = asyncio.ensure_future(job.factory())
+        task.add_done_callback(lambda t: self._finish(job, t))
+
+    def _finish(self, job: _Job, task: asyncio.Task):
+        self._running_users.discard(job.user_id)
+        self._host_active[job.host] -= 1
+        if self._host_active[job.host] <= 0:
+            del self._host_active[job.host]
+        if not job.future.done():
+            if task.cancelled():
+                job.future.cancel()
+            elif task.exception() is not None:
+                job.future.set_exception(task.exception())
+            else:
+                job.future.set_result(task.result())
+        if self._queues.get(job.user_id):
+            self._ready.append(job.user_id)
+        elif job.user_id in self._queues:
+            del self._queues[job.user_id]
+        self._dispatch()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "queued": sum(len(q) for q in self._queues.values()),
+            "running": len(self._running_users),
+            "hosts": dict(self._host_active),
+            "rejected": self.rejected,
+            "coalesced": self.coalesced,
+        }
+
+
+command_scheduler = CommandScheduler()
+
+registry.callback("scheduler_queued", "Команды, ожидающие в очередях пользователей", "gauge",
+                  lambda: command_scheduler.snapshot()["queued"])
+registry.callback("scheduler_rejected_total", "Команды, отклоненные из-за переполнения очереди", "counter",
+                  lambda: command_scheduler.rejected)
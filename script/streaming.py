@@ -0,0 +1,95 @@
+"""
+Потоковая обработка вывода с ВМ: инкрементальное декодирование, нарезка на страницы
+и чтение источника с упреждением.
+"""
+
+import codecs
+import html
+import asyncio
+from contextlib import aclosing
+from typing import AsyncIterator
+
+# Telegram ограничивает сообщение 4096 символами, оставляем запас под теги <pre>
+PAGE_SIZE = 4000
+# Самая длинная сущность, которую порождает html.escape(quote=False) - "&amp;"
+_MAX_ENTITY_LEN = 5
+
+
+async def decode_utf8_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    Декодирует поток байтов в текст, не разрывая многобайтовые символы UTF-8
+    на границах чанков.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    async with aclosing(chunks):
+        async for chunk in chunks:
+            text = decoder.decode(chunk)
+            if text:
+                yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def _safe_cut(text: str, limit: int) -> int:
+    """Позиция разреза не дальше limit, не попадающая внутрь HTML-сущности."""
+    amp = text.rfind("&", max(0, limit - _MAX_ENTITY_LEN + 1), limit)
+    if amp > 0 and text.find(";", amp, limit) == -1:
+        return amp
+    return limit
+
+
+async def iter_html_pages(pieces: AsyncIterator[str], page_size: int = PAGE_SIZE,
+                          by_lines: bool = False) -> AsyncIterator[str]:
+    """
+    Экранирует поток текста для HTML-разметки Telegram и отдает страницы
+    длиной не более page_size, как только они набраны.
+
+    При by_lines=True страница по возможности обрывается на конце строки.
+    """
+    buffer = ""
+    async with aclosing(pieces):
+        async for piece in pieces:
+            buffer += html.escape(piece, quote=False)
+            while len(buffer) >= page_size:
+                cut = _safe_cut(buffer, page_size)
+                if by_lines:
+                    cut = buffer.rfind("\n", 0, cut) + 1 or cut
+                yield buffer[:cut]
+                buffer = buffer[cut:]
+    if buffer:
+        yield buffer
+
+
+async def read_ahead(chunks: AsyncIterator[bytes], depth: int) -> AsyncIterator[bytes]:
+    """
+    Читает источник в фоновой задаче не больше чем на depth блоков вперед:
+    следующий блок уже загружается, пока потребитель обрабатывает текущий.
+
+    Очередь ограничена, поэтому медленный потребитель останавливает чтение
+    и в памяти не оказывается больше depth + 2 блоков. Ошибка источника
+    передается потребителю.
+    """
+    queue: asyncio.Queue = asyncio.Queue(depth)
+
+    async def produce():
+        try:
+            async with aclosing(chunks):
+                async for chunk in chunks:
+                    await queue.put((chunk, None))
+            await queue.put((None, None))
+        except Exception as e:
+            await queue.put((None, e))
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            chunk, error = await queue.get()
+            if error is not None:
+                raise error
+            if chunk is None:
+                break
+            yield chunk
+    finally:
+        producer.cancel()
+        await asyncio.gather(producer, return_exceptions=True)
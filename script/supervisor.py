@@ -0,0 +1,431 @@
+"""
+Многопроцессный режим: супервизор получает обновления (polling или webhook) и
+раздает их рабочим процессам по from_user.id.
+
+Все обновления одного пользователя попадают в один процесс и обрабатываются
+в нем строго по очереди, поэтому порядок сообщений и локальный кэш FSM
+(script.fsm) остаются согласованными. Упавший процесс перезапускается.
+
+Очереди процессов короткие: основной буфер - сам Telegram (getUpdates или
+повтор webhook), поэтому при падении процесса теряется немного обновлений.
+"""
+
+import os
+import time
+import queue
+import asyncio
+import logging
+import resource
+import multiprocessing
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Set
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Число рабочих процессов; 1 - обычный режим в одном процессе
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+# Сколько обновлений может ждать в очереди одного процесса, прежде чем супервизор притормозит
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "100"))
+# Сколько обновлений процесс обрабатывает одновременно (разных пользователей)
+WORKER_MAX_CONCURRENT = int(os.getenv("WORKER_MAX_CONCURRENT", "64"))
+WORKER_STATS_INTERVAL = float(os.getenv("WORKER_STATS_INTERVAL", "1"))
+# Пауза перед перезапуском; удваивается, если процесс падает сразу после старта
+WORKER_RESTART_DELAY = float(os.getenv("WORKER_RESTART_DELAY", "1"))
+WORKER_RESTART_MAX_DELAY = 30.0
+# Процесс, проработавший меньше (сек), считается упавшим при запуске
+WORKER_MIN_UPTIME = 10.0
+
+worker_dispatched = registry.counter(
+    "bot_worker_updates_total", "Обновления, переданные рабочему процессу", ("worker",))
+worker_restarts = registry.counter(
+    "bot_worker_restarts_total", "Перезапуски рабочего процесса после падения", ("worker",))
+worker_lost = registry.counter(
+    "bot_worker_lost_updates_total", "Обновления, оставшиеся в очереди или в обработке у упавшего процесса",
+    ("worker",))
+worker_pending = registry.gauge(
+    "bot_worker_pending", "Обновления в очереди и в обработке у рабочего процесса", ("worker",))
+worker_handled = registry.gauge(
+    "bot_worker_handled", "Обработанные процессом обновления с момента его запуска", ("worker",))
+worker_cpu = registry.gauge(
+    "bot_worker_cpu_ratio", "Загрузка CPU рабочим процессом (доля ядра)", ("worker",))
+worker_rss = registry.gauge(
+    "bot_worker_max_rss_bytes", "Пиковая память рабочего процесса", ("worker",))
+
+
+def route_key(update: Dict[str, Any]) -> int:
+    """
+    Ключ шардирования обновления: id пользователя, а если его нет
+    (посты каналов, опросы) - id чата или самого обновления.
+    """
+    for name, event in update.items():
+        if name == "update_id" or not isinstance(event, dict):
+            continue
+        user = event.get("from") or event.get("user")
+        if isinstance(user, dict) and "id" in user:
+            return int(user["id"])
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return int(chat["id"])
+    return int(update.get("update_id", 0))
+
+
+def _qsize(inbox) -> int:
+    try:
+        return inbox.qsize()
+    except NotImplementedError:  # macOS
+        return 0
+
+
+# --- рабочий процесс ---
+
+async def serve_worker(index: int, inbox, outbox, feed: Callable[[Dict[str, Any]], Awaitable[Any]],
+                       max_concurrent: int = WORKER_MAX_CONCURRENT,
+                       stats_interval: float = WORKER_STATS_INTERVAL,
+                       max_waiting: int = WORKER_QUEUE_SIZE):
+    """
+    Цикл рабочего процесса: берет обновления из inbox и передает их в feed.
+
+    Обновления разных пользователей обрабатываются параллельно (до max_concurrent),
+    одного пользователя - по очереди в порядке поступления. Обновление, ждущее
+    предыдущее того же пользователя, слот обработки не занимает. Статистика раз в
+    stats_interval уходит супервизору в outbox. None в inbox - сигнал завершения.
+
+    Из-за очереди по пользователю следующая команда пользователя попадает в
+    планировщик команд (script.scheduler) только после завершения предыдущей,
+    поэтому сообщение "команда в очереди" и отказ QueueFull в этом режиме не
+    возникают: лишние команды просто ждут здесь.
+
+    Args:
+        index (int): Номер процесса
+        inbox: Очередь обновлений (multiprocessing.Queue)
+        outbox: Канал статистики (пишущий конец multiprocessing.Pipe)
+        feed: Корутина-функция, обрабатывающая одно обновление (обычно dp.feed_raw_update)
+        max_concurrent (int): Максимум одновременно обрабатываемых обновлений
+        stats_interval (float): Период отправки статистики (сек)
+        max_waiting (int): Сколько обновлений может ждать сверх обрабатываемых;
+            дальше процесс перестает брать новые из inbox
+    """
+    loop = asyncio.get_running_loop()
+    parent = os.getppid()
+    slots = asyncio.Semaphore(max_concurrent)
+    admitted = asyncio.Semaphore(max_concurrent + max_waiting)
+    # Пользователь -> последняя его задача; следующая ждет ее завершения
+    tails: Dict[int, asyncio.Task] = {}
+    tasks: Set[asyncio.Task] = set()
+    counts = {"handled": 0, "failed": 0}
+
+    async def handle(update: Dict[str, Any], previous: Optional[asyncio.Task]):
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            async with slots:
+                await feed(update)
+            counts["handled"] += 1
+        except Exception as e:
+            counts["failed"] += 1
+            logger.error("Worker %s failed to handle update %s: %s", index, update.get("update_id"), e,
+                         exc_info=True)
+        finally:
+            admitted.release()
+
+    def forget(key: int, task: asyncio.Task):
+        tasks.discard(task)
+        if tails.get(key) is task:
+            del tails[key]
+
+    def report():
+        outbox.send({
+            "worker": index,
+            "pid": os.getpid(),
+            "handled": counts["handled"],
+            "failed": counts["failed"],
+            "in_flight": len(tasks),
+            "cpu_seconds": time.process_time(),
+            "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        })
+
+    def next_update():
+        # Таймаут нужен, чтобы заметить пропажу супервизора и не висеть в get() вечно
+        while True:
+            try:
+                return inbox.get(timeout=stats_interval)
+            except queue.Empty:
+                if os.getppid() != parent:
+                    logger.warning("Worker %s: supervisor is gone, stopping", index)
+                    return None
+
+    async def reporter():
+        while True:
+            report()
+            await asyncio.sleep(stats_interval)
+
+    reporter_task = asyncio.create_task(reporter())
+    try:
+        while True:
+            update = await loop.run_in_executor(None, next_update)
+            if update is None:
+                break
+            await admitted.acquire()
+            key = route_key(update)
+            task = asyncio.create_task(handle(update, tails.get(key)))
+            tails[key] = task
+            tasks.add(task)
+            task.add_done_callback(lambda done, key=key: forget(key, done))
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        reporter_task.cancel()
+        report()
+
+
+# --- супервизор ---
+
+class Worker:
+    """Состояние одного рабочего процесса на стороне супервизора."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.inbox = None
+        self.stats_reader = None
+        self.process: Optional[multiprocessing.process.BaseProcess] = None
+        self.started_at = 0.0
+        self.restart_delay: Optional[float] = None
+        self.respawn_at: Optional[float] = None
+        self.dispatched = 0
+        self.restarts = 0
+        self.stats: Dict[str, Any] = {}
+        self.cpu_ratio = 0.0
+        self._cpu_sample: Optional[tuple] = None
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    @property
+    def pending(self) -> int:
+        queued = _qsize(self.inbox) if self.inbox is not None else 0
+        return queued + self.stats.get("in_flight", 0)
+
+    def update_stats(self, stats: Dict[str, Any]):
+        now = time.monotonic()
+        if self._cpu_sample and self._cpu_sample[0] == stats["pid"] and now > self._cpu_sample[1]:
+            self.cpu_ratio = (stats["cpu_seconds"] - self._cpu_sample[2]) / (now - self._cpu_sample[1])
+        self._cpu_sample = (stats["pid"], now, stats["cpu_seconds"])
+        self.stats = stats
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "worker": self.index,
+            "pid": getattr(self.process, "pid", None),
+            "alive": self.alive,
+            "dispatched": self.dispatched,
+            "pending": self.pending,
+            "handled": self.stats.get("handled", 0),
+            "failed": self.stats.get("failed", 0),
+            "cpu_ratio": round(self.cpu_ratio, 3),
+            "max_rss_bytes": self.stats.get("max_rss_bytes", 0),
+            "restarts": self.restarts,
+        }
+
+
+class Supervisor:
+    """
+    Запускает рабочие процессы, раздает им обновления и перезапускает упавшие.
+
+    Каждый запуск процесса получает новые очередь и канал статистики: процесс,
+    упавший посреди inbox.get(), оставляет блокировку очереди занятой навсегда.
+
+    Args:
+        target: Функция рабочего процесса target(index, inbox, outbox, *args);
+            должна импортироваться по имени (процессы запускаются через spawn)
+        workers (int): Число процессов
+        args (Sequence): Дополнительные аргументы target
+        queue_size (int): Размер очереди одного процесса
+        restart_delay (float): Пауза перед перезапуском упавшего процесса (сек)
+    """
+
+    def __init__(self, target: Callable[..., Any], workers: int = BOT_WORKERS, args: Sequence[Any] = (),
+                 queue_size: int = WORKER_QUEUE_SIZE, restart_delay: float = WORKER_RESTART_DELAY):
+        # spawn: дочерний процесс не наследует event loop, соединения и потоки супервизора
+        self.context = multiprocessing.get_context("spawn")
+        self.target = target
+        self.args = tuple(args)
+        self.restart_delay = restart_delay
+        self.queue_size = queue_size
+        self.workers = [Worker(index) for index in range(workers)]
+        self._stopping = False
+        self._monitor_task: Optional[asyncio.Task] = None
+
+    def _spawn(self, worker: Worker):
+        worker.inbox = self.context.Queue(self.queue_size)
+        worker.stats_reader, stats_writer = self.context.Pipe(duplex=False)
+        worker.process = self.context.Process(
+            target=self.target, args=(worker.index, worker.inbox, stats_writer, *self.args),
+            name=f"bot-worker-{worker.index}", daemon=True,
+        )
+        worker.process.start()
+        # Пишущий конец остается только у процесса: после его выхода чтение вернет EOF
+        stats_writer.close()
+        asyncio.get_running_loop().add_reader(worker.stats_reader.fileno(), self._read_stats, worker)
+        worker.started_at = time.monotonic()
+        worker.respawn_at = None
+        worker.stats = {}
+        worker.cpu_ratio = 0.0
+        logger.info("Worker %s started (pid %s)", worker.index, worker.process.pid)
+
+    def _read_stats(self, worker: Worker):
+        if worker.stats_reader is None:
+            return
+        try:
+            while worker.stats_reader.poll():
+                worker.update_stats(worker.stats_reader.recv())
+        except (EOFError, OSError):
+            self._close_stats(worker)
+
+    def _close_stats(self, worker: Worker):
+        if worker.stats_reader is not None:
+            asyncio.get_running_loop().remove_reader(worker.stats_reader.fileno())
+            worker.stats_reader.close()
+            worker.stats_reader = None
+
+    def _discard_inbox(self, worker: Worker) -> int:
+        """Закрывает очередь упавшего процесса; возвращает, сколько обновлений в ней пропало."""
+        lost = worker.pending
+        worker.inbox.cancel_join_thread()
+        worker.inbox.close()
+        worker.inbox = None
+        return lost
+
+    def start(self):
+        for worker in self.workers:
+            self._spawn(worker)
+        self._monitor_task = asyncio.create_task(self._monitor())
+
+    def worker_for(self, update: Dict[str, Any]) -> Worker:
+        return self.workers[route_key(update) % len(self.workers)]
+
+    async def dispatch(self, update: Dict[str, Any]):
+        """Передает обновление процессу пользователя; ждет, если его очередь заполнена."""
+        worker = self.worker_for(update)
+        while True:
+            # Пока процесс перезапускается, очереди нет - обновление ждет нового процесса
+            if worker.inbox is not None:
+                try:
+                    worker.inbox.put_nowait(update)
+                    break
+                except queue.Full:
+                    pass
+            await asyncio.sleep(0.01)
+        worker.dispatched += 1
+        worker_dispatched.inc(worker=worker.index)
+
+    async def _monitor(self):
+        while not self._stopping:
+            now = time.monotonic()
+            for worker in self.workers:
+                if worker.alive or self._stopping:
+                    continue
+                if worker.respawn_at is None:
+                    # Повторное падение сразу после запуска - увеличиваем паузу, чтобы не крутиться в цикле
+                    if worker.restart_delay is not None and now - worker.started_at < WORKER_MIN_UPTIME:
+                        worker.restart_delay = min(worker.restart_delay * 2, WORKER_RESTART_MAX_DELAY)
+                    else:
+                        worker.restart_delay = self.restart_delay
+                    worker.respawn_at = now + worker.restart_delay
+                    self._read_stats(worker)
+                    lost = self._discard_inbox(worker)
+                    if lost:
+                        worker_lost.inc(lost, worker=worker.index)
+                    logger.error("Worker %s (pid %s) exited with code %s, %s updates lost, restarting in %.1fs",
+                                 worker.index, worker.process.pid, worker.process.exitcode, lost,
+                                 worker.restart_delay)
+                elif now >= worker.respawn_at:
+                    worker.restarts += 1
+                    worker_restarts.inc(worker=worker.index)
+                    self._close_stats(worker)
+                    self._spawn(worker)
+            self._export()
+            await asyncio.sleep(0.2)
+
+    def _export(self):
+        for worker in self.workers:
+            worker_pending.set(worker.pending, worker=worker.index)
+            worker_handled.set(worker.stats.get("handled", 0), worker=worker.index)
+            worker_cpu.set(round(worker.cpu_ratio, 3), worker=worker.index)
+            worker_rss.set(worker.stats.get("max_rss_bytes", 0), worker=worker.index)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Нагрузка по процессам: очередь, обработано, CPU, память, перезапуски."""
+        return [worker.as_dict() for worker in self.workers]
+
+    async def stop(self, timeout: float = 30.0):
+        """Дает процессам дообработать очереди и останавливает их."""
+        self._stopping = True
+        loop = asyncio.get_running_loop()
+        for worker in self.workers:
+            if worker.alive and worker.inbox is not None:
+                await loop.run_in_executor(None, worker.inbox.put, None)
+        deadline = time.monotonic() + timeout
+        for worker in self.workers:
+            if worker.process is None:
+                continue
+            await loop.run_in_executor(None, worker.process.join, max(0.0, deadline - time.monotonic()))
+            if worker.process.is_alive():
+                logger.warning("Worker %s did not stop in time, terminating", worker.index)
+                worker.process.terminate()
+                await loop.run_in_executor(None, worker.process.join, 5)
+            # Последняя статистика процесса уже в канале
+            self._read_stats(worker)
+            self._close_stats(worker)
+        if self._monitor_task is not None:
+            await asyncio.gather(self._monitor_task, return_exceptions=True)
+        self._export()
+        logger.info("All workers stopped.")
+
+
+# --- источники обновлений ---
+
+async def poll_updates(bot, supervisor: Supervisor, allowed_updates: Optional[List[str]] = None,
+                       timeout: int = 30):
+    """Long polling в супервизоре: обновления не разбираются, а сразу уходят процессам."""
+    offset = None
+    backoff = 1.0
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=timeout, allowed_updates=allowed_updates,
+                                            request_timeout=timeout + 10)
+        except Exception as e:
+            logger.error("getUpdates failed: %s, retrying in %.0fs", e, backoff)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+            continue
+        backoff = 1.0
+        for update in updates:
+            await supervisor.dispatch(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+            offset = update.update_id + 1
+
+
+def build_supervisor_app(supervisor: Supervisor, path: str = "/webhook", secret_token: Optional[str] = None):
+    """
+    aiohttp-приложение webhook для супервизора: проверяет секрет, отдает
+    обновление процессу и сразу отвечает Telegram. /healthz - нагрузка по процессам.
+    """
+    from aiohttp import web
+    from .webhook import HEALTH_PATH
+
+    async def webhook(request: web.Request) -> web.Response:
+        if secret_token and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != secret_token:
+            return web.Response(status=401, text="Unauthorized")
+        await supervisor.dispatch(await request.json())
+        return web.json_response({})
+
+    async def health(request: web.Request) -> web.Response:
+        workers = supervisor.stats()
+        status = "ok" if all(worker["alive"] for worker in workers) else "degraded"
+        return web.json_response({"status": status, "workers": workers})
+
+    app = web.Application()
+    app.router.add_post(path, webhook)
+    app.router.add_get(HEALTH_PATH, health)
+    return app
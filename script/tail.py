@@ -0,0 +1,211 @@
+"""
+Режим /tail: удаленный tail -F держит один канал открытым, новые байты
+складываются в окно из последних строк, а одно сообщение Telegram
+редактируется не чаще раза в TAIL_EDIT_INTERVAL секунд.
+"""
+
+import os
+import html
+import time
+import codecs
+import asyncio
+import logging
+from collections import deque
+from contextlib import AbstractAsyncContextManager
+from typing import Awaitable, Callable, Deque, Dict, Optional
+
+from .metrics import registry
+from .streaming import PAGE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних строк показывать
+TAIL_LINES = int(os.getenv("TAIL_LINES", "30"))
+# Не чаще одного редактирования сообщения за столько секунд
+TAIL_EDIT_INTERVAL = float(os.getenv("TAIL_EDIT_INTERVAL", "3"))
+# Остановка, если столько секунд не было новых строк
+TAIL_IDLE_TIMEOUT = float(os.getenv("TAIL_IDLE_TIMEOUT", "600"))
+# Максимальная длительность одного /tail
+TAIL_MAX_DURATION = float(os.getenv("TAIL_MAX_DURATION", "3600"))
+# Длиннее строки обрезаются
+TAIL_MAX_LINE = 500
+
+# Причина остановки -> текст для пользователя
+STOP_REASONS = {
+    "stop": "по команде /stop",
+    "replaced": "запущен новый /tail",
+    "idle": "нет новых строк",
+    "duration": "превышено время наблюдения",
+    "ended": "команда на ВМ завершилась",
+    "error": "ошибка",
+    "shutdown": "бот перезапускается",
+}
+
+tail_edits = registry.counter("tail_edits_total", "Редактирования сообщений /tail")
+tail_bytes = registry.counter("tail_received_bytes_total", "Байты, полученные потоками /tail")
+
+
+class TailWindow:
+    """Последние max_lines строк потока; текст собирается с учетом многобайтовых символов."""
+
+    def __init__(self, max_lines: int = TAIL_LINES, max_chars: int = PAGE_SIZE - 200):
+        self.lines: Deque[str] = deque(maxlen=max_lines)
+        self.max_chars = max_chars
+        self.partial = ""
+        self.changed = False
+        self.received = 0
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    def feed(self, data: bytes):
+        self.received += len(data)
+        *complete, self.partial = (self.partial + self._decoder.decode(data)).split("\n")
+        for line in complete:
+            self.lines.append(self._cut(line.rstrip("\r")))
+        if len(self.partial) > TAIL_MAX_LINE:
+            self.lines.append(self._cut(self.partial))
+            self.partial = ""
+        self.changed = True
+
+    @staticmethod
+    def _cut(line: str) -> str:
+        return line if len(line) <= TAIL_MAX_LINE else line[:TAIL_MAX_LINE] + "…"
+
+    def render(self) -> str:
+        """Окно, экранированное для HTML; старые строки отбрасываются, чтобы уложиться в max_chars."""
+        lines = list(self.lines) + ([self.partial] if self.partial else [])
+        escaped = deque(html.escape(line, quote=False) for line in lines)
+        total = sum(len(line) + 1 for line in escaped)
+        while escaped and total > self.max_chars:
+            total -= len(escaped.popleft()) + 1
+        self.changed = False
+        return "\n".join(escaped)
+
+
+class TailSession:
+    """
+    Одно наблюдение за файлом.
+
+    Args:
+        open_stream: Фабрика async-контекста, отдающего поток с read_available() (CommandStream)
+        publish: Корутина publish(window_html, reason); reason=None - промежуточное обновление.
+            Возвращает False, если сообщение больше нельзя обновлять (например, удалено):
+            наблюдение тогда останавливается с причиной "gone"
+        edit_interval (float): Минимальный интервал между редактированиями (сек)
+        idle_timeout (float): Остановка без новых данных (сек)
+        max_duration (float): Максимальная длительность (сек)
+    """
+
+    def __init__(self, open_stream: Callable[[], AbstractAsyncContextManager],
+                 publish: Callable[[str, Optional[str]], Awaitable[bool]], lines: int = TAIL_LINES,
+                 edit_interval: float = TAIL_EDIT_INTERVAL, idle_timeout: float = TAIL_IDLE_TIMEOUT,
+                 max_duration: float = TAIL_MAX_DURATION):
+        self.open_stream = open_stream
+        self.publish = publish
+        self.window = TailWindow(lines)
+        self.edit_interval = edit_interval
+        self.idle_timeout = idle_timeout
+        self.max_duration = max_duration
+        self.reason: Optional[str] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def stop(self, reason: str = "stop"):
+        if self.task is not None and not self.task.done():
+            self.reason = self.reason or reason
+            self.task.cancel()
+
+    async def run(self) -> str:
+        """Следит за потоком до остановки; возвращает причину остановки."""
+        try:
+            async with self.open_stream() as stream:
+                reason = await self._follow(stream)
+        except asyncio.CancelledError:
+            # Отмена задачи - штатная остановка, если ее запросили через stop()
+            if self.reason is None:
+                raise
+            reason = self.reason
+        except Exception as e:
+            logger.error("Tail stream failed: %s", e)
+            self.window.feed(f"\n{e}".encode())
+            reason = "error"
+        self.reason = reason
+        if reason == "gone":
+            return reason
+        try:
+            await self.publish(self.window.render(), reason)
+        except Exception as e:
+            logger.warning("Cannot publish final tail message: %s", e)
+        return reason
+
+    async def _follow(self, stream) -> str:
+        now = time.monotonic()
+        deadline = now + self.max_duration
+        last_data = now
+        # Первые строки показываем сразу, дальше - не чаще edit_interval
+        next_edit = now
+        while True:
+            now = time.monotonic()
+            if self.window.changed and now >= next_edit:
+                tail_edits.inc()
+                if not await self.publish(self.window.render(), None):
+                    return "gone"
+                next_edit = now + self.edit_interval
+            if now >= deadline:
+                return "duration"
+            if now - last_data >= self.idle_timeout:
+                return "idle"
+            wait = min(deadline, last_data + self.idle_timeout) - now
+            if self.window.changed:
+                wait = min(wait, next_edit - now)
+            try:
+                data = await stream.read_available(timeout=max(wait, 0))
+            except asyncio.TimeoutError:
+                continue
+            if not data:
+                return "ended"
+            tail_bytes.inc(len(data))
+            self.window.feed(data)
+            last_data = time.monotonic()
+
+
+class TailRegistry:
+    """Активные /tail по пользователям: у пользователя не больше одного наблюдения."""
+
+    def __init__(self):
+        self.sessions: Dict[int, TailSession] = {}
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    def start(self, user_id: int, session: TailSession) -> asyncio.Task:
+        """Запускает наблюдение в фоне, останавливая предыдущее наблюдение пользователя."""
+        previous = self.sessions.get(user_id)
+        if previous is not None:
+            previous.stop("replaced")
+        self.sessions[user_id] = session
+        session.task = asyncio.create_task(session.run())
+
+        def forget(_):
+            if self.sessions.get(user_id) is session:
+                del self.sessions[user_id]
+
+        session.task.add_done_callback(forget)
+        return session.task
+
+    def stop(self, user_id: int) -> bool:
+        session = self.sessions.get(user_id)
+        if session is None:
+            return False
+        session.stop("stop")
+        return True
+
+    async def close(self):
+        """Останавливает все наблюдения (при остановке бота) и ждет финальных сообщений."""
+        sessions = list(self.sessions.values())
+        for session in sessions:
+            session.stop("shutdown")
+        await asyncio.gather(*(session.task for session in sessions), return_exceptions=True)
+
+
+tail_sessions = TailRegistry()
+
+registry.callback("tail_sessions", "Активные /tail", "gauge", lambda: len(tail_sessions))
@@ -1,124 +1,131 @@
+import io
+import stat
 import pytest
 import paramiko
-from unittest.mock import Mock, patch
-from ..classes import FileOperations
+from unittest.mock import Mock
+from script.classes import FileOperations, SSHConnection
+
+
+class FakeExecutor:
+    """Выполняет блокирующие вызовы сразу, без пула потоков."""
+
+    async def run(self, host, func, *args, **kwargs):
+        return func(*args, **kwargs)
+
+
+def make_attr(name, mode, size=10, mtime=1700000000):
+    attr = paramiko.SFTPAttributes()
+    attr.filename = name
+    attr.st_mode = mode
+    attr.st_size = size
+    attr.st_mtime = mtime
+    return attr
+
+
+@pytest.fixture
+def mock_sftp():
+    """Фикстура для создания мок-объекта SFTP-клиента."""
+    sftp = Mock(spec=paramiko.SFTPClient)
+    sftp.sock = Mock(closed=False)
+    return sftp
+
 
 @pytest.fixture
-def mock_ssh_client():
-    """Фикстура для создания мок-объекта SSH-клиента."""
-    client = Mock(spec=paramiko.SSHClient)
-    return client
+def connection(mock_sftp):
+    """Фикстура для создания активного SSH-подключения с мок-клиентом."""
+    conn = SSHConnection("vm.local", username="user", executor=FakeExecutor())
+    conn.client = Mock(spec=paramiko.SSHClient)
+    conn.client.open_sftp.return_value = mock_sftp
+    conn.transport = Mock(is_active=Mock(return_value=True))
+    return conn
+
 
 @pytest.fixture
-def file_operations(mock_ssh_client):
+def file_operations(connection):
     """Фикстура для создания экземпляра FileOperations."""
-    return FileOperations(mock_ssh_client)
+    return FileOperations(connection)
+
 
 @pytest.mark.asyncio
-async def test_list_directory_success(file_operations, mock_ssh_client):
+async def test_list_directory_success(file_operations, mock_sftp):
     """Тест успешного получения списка файлов."""
-    # Подготовка мок-данных
-    mock_stdout = Mock()
-    mock_stdout.read.return_value = b"""total 8
-drwxr-xr-x 2 user user 4096 Mar 10 10:00 .
-drwxr-xr-x 3 root root 4096 Mar 10 09:00 ..
--rw-r--r-- 1 user user   10 Mar 10 10:00 test.txt
-drwxr-xr-x 2 user user 4096 Mar 10 10:00 test_dir"""
-    
-    mock_stderr = Mock()
-    mock_stderr.read.return_value = b""
-    
-    mock_ssh_client.exec_command.return_value = (None, mock_stdout, mock_stderr)
-    
-    # Выполнение теста
-    result = await file_operations.list_directory()
-    
-    # Проверки
-    assert len(result) == 2  # test.txt и test_dir
-    assert any(f['name'] == 'test.txt' and f['type'] == 'file' for f in result)
+    mock_sftp.listdir_attr.return_value = [
+        make_attr("test.txt", stat.S_IFREG | 0o644),
+        make_attr("test_dir", stat.S_IFDIR | 0o755, size=4096),
+    ]
+
+    result = await file_operations.list_directory("~")
+
+    assert len(result) == 2
+    assert any(f['name'] == 'test.txt' and f['type'] == 'file' and f['size'] == 10 for f in result)
     assert any(f['name'] == 'test_dir' and f['type'] == 'directory' for f in result)
-    mock_ssh_client.exec_command.assert_called_once_with("ls -la ~")
+    mock_sftp.listdir_attr.assert_called_once_with(".")
+
 
 @pytest.mark.asyncio
-async def test_list_directory_error(file_operations, mock_ssh_client):
+async def test_list_directory_error(file_operations, mock_sftp):
     """Тест обработки ошибки при получении списка файлов."""
-    # Подготовка мок-данных с ошибкой
-    mock_stderr = Mock()
-    mock_stderr.read.return_value = b"Permission denied"
-    
-    mock_ssh_client.exec_command.return_value = (None, Mock(), mock_stderr)
-    
-    # Проверка выброса исключения
-    with pytest.raises(Exception) as exc_info:
-        await file_operations.list_directory()
-    
-    assert "Failed to list directory" in str(exc_info.value)
+    mock_sftp.listdir_attr.side_effect = PermissionError("Permission denied")
+
+    with pytest.raises(PermissionError) as exc_info:
+        await file_operations.list_directory("/root")
+
+    assert "Permission denied" in str(exc_info.value)
+
 
 @pytest.mark.asyncio
-async def test_read_text_files_success(file_operations, mock_ssh_client):
-    """Тест успешного чтения текстовых файлов."""
-    # Подготовка мок-данных для list_directory
-    mock_stdout_ls = Mock()
-    mock_stdout_ls.read.return_value = b"""total 4
-drwxr-xr-x 2 user user 4096 Mar 10 10:00 .
--rw-r--r-- 1 user user   10 Mar 10 10:00 test.txt"""
-    
-    mock_stderr_ls = Mock()
-    mock_stderr_ls.read.return_value = b""
-    
-    # Подготовка мок-данных для file
-    mock_stdout_file = Mock()
-    mock_stdout_file.read.return_value = b"test.txt: ASCII text"
-    
-    # Подготовка мок-данных для cat
-    mock_stdout_cat = Mock()
-    mock_stdout_cat.read.return_value = b"test content"
-    
-    mock_stderr = Mock()
-    mock_stderr.read.return_value = b""
-    
-    # Настройка последовательных вызовов exec_command
-    mock_ssh_client.exec_command.side_effect = [
-        (None, mock_stdout_ls, mock_stderr_ls),  # для ls
-        (None, mock_stdout_file, mock_stderr),   # для file
-        (None, mock_stdout_cat, mock_stderr)     # для cat
-    ]
-    
-    # Выполнение теста
-    result = await file_operations.read_text_files()
-    
-    # Проверки
-    assert len(result) == 1
-    assert 'test.txt' in result
-    assert result['test.txt'] == 'test content'
-    assert mock_ssh_client.exec_command.call_count == 3
+async def test_sftp_session_is_reused(file_operations, connection, mock_sftp):
+    """Тест повторного использования одной SFTP-сессии подключения."""
+    mock_sftp.listdir_attr.return_value = []
+    mock_sftp.stat.return_value = make_attr("a", stat.S_IFREG)
+
+    await file_operations.list_directory()
+    await file_operations.stat("a")
+    await FileOperations(connection).list_directory("docs")
+
+    connection.client.open_sftp.assert_called_once()
+
 
 @pytest.mark.asyncio
-async def test_read_text_files_no_text_files(file_operations, mock_ssh_client):
-    """Тест чтения директории без текстовых файлов."""
-    # Подготовка мок-данных
-    mock_stdout_ls = Mock()
-    mock_stdout_ls.read.return_value = b"""total 4
-drwxr-xr-x 2 user user 4096 Mar 10 10:00 .
--rw-r--r-- 1 user user   10 Mar 10 10:00 test.bin"""
-    
-    mock_stderr_ls = Mock()
-    mock_stderr_ls.read.return_value = b""
-    
-    mock_stdout_file = Mock()
-    mock_stdout_file.read.return_value = b"test.bin: data"
-    
-    mock_stderr = Mock()
-    mock_stderr.read.return_value = b""
-    
-    mock_ssh_client.exec_command.side_effect = [
-        (None, mock_stdout_ls, mock_stderr_ls),
-        (None, mock_stdout_file, mock_stderr)
-    ]
-    
-    # Выполнение теста
-    result = await file_operations.read_text_files()
-    
-    # Проверки
-    assert len(result) == 0
-    assert mock_ssh_client.exec_command.call_count == 2 
\ No newline at end of file
+async def test_batched_helpers(file_operations, mock_sftp):
+    """Тест пакетных stat и чтения нескольких директорий."""
+    def fake_stat(path):
+        if path == "missing":
+            raise FileNotFoundError(path)
+        return make_attr(path, stat.S_IFREG)
+
+    def fake_listdir(path):
+        if path == "locked":
+            raise PermissionError(path)
+        return [make_attr(f"{path}.txt", stat.S_IFREG)]
+
+    mock_sftp.stat.side_effect = fake_stat
+    mock_sftp.listdir_attr.side_effect = fake_listdir
+
+    stats = await file_operations.stat_many(["a", "missing"])
+    assert stats["a"].filename == "a"
+    assert stats["missing"] is None
+
+    listings = await file_operations.list_directories(["docs", "locked"])
+    assert listings["docs"][0]['name'] == "docs.txt"
+    assert isinstance(listings["locked"], PermissionError)
+
+
+@pytest.mark.asyncio
+async def test_read_text_file_success(file_operations, mock_sftp):
+    """Тест успешного чтения текстового файла."""
+    mock_sftp.open.return_value = io.BytesIO("test content\nтекст".encode())
+
+    result = "".join([piece async for piece in file_operations.read_text_file("test.txt")])
+
+    assert result == "test content\nтекст"
+    mock_sftp.open.assert_called_once_with("test.txt", "rb")
+
+
+@pytest.mark.asyncio
+async def test_read_text_file_not_text(file_operations, mock_sftp):
+    """Тест чтения бинарного файла."""
+    mock_sftp.open.return_value = io.BytesIO(b"\x7fELF\x00\x00binary")
+
+    with pytest.raises(ValueError):
+        [piece async for piece in file_operations.read_text_file("test.bin")]
@@ -0,0 +1,74 @@
+import stat
+
+from script.listing import ListingCache, render_page
+
+
+def entry(name, size=0, mtime=0, directory=False):
+    return {
+        'name': name,
+        'type': 'directory' if directory else 'file',
+        'size': size,
+        'mtime': mtime,
+        'mode': (stat.S_IFDIR if directory else stat.S_IFREG) | 0o644,
+    }
+
+
+ENTRIES = [entry(f"file{i:03}.txt", size=i, mtime=1700000000 + i) for i in range(95)] + [
+    entry("src", directory=True),
+    entry("notes.md", size=500),
+]
+
+
+def test_pagination_and_default_sort():
+    text, page, pages = render_page(ENTRIES, 0, page_size=40)
+    assert (page, pages) == (0, 3)
+    assert text.splitlines()[0].endswith("src/")
+    assert len(text.splitlines()) == 40
+
+    _, page, _ = render_page(ENTRIES, 10, page_size=40)
+    assert page == 2
+
+
+def test_sort_by_size_and_mtime():
+    text, _, _ = render_page(ENTRIES, 0, "size")
+    assert text.splitlines()[0].endswith("notes.md")
+    text, _, _ = render_page(ENTRIES, 0, "mtime")
+    assert text.splitlines()[0].endswith("file094.txt")
+
+
+def test_glob_filter():
+    text, _, pages = render_page(ENTRIES, 0, pattern="*.md")
+    assert pages == 1
+    assert text.endswith("notes.md")
+
+
+def test_cache_lru_and_views():
+    cache = ListingCache(ttl=60, max_entries=2)
+    cache.put(1, "a", [], 1)
+    cache.put(1, "b", [], 1)
+    cache.get(1, "a")
+    cache.put(1, "c", [], 1)
+    assert cache.get(1, "b") is None
+    assert cache.get(1, "a").is_fresh(cache.ttl)
+
+    view = cache.register_view(1, "/var/log", "*.log", cache.get(1, "a"))
+    assert len(f"ls:{view.view_id}:999:mtime") <= 64
+    assert cache.get_view(1, view.view_id).pattern == "*.log"
+    assert cache.get_view(2, view.view_id) is None
+
+    cache.invalidate_user(1)
+    assert cache.get(1, "a") is None
+    assert cache.get_view(1, view.view_id) is None
+
+
+def test_view_pages_through_its_snapshot():
+    cache = ListingCache(ttl=0)
+    snapshot = cache.put(1, ".", ENTRIES, 1)
+    view = cache.register_view(1, ".", "file*", snapshot)
+    # Снимок в кэше уже устарел и заменен, а просмотр показывает свой
+    cache.put(1, ".", [], 2)
+    text, page, pages = view.render_page(1, "name")
+    assert (page, pages) == (1, 3)
+    assert text == render_page(ENTRIES, 1, "name", "file*")[0]
+    # Отсортированный список вычисляется один раз на способ сортировки
+    assert view.entries("size") is view.entries("size")
@@ -0,0 +1,58 @@
+import html
+
+from script.streaming import decode_utf8_stream, iter_html_pages
+
+
+async def agen(items):
+    for item in items:
+        yield item
+
+
+async def collect(gen):
+    return [item async for item in gen]
+
+
+async def test_decode_does_not_split_multibyte_chars():
+    data = "Привет, мир! ✓".encode("utf-8")
+    # Режем по одному байту, чтобы каждая кириллическая буква попала на границу
+    chunks = [data[i:i + 1] for i in range(len(data))]
+    text = "".join(await collect(decode_utf8_stream(agen(chunks))))
+    assert text == "Привет, мир! ✓"
+
+
+async def test_decode_replaces_truncated_tail():
+    text = "".join(await collect(decode_utf8_stream(agen([b"ok", "я".encode()[:1]]))))
+    assert text == "ok�"
+
+
+async def test_pages_respect_size_and_entities():
+    source = "a<b>&c" * 1000
+    pages = await collect(iter_html_pages(agen([source[:777], source[777:]]), page_size=100))
+    assert all(0 < len(page) <= 100 for page in pages)
+    for page in pages:
+        # Ни одна страница не заканчивается обрывком сущности
+        tail = page[page.rfind("&"):] if "&" in page else ""
+        assert not tail or ";" in tail
+    assert html.unescape("".join(pages)) == source
+
+
+async def test_pages_are_yielded_before_source_is_exhausted():
+    consumed = []
+
+    async def source():
+        for i in range(3):
+            consumed.append(i)
+            yield "x" * 50
+
+    pages = iter_html_pages(source(), page_size=40)
+    first = await pages.__anext__()
+    assert first == "x" * 40
+    assert consumed == [0]
+    await pages.aclose()
+
+
+async def test_pages_by_lines_cut_at_newline():
+    lines = [f"result {i}\n" for i in range(20)]
+    pages = [page async for page in iter_html_pages(agen(lines), page_size=50, by_lines=True)]
+    assert "".join(pages) == "".join(lines)
+    assert all(page.endswith("\n") and len(page) <= 50 for page in pages)
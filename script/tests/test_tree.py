@@ -0,0 +1,96 @@
+from script.tree import TreeCache, TreeIndex, parse_records, render_tree
+
+
+def output(*records):
+    return "".join(f"{kind} {size} {mtime} {path}\0" for kind, size, mtime, path in records)
+
+
+SCAN = output(
+    ("d", 4096, "100.0", "."),
+    ("d", 4096, "101.0", "./lab1"),
+    ("f", 120, "102.5", "./lab1/main.py"),
+    ("d", 4096, "103.0", "./lab1/src"),
+    ("f", 30, "104.0", "./lab1/src/util.py"),
+    ("f", 7, "105.0", "./notes with spaces.txt"),
+)
+
+
+def test_parse_records():
+    records = list(parse_records(SCAN))
+    assert records[0] == ("", "d", 4096, 100.0)
+    assert records[-1] == ("notes with spaces.txt", "f", 7, 105.0)
+    assert list(parse_records("garbage\0f x 1 ./a\0")) == []
+
+
+def test_index_is_prefix_tree_with_summaries():
+    index = TreeIndex(".", max_depth=3)
+    index.load(parse_records(SCAN))
+    assert index.entries == 5 and not index.truncated
+    assert index.find("lab1/src").children["util.py"].size == 30
+    assert index.find("lab1/missing") is None
+    assert index.summary("") == (3, 2, 157)
+    assert index.summary("lab1") == (2, 1, 150)
+    assert index.directory_mtimes() == {"": 100.0, "lab1": 101.0, "lab1/src": 103.0}
+
+
+def test_index_respects_limits():
+    index = TreeIndex(".", max_depth=2, max_entries=3)
+    index.load(parse_records(SCAN))
+    assert index.truncated
+    assert index.entries == 3
+    # Директория на предельной глубине не прочитана
+    assert index.find("lab1/src").children is None
+
+
+def test_relative_paths():
+    home = TreeIndex(".")
+    assert home.relative(".") == ""
+    assert home.relative("lab1/src") == "lab1/src"
+    assert home.relative("/etc") is None
+    lab = TreeIndex("/home/u/lab1")
+    assert lab.relative("/home/u/lab1/src") == "src"
+    assert lab.relative("/home/u/lab10") is None
+
+
+def test_apply_changes_keeps_unchanged_subtrees():
+    index = TreeIndex(".", max_depth=3)
+    index.load(parse_records(SCAN))
+    src = index.find("lab1/src")
+    # В lab1 появился файл и новая директория, main.py удален
+    listings = {
+        "lab1": list(parse_records(output(
+            ("d", 4096, "103.0", "./lab1/src"),
+            ("d", 4096, "200.0", "./lab1/docs"),
+            ("f", 10, "201.0", "./lab1/new.txt"),
+        ))),
+        "lab1/docs": list(parse_records(output(("f", 5, "202.0", "./lab1/docs/a.md")))),
+    }
+    index.apply_changes({"": 100.0, "lab1": 203.0, "lab1/src": 103.0, "lab1/docs": 200.0}, listings)
+    assert index.find("lab1/main.py") is None
+    assert index.find("lab1/src").children is src.children
+    assert index.find("lab1/docs/a.md").size == 5
+    assert index.find("lab1").mtime == 203.0
+    assert index.entries == 7
+
+
+def test_render_tree():
+    index = TreeIndex(".", max_depth=3)
+    index.load(parse_records(SCAN))
+    assert render_tree(index, "", 2).splitlines() == [
+        "├── lab1/  150 Б",
+        "│   ├── src/  30 Б",
+        "│   └── main.py  120 Б",
+        "└── notes with spaces.txt  7 Б",
+    ]
+    short = render_tree(index, "", 3, max_chars=40)
+    assert short.splitlines()[-1].startswith("… еще")
+
+
+def test_cache_keeps_last_users():
+    cache = TreeCache(max_users=2)
+    for user_id in (1, 2, 3):
+        cache.put(user_id, TreeIndex("."))
+    assert cache.get(1) is None
+    assert cache.get(3) is not None
+    cache.invalidate_user(3)
+    assert len(cache) == 1
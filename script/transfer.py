@@ -0,0 +1,87 @@
+"""
+Передача файлов между Telegram и ВМ (/get и /put): учет скорости и потоковое
+скачивание документа из Telegram без сохранения на диск.
+"""
+
+import os
+import time
+from contextlib import aclosing
+from typing import AsyncIterator
+
+from aiogram import Bot
+
+from .metrics import registry
+
+# Bot API отдает ботам на скачивание файлы не больше 20 МБ
+PUT_MAX_BYTES = int(os.getenv("PUT_MAX_BYTES", str(20 * 1024 * 1024)))
+# Размер блока и время на скачивание документа из Telegram
+TELEGRAM_CHUNK_SIZE = 65536
+TELEGRAM_DOWNLOAD_TIMEOUT = int(os.getenv("TELEGRAM_DOWNLOAD_TIMEOUT", "300"))
+# Сколько блоков скачанного документа может ждать записи на ВМ
+PUT_READ_AHEAD = int(os.getenv("PUT_READ_AHEAD", "8"))
+
+transfer_bytes = registry.counter(
+    "sftp_transfer_bytes_total", "Байты, переданные /get и /put", ("direction",))
+
+
+def format_size(size: float) -> str:
+    for unit in ("Б", "КБ", "МБ"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "Б" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} ГБ"
+
+
+class TransferMeter:
+    """
+    Счетчик байт и времени одной передачи.
+
+    Args:
+        direction (str): "get" или "put" - метка метрики sftp_transfer_bytes_total
+    """
+
+    def __init__(self, direction: str):
+        self.direction = direction
+        self.bytes = 0
+        self.started = time.perf_counter()
+        self.finished = self.started
+
+    async def count(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """Пропускает поток через счетчик; повторный вызов (повтор отправки) начинает отсчет заново."""
+        self.bytes = 0
+        self.started = self.finished = time.perf_counter()
+        async with aclosing(chunks):
+            async for chunk in chunks:
+                self.bytes += len(chunk)
+                transfer_bytes.inc(len(chunk), direction=self.direction)
+                yield chunk
+                self.finished = time.perf_counter()
+
+    @property
+    def elapsed(self) -> float:
+        return self.finished - self.started
+
+    @property
+    def rate(self) -> float:
+        """Средняя скорость в байтах в секунду."""
+        return self.bytes / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self) -> str:
+        return f"{format_size(self.bytes)} за {self.elapsed:.1f} с ({format_size(self.rate)}/с)"
+
+
+async def telegram_file_chunks(bot: Bot, file_path: str,
+                               timeout: int = TELEGRAM_DOWNLOAD_TIMEOUT) -> AsyncIterator[bytes]:
+    """
+    Содержимое файла с серверов Telegram по мере скачивания.
+
+    Args:
+        bot (Bot): Бот, от имени которого скачивается файл
+        file_path (str): File.file_path из getFile
+        timeout (int): Максимальное время скачивания (сек)
+    """
+    url = bot.session.api.file_url(bot.token, file_path)
+    stream = bot.session.stream_content(url=url, timeout=timeout, chunk_size=TELEGRAM_CHUNK_SIZE)
+    async with aclosing(stream):
+        async for chunk in stream:
+            yield chunk
@@ -0,0 +1,386 @@
+"""
+Индекс дерева файлов ВМ для /tree.
+
+Все поддерево читается одной командой find на ВМ (глубина и число записей
+ограничены) и хранится в памяти префиксным деревом по компонентам пути.
+Обновление сверяет mtime директорий и перечитывает только изменившиеся
+директории, так что повторный /tree и сводки по размерам обходятся без
+полного обхода ВМ.
+"""
+
+import os
+import html
+import time
+import shlex
+import logging
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple
+
+from .metrics import registry
+from .streaming import PAGE_SIZE
+from .transfer import format_size
+
+if TYPE_CHECKING:
+    from .classes import SSHConnection
+
+logger = logging.getLogger(__name__)
+
+# Глубина обхода и максимальное число записей в индексе
+TREE_MAX_DEPTH = int(os.getenv("TREE_MAX_DEPTH", "4"))
+TREE_MAX_ENTRIES = int(os.getenv("TREE_MAX_ENTRIES", "5000"))
+# Сколько секунд индекс считается свежим и отдается без обращения к ВМ
+TREE_FRESH_SECONDS = float(os.getenv("TREE_FRESH_SECONDS", "30"))
+# Для скольких пользователей хранить индекс
+TREE_CACHE_SIZE = int(os.getenv("TREE_CACHE_SIZE", "256"))
+# Если изменилось больше директорий, индекс строится заново, а не обновляется по частям
+TREE_REFRESH_MAX_DIRS = 200
+
+# Тип, размер, mtime и путь от корня индекса; записи разделены NUL, поэтому в имени может быть что угодно
+_FORMAT = "%y %s %T@ %p\\0"
+
+tree_scans = registry.counter("tree_scans_total", "Обращения к ВМ за деревом файлов", ("kind",))
+
+Record = Tuple[str, str, int, float]
+
+
+class TreeNode:
+    """Узел индекса; имя хранится ключом в children родителя."""
+
+    __slots__ = ("kind", "size", "mtime", "children")
+
+    def __init__(self, kind: str, size: int, mtime: float):
+        self.kind = kind        # %y из find: "d" - директория, "f" - файл, "l" - ссылка...
+        self.size = size
+        self.mtime = mtime
+        # Содержимое директории; None - не прочитано (глубже TREE_MAX_DEPTH) или это не директория
+        self.children: Optional[Dict[str, "TreeNode"]] = None
+
+    @property
+    def is_dir(self) -> bool:
+        return self.kind == "d"
+
+
+def _find_command(root: str, starts: List[str], options: str, records: int) -> str:
+    # Пути выводятся относительно root ("./a/b"); head обрывает вывод, а с ним и find
+    quoted = " ".join(shlex.quote(start) for start in starts)
+    return (f"cd -- {shlex.quote(root)} && find {quoted} {options} -printf '{_FORMAT}' 2>/dev/null"
+            f" | head -z -n {records}")
+
+
+def scan_command(root: str, max_depth: int, limit: int) -> str:
+    """Одна команда, выводящая все поддерево root до глубины max_depth."""
+    # Сам root и одна лишняя запись, по которой видно, что лимит превышен
+    return _find_command(root, ["."], f"-maxdepth {max_depth}", limit + 2)
+
+
+def dirs_command(root: str, max_depth: int, limit: int) -> str:
+    """Только директории поддерева с их mtime - для проверки, что изменилось."""
+    return _find_command(root, ["."], f"-maxdepth {max_depth} -type d", limit + 2)
+
+
+def children_command(root: str, dirs: List[str], limit: int) -> str:
+    """Содержимое нескольких директорий (пути относительно root) одной командой."""
+    return _find_command(root, ["./" + path if path else "." for path in dirs],
+                         "-mindepth 1 -maxdepth 1", limit + 1)
+
+
+def parse_records(output: str) -> Iterator[Record]:
+    """Разбирает вывод find -printf в (путь, тип, размер, mtime); путь корня - ""."""
+    for record in output.split("\0"):
+        parts = record.split(" ", 3)
+        if len(parts) != 4:
+            continue
+        kind, size, mtime, path = parts
+        if path == ".":
+            path = ""
+        elif path.startswith("./"):
+            path = path[2:]
+        else:
+            continue
+        try:
+            yield path, kind, int(size), float(mtime)
+        except ValueError:
+            continue
+
+
+def _split(path: str) -> List[str]:
+    return path.split("/") if path else []
+
+
+class TreeIndex:
+    """
+    Дерево файлов ВМ от root, прочитанное до глубины max_depth.
+
+    Пути внутри индекса задаются относительно root, без "./" в начале.
+    """
+
+    def __init__(self, root: str, max_depth: int = TREE_MAX_DEPTH, max_entries: int = TREE_MAX_ENTRIES):
+        self.root = root
+        self.max_depth = max_depth
+        self.max_entries = max_entries
+        self.tree = TreeNode("d", 0, 0.0)
+        self.entries = 0
+        self.truncated = False
+        self.updated = time.monotonic()
+
+    def is_fresh(self, ttl: float = TREE_FRESH_SECONDS) -> bool:
+        return time.monotonic() - self.updated < ttl
+
+    def load(self, records: Iterator[Record]):
+        """Строит индекс из записей полного обхода (родители идут раньше детей, как выводит find)."""
+        self.tree = TreeNode("d", 0, 0.0)
+        self.entries = 0
+        self.truncated = False
+        for path, kind, size, mtime in records:
+            if not path:
+                self.tree.mtime = mtime
+                self.tree.children = {}
+                continue
+            if self.entries >= self.max_entries:
+                self.truncated = True
+                break
+            self._insert(path, kind, size, mtime)
+        if self.tree.children is None:
+            raise FileNotFoundError(self.root)
+        self.updated = time.monotonic()
+
+    def _insert(self, path: str, kind: str, size: int, mtime: float):
+        *parents, name = _split(path)
+        parent = self.find("/".join(parents))
+        if parent is None or not parent.is_dir:
+            return
+        if parent.children is None:
+            parent.children = {}
+        node = TreeNode(kind, size, mtime)
+        if node.is_dir and len(parents) + 1 < self.max_depth:
+            node.children = {}
+        parent.children[name] = node
+        self.entries += 1
+
+    def find(self, path: str) -> Optional[TreeNode]:
+        node = self.tree
+        for name in _split(path):
+            if not node.children or name not in node.children:
+                return None
+            node = node.children[name]
+        return node
+
+    def relative(self, path: str) -> Optional[str]:
+        """
+        Путь относительно root или None, если path лежит вне индекса.
+
+        Оба пути - в виде FileOperations.normalize_path без "/" на конце.
+        """
+        if path == self.root:
+            return ""
+        if self.root == ".":
+            return None if path.startswith("/") else path
+        prefix = self.root.rstrip("/") + "/"
+        return path[len(prefix):] if path.startswith(prefix) else None
+
+    def directory_mtimes(self) -> Dict[str, float]:
+        """mtime прочитанных директорий индекса по путям."""
+        result = {}
+        stack = [("", self.tree)]
+        while stack:
+            path, node = stack.pop()
+            if node.children is None:
+                continue
+            result[path] = node.mtime
+            for name, child in node.children.items():
+                if child.is_dir:
+                    stack.append((f"{path}/{name}" if path else name, child))
+        return result
+
+    def depth_of(self, path: str) -> int:
+        return len(_split(path))
+
+    def apply_changes(self, dir_mtimes: Dict[str, float], listings: Dict[str, List[Record]]):
+        """
+        Переносит в индекс новое содержимое изменившихся директорий.
+
+        Поддеревья директорий, чей mtime не изменился, сохраняются; директории
+        обрабатываются от корня вглубь, поэтому новые поддиректории заполняются
+        своими листингами уже после того, как появились в родителе.
+        """
+        for path in sorted(listings, key=self.depth_of):
+            node = self.find(path)
+            if node is None or not node.is_dir:
+                continue
+            node.mtime = dir_mtimes.get(path, node.mtime)
+            old = node.children or {}
+            children = {}
+            for child_path, kind, size, mtime in listings[path]:
+                name = _split(child_path)[-1]
+                child = TreeNode(kind, size, mtime)
+                previous = old.get(name)
+                if child.is_dir:
+                    if previous is not None and previous.is_dir:
+                        child.children = previous.children
+                    elif self.depth_of(child_path) < self.max_depth:
+                        child.children = {}
+                children[name] = child
+            node.children = children
+        self.entries = sum(1 for _ in self.walk("")) - 1
+        self.truncated = self.entries > self.max_entries
+        self.updated = time.monotonic()
+
+    def walk(self, path: str) -> Iterator[Tuple[str, TreeNode]]:
+        """Все узлы поддерева path (включая сам path) в прямом порядке."""
+        node = self.find(path)
+        if node is None:
+            return
+        stack = [(path, node)]
+        while stack:
+            current, node = stack.pop()
+            yield current, node
+            if node.children:
+                for name, child in node.children.items():
+                    stack.append((f"{current}/{name}" if current else name, child))
+
+    def summary(self, path: str) -> Tuple[int, int, int]:
+        """Число файлов, директорий и суммарный размер файлов поддерева path (без самого path)."""
+        files = dirs = size = 0
+        for current, node in self.walk(path):
+            if current == path:
+                continue
+            if node.is_dir:
+                dirs += 1
+            else:
+                files += 1
+                size += node.size
+        return files, dirs, size
+
+
+async def build_index(ssh: "SSHConnection", root: str, max_depth: int = TREE_MAX_DEPTH,
+                      max_entries: int = TREE_MAX_ENTRIES) -> TreeIndex:
+    """
+    Читает поддерево root одной командой на ВМ.
+
+    Raises:
+        FileNotFoundError: root не существует или это не директория
+    """
+    tree_scans.inc(kind="full")
+    output, _, _ = await ssh.execute_command(scan_command(root, max_depth, max_entries))
+    index = TreeIndex(root, max_depth, max_entries)
+    index.load(parse_records(output))
+    logger.info("Indexed %s entries under %s on %s", index.entries, root, ssh.host)
+    return index
+
+
+async def refresh_index(ssh: "SSHConnection", index: TreeIndex) -> TreeIndex:
+    """
+    Обновляет индекс по mtime директорий: одна команда, если ничего не изменилось,
+    и еще одна на чтение всех изменившихся директорий сразу. Неполный индекс
+    и слишком много изменений - полный обход заново.
+    """
+    if index.truncated:
+        return await build_index(ssh, index.root, index.max_depth, index.max_entries)
+
+    tree_scans.inc(kind="dirs")
+    output, _, _ = await ssh.execute_command(dirs_command(index.root, index.max_depth, index.max_entries))
+    current = {path: mtime for path, _, _, mtime in parse_records(output)}
+    if "" not in current:
+        raise FileNotFoundError(index.root)
+    if len(current) > index.max_entries + 1:
+        return await build_index(ssh, index.root, index.max_depth, index.max_entries)
+    known = index.directory_mtimes()
+    changed = [path for path, mtime in current.items()
+               if known.get(path) != mtime and index.depth_of(path) < index.max_depth]
+    if len(changed) > TREE_REFRESH_MAX_DIRS:
+        return await build_index(ssh, index.root, index.max_depth, index.max_entries)
+
+    listings: Dict[str, List[Record]] = {path: [] for path in changed}
+    if changed:
+        tree_scans.inc(kind="dirs_changed")
+        output, _, _ = await ssh.execute_command(children_command(index.root, changed, index.max_entries))
+        records = list(parse_records(output))
+        if len(records) > index.max_entries:
+            return await build_index(ssh, index.root, index.max_depth, index.max_entries)
+        for record in records:
+            parent = record[0].rpartition("/")[0]
+            if parent in listings:
+                listings[parent].append(record)
+    index.apply_changes(current, listings)
+    logger.info("Refreshed tree index %s on %s: %s changed directories", index.root, ssh.host, len(changed))
+    return index
+
+
+def render_tree(index: TreeIndex, path: str, depth: int, max_chars: int = PAGE_SIZE - 300) -> str:
+    """
+    Дерево поддиректорий path в виде текста, экранированного для HTML.
+
+    У директорий показывается суммарный размер файлов, глубже depth уровней
+    содержимое не раскрывается. Не помещающиеся в max_chars строки заменяются
+    строкой "… еще N".
+    """
+    lines: List[str] = []
+    total = 0
+    hidden = 0
+
+    def add(line: str) -> bool:
+        nonlocal total
+        line = html.escape(line, quote=False)
+        if total + len(line) + 1 > max_chars:
+            return False
+        lines.append(line)
+        total += len(line) + 1
+        return True
+
+    def visit(node: TreeNode, node_path: str, prefix: str, level: int):
+        nonlocal hidden
+        items = sorted(node.children.items(), key=lambda item: (not item[1].is_dir, item[0]))
+        for i, (name, child) in enumerate(items):
+            last = i == len(items) - 1
+            child_path = f"{node_path}/{name}" if node_path else name
+            shown = name.replace("\n", "\\n")
+            if child.is_dir and child.children is None:
+                # Глубже индекса: размер содержимого неизвестен
+                label = f"{shown}/  …"
+            elif child.is_dir:
+                label = f"{shown}/  {format_size(index.summary(child_path)[2])}"
+            else:
+                label = f"{shown}  {format_size(child.size)}"
+            if hidden or not add(prefix + ("└── " if last else "├── ") + label):
+                hidden += 1
+                continue
+            if child.children and level + 1 < depth:
+                visit(child, child_path, prefix + ("    " if last else "│   "), level + 1)
+
+    node = index.find(path)
+    if node is not None and node.children:
+        visit(node, path, "", 0)
+    if hidden:
+        lines.append(f"… еще {hidden}")
+    return "\n".join(lines)
+
+
+class TreeCache:
+    """Индексы деревьев по пользователям (LRU): у пользователя хранится последний построенный индекс."""
+
+    def __init__(self, max_users: int = TREE_CACHE_SIZE):
+        self.max_users = max_users
+        self._indexes: "OrderedDict[int, TreeIndex]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._indexes)
+
+    def get(self, user_id: int) -> Optional[TreeIndex]:
+        index = self._indexes.get(user_id)
+        if index is not None:
+            self._indexes.move_to_end(user_id)
+        return index
+
+    def put(self, user_id: int, index: TreeIndex):
+        self._indexes[user_id] = index
+        self._indexes.move_to_end(user_id)
+        while len(self._indexes) > self.max_users:
+            self._indexes.popitem(last=False)
+
+    def invalidate_user(self, user_id: int):
+        self._indexes.pop(user_id, None)
+
+
+tree_cache = TreeCache()
+
+registry.callback("tree_indexes", "Индексы /tree в памяти", "gauge", lambda: len(tree_cache))
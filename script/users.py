@@ -0,0 +1,113 @@
+import os
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy.future import select
+
+from . import db
+from .db import User
+from .cache import MISSING, TTLCache
+
+logger = logging.getLogger(__name__)
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "4096"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "600"))
+
+
+@dataclass(frozen=True, slots=True)
+class UserProfile:
+    """Неизменяемый снимок записи пользователя для обработчиков."""
+    userid: int
+    username: Optional[str]
+    role: Optional[str]
+    tutorcode: Optional[str]
+    subscribe: Optional[str]
+    vm_host: Optional[str]
+    teacher_id: Optional[int] = None
+
+    @classmethod
+    def from_user(cls, user: User) -> "UserProfile":
+        return cls(user.userid, user.username, user.role, user.tutorcode, user.subscribe, user.vm_host,
+                   user.teacher_id)
+
+
+class UserCache:
+    """
+    Кэш профилей пользователей и преподавателей по коду.
+
+    Отсутствие пользователя тоже кэшируется, поэтому после регистрации и
+    изменения данных ВМ запись нужно сбрасывать явно (это делают register()
+    и VMConfigManager.save_vm_config).
+    """
+
+    def __init__(self, session_maker=None, maxsize: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        """
+        Args:
+            session_maker: Фабрика сессий; по умолчанию script.db.async_session на момент вызова
+            maxsize (int): Максимальное число записей в каждом из кэшей
+            ttl (float): Время жизни записи (сек)
+        """
+        self._session_maker = session_maker
+        self.profiles = TTLCache(maxsize, ttl)
+        self.teachers = TTLCache(maxsize, ttl)
+
+    @property
+    def session_maker(self):
+        return self._session_maker or db.async_session
+
+    async def get(self, user_id: int) -> Optional[UserProfile]:
+        """Профиль пользователя или None, если он не зарегистрирован."""
+        cached = self.profiles.get(user_id)
+        if cached is not MISSING:
+            return cached
+        async with self.session_maker() as session:
+            user = await session.get(User, user_id)
+        profile = UserProfile.from_user(user) if user else None
+        self.profiles.set(user_id, profile)
+        return profile
+
+    async def get_teacher_by_code(self, tutor_code: str) -> Optional[UserProfile]:
+        """Преподаватель с указанным кодом или None."""
+        cached = self.teachers.get(tutor_code)
+        if cached is not MISSING:
+            return cached
+        async with self.session_maker() as session:
+            result = await session.execute(select(User).where(User.tutorcode == tutor_code))
+            teacher = result.scalar_one_or_none()
+        profile = UserProfile.from_user(teacher) if teacher else None
+        self.teachers.set(tutor_code, profile)
+        if profile:
+            self.profiles.set(profile.userid, profile)
+        return profile
+
+    async def register(self, user: User) -> UserProfile:
+        """
+        Сохраняет нового пользователя и сразу кладет его профиль в кэш.
+
+        Raises:
+            IntegrityError: Пользователь уже зарегистрирован (или код занят)
+        """
+        try:
+            async with self.session_maker() as session:
+                session.add(user)
+                await session.commit()
+        except Exception:
+            self.invalidate(user.userid)
+            raise
+        profile = UserProfile.from_user(user)
+        self.profiles.set(user.userid, profile)
+        if profile.tutorcode:
+            self.teachers.set(profile.tutorcode, profile)
+        logger.info("User %s registered as %s", user.userid, user.role)
+        return profile
+
+    def invalidate(self, user_id: int):
+        """Сбрасывает профиль пользователя (и его запись преподавателя, если есть)."""
+        profile = self.profiles.get(user_id, None)
+        if profile and profile.tutorcode:
+            self.teachers.pop(profile.tutorcode)
+        self.profiles.pop(user_id)
+
+
+user_cache = UserCache()
@@ -0,0 +1,128 @@
+"""
+Режим webhook: aiohttp-сервер, принимающий обновления Telegram вместо long polling.
+"""
+
+import asyncio
+import logging
+from typing import Any, Dict, Optional, Set
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+logger = logging.getLogger(__name__)
+
+HEALTH_PATH = "/healthz"
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """
+    Обработчик webhook, который отвечает Telegram сразу, а обновления
+    обрабатывает в фоне, но не более max_concurrent одновременно.
+
+    Когда все слоты заняты, запрос ждет свободного слота и Telegram не
+    получает ответ - это естественное обратное давление: Telegram не шлет
+    больше max_connections запросов, пока не ответили на предыдущие.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, max_concurrent: int = 32,
+                 secret_token: Optional[str] = None, **data: Any):
+        super().__init__(dispatcher, bot, handle_in_background=True, secret_token=secret_token, **data)
+        self.max_concurrent = max_concurrent
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._tasks: Set[asyncio.Task] = set()
+        self.handled = 0
+        self.failed = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    async def _feed_and_release(self, bot: Bot, update: Dict[str, Any]):
+        try:
+            await self._background_feed_update(bot=bot, update=update)
+            self.handled += 1
+        except Exception as e:
+            self.failed += 1
+            logger.error("Webhook update handling failed: %s", e, exc_info=True)
+        finally:
+            self._slots.release()
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        await self._slots.acquire()
+        task = asyncio.create_task(self._feed_and_release(bot, update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def close(self):
+        """Дожидается обработки принятых обновлений и закрывает сессию бота."""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await super().close()
+
+
+def build_webhook_app(dispatcher: Dispatcher, bot: Bot, path: str = "/webhook",
+                      secret_token: Optional[str] = None, max_concurrent: int = 32,
+                      **data: Any) -> web.Application:
+    """
+    Собирает aiohttp-приложение с webhook-обработчиком и health-эндпоинтом.
+
+    Args:
+        dispatcher (Dispatcher): Диспетчер aiogram
+        bot (Bot): Экземпляр бота
+        path (str): Путь, на который Telegram присылает обновления
+        secret_token (Optional[str]): Ожидаемое значение X-Telegram-Bot-Api-Secret-Token
+        max_concurrent (int): Максимум одновременно обрабатываемых обновлений
+
+    Returns:
+        web.Application: Готовое приложение
+    """
+    app = web.Application()
+    handler = BoundedRequestHandler(dispatcher, bot, max_concurrent=max_concurrent,
+                                    secret_token=secret_token, **data)
+    handler.register(app, path=path)
+    app["webhook_handler"] = handler
+
+    async def health(request: web.Request) -> web.Response:
+        return web.json_response({
+            "status": "ok",
+            "in_flight": handler.in_flight,
+            "max_concurrent": handler.max_concurrent,
+            "handled": handler.handled,
+            "failed": handler.failed,
+        })
+
+    app.router.add_get(HEALTH_PATH, health)
+    setup_application(app, dispatcher, bot=bot, **data)
+    return app
+
+
+async def run_webhook(dispatcher: Dispatcher, bot: Bot, *, listen_host: str, listen_port: int,
+                      path: str, base_url: Optional[str], secret_token: Optional[str],
+                      max_concurrent: int):
+    """Запускает webhook-сервер и (если задан base_url) регистрирует webhook в Telegram."""
+    app = build_webhook_app(dispatcher, bot, path=path, secret_token=secret_token,
+                            max_concurrent=max_concurrent)
+    await serve_webhook_app(app, bot, listen_host=listen_host, listen_port=listen_port, path=path,
+                            base_url=base_url, secret_token=secret_token, max_concurrent=max_concurrent)
+
+
+async def serve_webhook_app(app: web.Application, bot: Bot, *, listen_host: str, listen_port: int,
+                            path: str, base_url: Optional[str], secret_token: Optional[str],
+                            max_concurrent: int):
+    """Обслуживает готовое приложение webhook до отмены задачи (общая часть с многопроцессным режимом)."""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, listen_host, listen_port)
+    await site.start()
+    logger.info("Webhook server listening on %s:%s%s", listen_host, listen_port, path)
+    if base_url:
+        await bot.set_webhook(f"{base_url.rstrip('/')}{path}", secret_token=secret_token,
+                              max_connections=min(max_concurrent, 100))
+        logger.info("Webhook registered in Telegram.")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
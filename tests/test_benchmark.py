@@ -0,0 +1,24 @@
+import os
+import sys
+import json
+import subprocess
+
+import pytest
+
+# script/main.py использует DefaultBotProperties (aiogram >= 3.7)
+pytest.importorskip("aiogram.client.default")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_load_benchmark_smoke():
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.load", "--updates", "60", "--users", "5", "--hosts", "2", "--json"],
+        cwd=ROOT, capture_output=True, text=True, timeout=120,
+    )
+    assert result.returncode == 0, result.stderr
+    report = json.loads(result.stdout)
+    assert report["updates"] == 60
+    assert report["updates_per_sec"] > 0
+    assert sum(stats["count"] for name, stats in report["latency_ms"].items() if name != "all") == 60
+    assert report["telegram_calls"]["sendMessage"] > 0
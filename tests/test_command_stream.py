@@ -0,0 +1,137 @@
+import socket
+import asyncio
+
+import pytest
+
+from script.classes import CommandStream
+from handlers.vm_commands import SearchCap, find_command, grep_command
+
+
+class FakeChannel:
+    def __init__(self, chunks, stderr=b""):
+        self.chunks = list(chunks)
+        self.stderr = stderr
+        self.closed = False
+        self.reads = 0
+
+    def recv(self, size):
+        self.reads += 1
+        return self.chunks.pop(0) if self.chunks else b""
+
+    def recv_ready(self):
+        return bool(self.chunks)
+
+    @property
+    def eof_received(self):
+        return not self.chunks
+
+    def exit_status_ready(self):
+        return True
+
+    def recv_stderr_ready(self):
+        return bool(self.stderr)
+
+    def recv_stderr(self, size):
+        data, self.stderr = self.stderr[:size], self.stderr[size:]
+        return data
+
+    def recv_exit_status(self):
+        return 0
+
+    def close(self):
+        self.closed = True
+
+
+class InlineConnection:
+    async def run_blocking(self, func, *args):
+        return func(*args)
+
+
+class QuietChannel(FakeChannel):
+    """Канал, данные в который приходят позже; готовность сообщается через сокет, как у paramiko."""
+
+    def __init__(self):
+        super().__init__([])
+        self.pending = []
+        self.eof = False
+        self._notify, self._wake = socket.socketpair()
+        self._notify.setblocking(False)
+
+    def fileno(self):
+        return self._notify.fileno()
+
+    def deliver(self, data):
+        if data:
+            self.pending.append(data)
+        else:
+            self.eof = True
+        self._wake.send(b"x")
+
+    def recv(self, size):
+        try:
+            self._notify.recv(1024)
+        except BlockingIOError:
+            pass
+        return super().recv(size)
+
+    def recv_ready(self):
+        self.chunks.extend(self.pending)
+        self.pending.clear()
+        return bool(self.chunks)
+
+    @property
+    def eof_received(self):
+        return self.eof and not self.chunks
+
+
+class NoThreadsConnection:
+    async def run_blocking(self, func, *args):
+        raise AssertionError(f"{func} must not run in the executor")
+
+
+async def test_lines_are_split_across_chunks():
+    text = "первая строка\nвторая\nтретья без перевода".encode()
+    chunks = [text[i:i + 5] for i in range(0, len(text), 5)]
+    stream = CommandStream(InlineConnection(), FakeChannel(chunks, stderr=b"x" * 10000), stderr_limit=100)
+    lines = [line async for line in stream.lines()]
+    assert lines == ["первая строка", "вторая", "третья без перевода"]
+    assert stream.exit_status == 0
+    assert len(stream.stderr) == 100
+
+
+async def test_waiting_for_output_does_not_use_executor():
+    channel = QuietChannel()
+    stream = CommandStream(NoThreadsConnection(), channel, idle_timeout=5)
+    loop = asyncio.get_running_loop()
+    loop.call_later(0.05, channel.deliver, b"found\n")
+    loop.call_later(0.1, channel.deliver, b"")
+    assert [line async for line in stream.lines()] == ["found"]
+    assert stream.exit_status == 0
+
+
+async def test_idle_timeout():
+    stream = CommandStream(InlineConnection(), QuietChannel(), idle_timeout=0.05)
+    with pytest.raises(asyncio.TimeoutError):
+        [line async for line in stream.lines()]
+
+
+async def test_cap_stops_reading_early():
+    channel = FakeChannel([b"match %d\n" % i for i in range(1000)])
+    stream = CommandStream(InlineConnection(), channel)
+    cap = SearchCap(max_results=10, max_bytes=10000)
+    out = [line async for line in cap.apply(stream.lines())]
+    assert len(out) == 10 and cap.truncated
+    assert channel.reads == 11
+
+
+async def test_cap_by_bytes():
+    stream = CommandStream(InlineConnection(), FakeChannel([b"x" * 100 + b"\n"] * 50))
+    cap = SearchCap(max_results=1000, max_bytes=1000)
+    out = [line async for line in cap.apply(stream.lines())]
+    assert len(out) == 9 and cap.truncated
+
+
+def test_search_commands_are_quoted():
+    assert find_command("~/lab 1", "*.py") == "find 'lab 1' -name '*.py' 2>/dev/null"
+    assert find_command("-delete", "x") == "find ./-delete -name x 2>/dev/null"
+    assert grep_command("a'; rm -rf ~; '", ".") == "grep -rnIs -e 'a'\"'\"'; rm -rf ~; '\"'\"'' -- ."
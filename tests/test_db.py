@@ -0,0 +1,59 @@
+import sqlite3
+from sqlalchemy import text
+
+from script.db import Base, create_engine_with_profile, run_migrations, MIGRATIONS
+
+LEGACY_SCHEMA = """
+CREATE TABLE users (
+    userid INTEGER NOT NULL, username VARCHAR, role VARCHAR, tutorcode VARCHAR,
+    subscribe VARCHAR, extra VARCHAR, vm_host VARCHAR, vm_port INTEGER,
+    vm_username VARCHAR, vm_password VARCHAR,
+    PRIMARY KEY (userid), UNIQUE (tutorcode)
+)
+"""
+
+
+async def init(engine):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(run_migrations)
+
+
+async def test_sqlite_pragmas_applied(tmp_path):
+    engine = create_engine_with_profile(f"sqlite+aiosqlite:///{tmp_path}/bot.db")
+    async with engine.connect() as conn:
+        assert (await conn.execute(text("PRAGMA journal_mode"))).scalar() == "wal"
+        assert (await conn.execute(text("PRAGMA synchronous"))).scalar() == 1  # NORMAL
+        assert (await conn.execute(text("PRAGMA busy_timeout"))).scalar() == 5000
+    await engine.dispose()
+
+
+async def test_legacy_database_is_migrated(tmp_path):
+    db_path = tmp_path / "bot.db"
+    legacy = sqlite3.connect(db_path)
+    legacy.execute(LEGACY_SCHEMA)
+    legacy.execute("INSERT INTO users (userid, username, role, tutorcode) VALUES (1, 'prof', 'teacher', 'c1')")
+    legacy.execute("INSERT INTO users (userid, username, role, subscribe) VALUES (2, 'kid', 'student', 'prof')")
+    legacy.commit()
+    legacy.close()
+
+    engine = create_engine_with_profile(f"sqlite+aiosqlite:///{db_path}")
+    await init(engine)
+    await init(engine)  # повторный запуск ничего не ломает
+    async with engine.connect() as conn:
+        assert (await conn.execute(text("SELECT teacher_id FROM users WHERE userid = 2"))).scalar() == 1
+        assert (await conn.execute(text("PRAGMA user_version"))).scalar() == MIGRATIONS[-1][0]
+        plan = (await conn.execute(text(
+            "EXPLAIN QUERY PLAN SELECT userid FROM users WHERE teacher_id = 1"
+        ))).fetchall()
+        assert "ix_users_teacher_id" in str(plan)
+    await engine.dispose()
+
+
+async def test_fresh_database_has_indexes(tmp_path):
+    engine = create_engine_with_profile(f"sqlite+aiosqlite:///{tmp_path}/bot.db")
+    await init(engine)
+    async with engine.connect() as conn:
+        indexes = {row[1] for row in await conn.execute(text("PRAGMA index_list(users)"))}
+    assert {"ix_users_teacher_id", "ix_users_subscribe"} <= indexes
+    await engine.dispose()
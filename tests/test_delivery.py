@@ -0,0 +1,109 @@
+import gc
+import asyncio
+import time
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from script import delivery
+from script.delivery import RateLimitMiddleware, TokenBucket, exclusive, is_mergeable, mergeable
+
+
+class FakeAPI:
+    def __init__(self, fail_times=0):
+        self.sent = []
+        self.fail_times = fail_times
+
+    async def __call__(self, bot, method):
+        if self.fail_times:
+            self.fail_times -= 1
+            raise TelegramRetryAfter(method=method, message="Flood control exceeded", retry_after=0)
+        self.sent.append(method)
+        return len(self.sent)
+
+
+async def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=50, capacity=1)
+    start = time.monotonic()
+    for _ in range(6):
+        await bucket.acquire()
+    assert time.monotonic() - start >= 0.09
+
+
+async def test_consecutive_messages_are_merged():
+    api = FakeAPI()
+    middleware = RateLimitMiddleware(global_rate=100, chat_rate=100, chat_burst=1)
+    results = await asyncio.gather(*[
+        middleware(api, None, mergeable(SendMessage(chat_id=1, text=f"line {i}"))) for i in range(5)
+    ])
+    assert [m.text for m in api.sent] == ["line 0\nline 1\nline 2\nline 3\nline 4"]
+    assert results == [1] * 5
+    assert middleware.merged == 4
+
+
+async def test_exclusive_and_markup_messages_are_not_merged():
+    api = FakeAPI()
+    middleware = RateLimitMiddleware(global_rate=100, chat_rate=100, chat_burst=1)
+    await asyncio.gather(
+        middleware(api, None, mergeable(SendMessage(chat_id=1, text="a"))),
+        middleware(api, None, exclusive(SendMessage(chat_id=1, text="progress"))),
+        middleware(api, None, mergeable(SendMessage(chat_id=1, text="b"))),
+        middleware(api, None, mergeable(SendMessage(chat_id=2, text="other chat"))),
+    )
+    assert sorted(m.text for m in api.sent) == ["a", "b", "other chat", "progress"]
+
+
+class SentMessage:
+    def __init__(self, message_id, texts):
+        self.message_id = message_id
+        self.texts = texts
+
+    async def edit_text(self, text, **kwargs):
+        self.texts[self.message_id] = text
+        return self
+
+
+async def test_kept_messages_are_not_merged():
+    api = FakeAPI()
+    middleware = RateLimitMiddleware(global_rate=100, chat_rate=100, chat_burst=1)
+
+    async def send(text):
+        return await middleware(api, None, SendMessage(chat_id=1, text=text))
+
+    async def notice(text):
+        return await middleware(api, None, mergeable(SendMessage(chat_id=1, text=text)))
+
+    first, second, _, _ = await asyncio.gather(send("status 1"), send("status 2"),
+                                               notice("done 1"), notice("done 2"))
+    # Сообщения без пометки отправлены отдельно, поэтому редактирование одного не трогает другое
+    assert first != second
+    texts = {i + 1: method.text for i, method in enumerate(api.sent)}
+    await SentMessage(first, texts).edit_text("edited")
+    assert texts[second] == "status 2"
+    assert [m.text for m in api.sent] == ["status 1", "status 2", "done 1\ndone 2"]
+
+
+async def test_retry_after_is_retried():
+    api = FakeAPI(fail_times=2)
+    middleware = RateLimitMiddleware(global_rate=100, chat_rate=100, chat_burst=5, max_retries=3)
+    assert await middleware(api, None, SendMessage(chat_id=1, text="hi")) == 1
+    assert middleware.retried == 2
+
+
+async def test_retry_after_gives_up():
+    api = FakeAPI(fail_times=5)
+    middleware = RateLimitMiddleware(global_rate=100, chat_rate=100, chat_burst=5, max_retries=1)
+    with pytest.raises(TelegramRetryAfter):
+        await middleware(api, None, SendMessage(chat_id=1, text="hi"))
+
+
+def test_dropped_mark_does_not_leak_to_new_messages():
+    marked = mergeable(SendMessage(chat_id=1, text="never sent"))
+    marked_id = id(marked)
+    del marked
+    gc.collect()
+    assert marked_id not in delivery._marked_mergeable
+    # Новые запросы могут получить тот же id, но помеченными не становятся
+    fresh = [SendMessage(chat_id=1, text=f"status {i}") for i in range(100)]
+    assert not any(is_mergeable(method) for method in fresh)
@@ -0,0 +1,52 @@
+import gzip
+import os
+
+from script.documents import StreamedInputFile, buffered_document, gzip_chunks, worth_compressing
+
+
+async def agen(chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+async def collect(stream):
+    return b"".join([chunk async for chunk in stream])
+
+
+def test_worth_compressing():
+    text = b"INFO request handled in 12ms\n" * 500
+    assert worth_compressing(text, len(text))
+    assert not worth_compressing(os.urandom(8192), 8192)
+    assert not worth_compressing(b"short", 5)
+
+
+async def test_gzip_chunks_roundtrip():
+    chunks = [b"line %d\n" % i for i in range(1000)]
+    compressed = await collect(gzip_chunks(agen(chunks)))
+    assert gzip.decompress(compressed) == b"".join(chunks)
+
+
+async def test_streamed_input_file_reads_source_on_every_attempt():
+    calls = []
+
+    def source():
+        calls.append(1)
+        return agen([b"a" * 5000, b"b" * 5000])
+
+    document = StreamedInputFile(source, "app.log", compress=True)
+    assert document.filename == "app.log.gz"
+    first = await collect(document.read(None))
+    second = await collect(document.read(None))
+    assert gzip.decompress(first) == gzip.decompress(second) == b"a" * 5000 + b"b" * 5000
+    assert len(calls) == 2
+
+
+def test_buffered_document_compresses_only_when_useful():
+    text = b"drwxr-xr-x 4.0K 2024-01-01 00:00 dir/\n" * 1000
+    document = buffered_document(text, "ls.txt")
+    assert document.filename == "ls.txt.gz"
+    assert gzip.decompress(document.data) == text
+
+    noise = os.urandom(8192)
+    document = buffered_document(noise, "ls.txt")
+    assert document.filename == "ls.txt" and document.data == noise
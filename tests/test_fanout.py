@@ -0,0 +1,119 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from script.classes import VMConfig
+from script.db import Base, User
+from script.fanout import FanoutReport, FanoutTask, Student, fan_out, load_students
+from script.scheduler import CommandScheduler
+
+
+class FakePool:
+    def __init__(self, delays):
+        self.delays = delays
+        self.active = 0
+        self.peak = 0
+        self.discarded = []
+
+    @asynccontextmanager
+    async def connection(self, user_id, vm_config):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            yield user_id
+        finally:
+            self.active -= 1
+
+    async def discard(self, connection):
+        self.discarded.append(connection)
+
+
+async def echo_task(ssh, arg):
+    await asyncio.sleep(pool.delays.get(ssh, 0.01))
+    if ssh == 3:
+        raise OSError("No such file")
+    return "main.py\nREADME" if ssh != 2 else "main.py\nREADME\nextra.txt"
+
+
+pool = FakePool({4: 1.0})
+
+
+def students(n):
+    return [Student(i, f"s{i}", VMConfig(f"10.0.0.{i}", 22, "u", "p")) for i in range(1, n + 1)]
+
+
+async def test_fan_out_limits_concurrency_and_reports_failures():
+    pool.peak = 0
+    task = FanoutTask("test", echo_task)
+    group = students(5) + [Student(6, "novm", None)]
+    results = [r async for r in fan_out(group, task, None, pool, concurrency=2, timeout=0.2)]
+
+    by_id = {r.student.userid: r for r in results}
+    assert pool.peak <= 2
+    assert by_id[1].ok and by_id[1].output == "main.py\nREADME"
+    assert not by_id[3].ok and "No such file" in by_id[3].error
+    assert not by_id[4].ok and "таймаут" in by_id[4].error
+    assert not by_id[6].ok
+    # Закрывается только зависшее подключение, а не все подключения студента
+    assert pool.discarded == [4]
+
+
+async def test_fan_out_goes_through_command_scheduler():
+    pool.peak = 0
+    scheduler = CommandScheduler(user_queue_size=1, host_limit=1)
+    task = FanoutTask("test", echo_task)
+    # Все студенты на одном хосте: лимит хоста планировщика важнее concurrency
+    group = [Student(i, f"s{i}", VMConfig("10.0.0.1", 22, "u", "p")) for i in (1, 2, 5)]
+    results = [r async for r in fan_out(group, task, None, pool, concurrency=3, scheduler=scheduler)]
+    assert all(r.ok for r in results)
+    assert pool.peak == 1
+
+    # Очередь студента уже занята его собственными командами
+    busy = asyncio.Event()
+    running = asyncio.ensure_future(scheduler.run(1, "10.0.0.9", busy.wait))
+    queued = asyncio.ensure_future(scheduler.run(1, "10.0.0.9", busy.wait))
+    await asyncio.sleep(0)
+    results = [r async for r in fan_out(group[:1], task, None, pool, scheduler=scheduler)]
+    assert not results[0].ok and "очередь" in results[0].error
+    busy.set()
+    await asyncio.gather(running, queued)
+
+
+async def test_report_groups_identical_outputs_and_diffs_others():
+    task = FanoutTask("test", echo_task)
+    group = students(3)
+    report = FanoutReport("/class ls", group)
+    assert "⏳ 3" in report.render_summary()
+    async for result in fan_out(group, task, None, pool):
+        report.add(result)
+
+    summary = report.render_summary()
+    assert "✅ 2  ❌ 1" in summary and "Вариантов вывода: 2" in summary
+    document = report.render_document()
+    assert "=== Вариант 1 (1): @s1" in document
+    assert "+extra.txt" in document
+    assert "@s3: No such file" in document
+
+
+async def test_load_students_by_teacher_id_and_legacy_subscribe(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/test.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    maker = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    async with maker() as session:
+        session.add_all([
+            User(userid=1, username="teach", role="teacher", tutorcode="c1"),
+            User(userid=2, username="a", role="student", teacher_id=1, subscribe="teach",
+                 vm_host="h2", vm_port=22, vm_username="u", vm_password="p"),
+            User(userid=3, username="b", role="student", subscribe="teach"),
+            User(userid=4, username="c", role="student", subscribe="other"),
+        ])
+        await session.commit()
+
+    found = await load_students(1, "teach", session_maker=maker)
+    await engine.dispose()
+    assert [s.userid for s in found] == [2, 3]
+    assert found[0].vm_config == VMConfig("h2", 22, "u", "p")
+    assert found[1].vm_config is None
@@ -0,0 +1,132 @@
+import time
+import asyncio
+
+import pytest
+from sqlalchemy import event, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import StorageKey
+
+from script.db import Base, FSMRecord, create_engine_with_profile
+from script.fsm import SQLAlchemyStorage, build_key
+
+
+class Form(StatesGroup):
+    name = State()
+
+
+def key(user_id: int) -> StorageKey:
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+
+@pytest.fixture
+async def session_maker(tmp_path):
+    engine = create_engine_with_profile(f"sqlite+aiosqlite:///{tmp_path}/bot.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    statements = []
+    event.listen(engine.sync_engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+    maker = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    maker.statements = statements
+    yield maker
+    await engine.dispose()
+
+
+def make_storage(session_maker, **kwargs) -> SQLAlchemyStorage:
+    # Большой интервал: сброс в тестах выполняется явно
+    kwargs.setdefault("flush_interval", 60)
+    return SQLAlchemyStorage(session_maker, **kwargs)
+
+
+async def test_read_your_writes_and_batched_flush(session_maker):
+    storage = make_storage(session_maker)
+    for user_id in (1, 2, 3):
+        await storage.set_state(key(user_id), Form.name)
+        await storage.set_data(key(user_id), {"n": user_id})
+    # До записи в БД состояние видно из памяти
+    assert await storage.get_state(key(2)) == Form.name.state
+    assert await storage.get_data(key(2)) == {"n": 2}
+
+    session_maker.statements.clear()
+    await storage.flush()
+    inserts = [s for s in session_maker.statements if s.startswith("INSERT")]
+    assert len(inserts) == 1  # три ключа одним executemany
+    assert storage.flushes == 1 and storage.written == 3
+
+    other = make_storage(session_maker)
+    assert await other.get_state(key(3)) == Form.name.state
+    assert await other.get_data(key(3)) == {"n": 3}
+    await storage.close()
+    await other.close()
+
+
+async def test_partial_update_keeps_other_field(session_maker):
+    storage = make_storage(session_maker)
+    await storage.set_state(key(1), Form.name)
+    await storage.set_data(key(1), {"a": 1})
+    await storage.flush()
+    await storage.set_data(key(1), {"a": 2})
+    await storage.flush()
+
+    other = make_storage(session_maker)
+    assert await other.get_state(key(1)) == Form.name.state
+    assert await other.get_data(key(1)) == {"a": 2}
+    await storage.close()
+
+
+async def test_clear_deletes_row(session_maker):
+    storage = make_storage(session_maker)
+    await storage.set_state(key(1), Form.name)
+    await storage.flush()
+    await storage.set_state(key(1), None)
+    await storage.set_data(key(1), {})
+    await storage.flush()
+    async with session_maker() as session:
+        assert await session.get(FSMRecord, build_key(key(1))) is None
+    assert await storage.get_state(key(1)) is None
+
+
+async def test_expired_state_is_ignored_and_cleaned_up(session_maker):
+    storage = make_storage(session_maker, cache_ttl=0)
+    await storage.set_state(key(1), Form.name)
+    await storage.set_state(key(2), Form.name)
+    await storage.flush()
+    async with session_maker() as session:
+        async with session.begin():
+            await session.execute(update(FSMRecord).where(FSMRecord.key == build_key(key(1)))
+                                  .values(expires_at=int(time.time()) - 1))
+
+    assert await storage.get_state(key(1)) is None
+    assert await storage.cleanup() == 1
+    assert await storage.get_state(key(2)) == Form.name.state
+
+
+async def test_close_flushes_pending_writes(session_maker):
+    storage = make_storage(session_maker)
+    await storage.set_data(key(1), {"x": "значение"})
+    await storage.close()
+    assert not storage._dirty
+
+    restarted = make_storage(session_maker)
+    assert await restarted.get_data(key(1)) == {"x": "значение"}
+
+
+async def test_background_flush(session_maker):
+    storage = make_storage(session_maker, flush_interval=0, flush_batch=1)
+    await storage.set_state(key(1), Form.name)
+    for _ in range(100):
+        if storage.flushes:
+            break
+        await asyncio.sleep(0.01)
+    assert storage.flushes == 1
+    await storage.close()
+
+
+async def test_set_data_rejects_unserializable(session_maker):
+    storage = make_storage(session_maker)
+    with pytest.raises(TypeError):
+        await storage.set_data(key(1), {"bad": object()})
+    assert not storage._dirty
@@ -0,0 +1,96 @@
+import sys
+import json
+import queue
+import logging
+
+import pytest
+from aiogram.types import Update
+
+from script.executor import SSHExecutor
+from script.logs import (CorrelationMiddleware, RotatingLogFileHandler, TruncatingQueueHandler, correlation_id,
+                         setup_logging, shorten)
+
+
+@pytest.fixture
+def clean_root():
+    root = logging.getLogger()
+    saved_handlers, saved_level = root.handlers[:], root.level
+    yield root
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.handlers.extend(saved_handlers)
+    root.setLevel(saved_level)
+
+
+def test_shorten_is_lazy_and_truncates():
+    calls = []
+
+    class Payload:
+        def __str__(self):
+            calls.append(1)
+            return "x" * 50
+
+    logger = logging.getLogger("test_logs.lazy")
+    logger.setLevel(logging.INFO)
+    logger.debug("STDOUT: %s", shorten(Payload()))
+    assert calls == []
+    assert str(shorten("x" * 50, limit=10)) == "x" * 10 + "... [+40 chars]"
+    assert str(shorten(b"abc")) == "abc"
+
+
+def test_queue_handler_flattens_and_truncates_record():
+    log_queue = queue.Queue()
+    handler = TruncatingQueueHandler(log_queue, max_message=20)
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = logging.getLogger("t").makeRecord("t", logging.ERROR, __file__, 1, "value %s", ("y" * 40,),
+                                                   exc_info=sys.exc_info())
+    handler.handle(record)
+    queued = log_queue.get_nowait()
+    assert queued.args is None
+    assert queued.exc_info is None
+    assert queued.msg.startswith("value " + "y" * 14 + "...")
+    assert "ValueError: boom" in queued.exc_text
+
+
+def test_rotation_by_size_and_time(tmp_path):
+    log_file = tmp_path / "bot.log"
+    handler = RotatingLogFileHandler(log_file, max_bytes=200, backup_count=2, interval=3600)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    record = logging.makeLogRecord({"msg": "z" * 150})
+    handler.handle(record)
+    handler.handle(record)
+    assert (tmp_path / "bot.log.1").exists()
+
+    handler.rollover_at = 0
+    handler.handle(logging.makeLogRecord({"msg": "short"}))
+    assert (tmp_path / "bot.log.2").exists()
+    assert log_file.read_text().strip() == "short"
+    handler.close()
+
+
+async def test_json_log_with_correlation_id(tmp_path, clean_root):
+    log_file = tmp_path / "bot.log"
+    listener = setup_logging(log_file, level="INFO", fmt="json", force=True)
+    assert setup_logging(log_file) is None
+
+    async def handler(event, data):
+        logging.getLogger("test_logs").info("handled %s", "update")
+        # Контекст апдейта доходит и до потоков SSH-исполнителя
+        executor = SSHExecutor(max_workers=1)
+        try:
+            return await executor.run("host", correlation_id.get)
+        finally:
+            executor.shutdown()
+
+    update = Update(update_id=77)
+    assert await CorrelationMiddleware()(handler, update, {}) == "u77"
+    assert correlation_id.get() == "-"
+    listener.stop()
+
+    records = [json.loads(line) for line in log_file.read_text(encoding="utf-8").splitlines()]
+    record = next(r for r in records if r["logger"] == "test_logs")
+    assert record["message"] == "handled update"
+    assert record["correlation_id"] == "u77"
+    assert record["level"] == "INFO"
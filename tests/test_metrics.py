@@ -0,0 +1,46 @@
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+from script.metrics import HandlerMetricsMiddleware, Registry, build_metrics_app
+
+
+def test_histogram_and_counter_exposition():
+    registry = Registry()
+    latency = registry.histogram("op_seconds", "latency", ("op",), buckets=(0.1, 1.0))
+    errors = registry.counter("op_errors_total", "errors", ("op",))
+    registry.callback("pool_size", "size", "gauge", lambda: 3)
+    latency.observe(0.05, op="ls")
+    latency.observe(0.5, op="ls")
+    latency.observe(5, op="ls")
+    errors.inc(op='c"at')
+
+    text = registry.render()
+    assert '# TYPE op_seconds histogram' in text
+    assert 'op_seconds_bucket{op="ls",le="0.1"} 1' in text
+    assert 'op_seconds_bucket{op="ls",le="1.0"} 2' in text
+    assert 'op_seconds_bucket{op="ls",le="+Inf"} 3' in text
+    assert 'op_seconds_count{op="ls"} 3' in text
+    assert 'op_errors_total{op="c\\"at"} 1' in text
+    assert "pool_size 3" in text
+
+
+async def test_handler_middleware_times_and_counts_errors():
+    from script.metrics import handler_duration, handler_errors
+
+    async def my_handler(event, data):
+        raise RuntimeError("boom")
+
+    handler_object = type("H", (), {"callback": my_handler})()
+    with pytest.raises(RuntimeError):
+        await HandlerMetricsMiddleware()(my_handler, None, {"handler": handler_object})
+    assert handler_duration.count(handler="my_handler") == 1
+    assert handler_errors.get(handler="my_handler") == 1
+
+
+async def test_metrics_endpoint():
+    registry = Registry()
+    registry.counter("hits_total", "hits").inc(2)
+    async with TestClient(TestServer(build_metrics_app(registry))) as client:
+        response = await client.get("/metrics")
+        assert response.status == 200
+        assert "hits_total 2" in await response.text()
@@ -0,0 +1,98 @@
+import asyncio
+import pytest
+
+from script.scheduler import CommandScheduler, QueueFull
+
+
+def job(log, name, delay=0.01, result=None):
+    async def work():
+        log.append(name)
+        await asyncio.sleep(delay)
+        return result if result is not None else name
+    return work
+
+
+async def test_round_robin_between_users():
+    scheduler = CommandScheduler(user_queue_size=10, host_limit=1)
+    log = []
+    calls = [scheduler.run(1, "vm", job(log, f"a{i}")) for i in range(3)]
+    calls += [scheduler.run(2, "vm", job(log, f"b{i}")) for i in range(3)]
+    await asyncio.gather(*calls)
+    assert log == ["a0", "b0", "a1", "b1", "a2", "b2"]
+
+
+async def test_one_running_command_per_user_and_host_limit():
+    scheduler = CommandScheduler(user_queue_size=10, host_limit=2)
+    running = {"vm": 0}
+    peak = {"vm": 0, "user": 0}
+    per_user = {}
+
+    def work(user_id):
+        async def run():
+            running["vm"] += 1
+            per_user[user_id] = per_user.get(user_id, 0) + 1
+            peak["vm"] = max(peak["vm"], running["vm"])
+            peak["user"] = max(peak["user"], per_user[user_id])
+            await asyncio.sleep(0.01)
+            running["vm"] -= 1
+            per_user[user_id] -= 1
+        return run
+
+    await asyncio.gather(*(scheduler.run(uid, "vm", work(uid)) for uid in (1, 1, 2, 2, 3, 3)))
+    assert peak == {"vm": 2, "user": 1}
+
+
+async def test_queue_full_is_rejected():
+    scheduler = CommandScheduler(user_queue_size=1, host_limit=1)
+    log = []
+    first = asyncio.ensure_future(scheduler.run(1, "vm", job(log, "first")))
+    await asyncio.sleep(0)
+    second = asyncio.ensure_future(scheduler.run(1, "vm", job(log, "second")))
+    await asyncio.sleep(0)
+    with pytest.raises(QueueFull):
+        await scheduler.run(1, "vm", job(log, "third"))
+    await asyncio.gather(first, second)
+    assert scheduler.rejected == 1
+
+
+async def test_identical_queued_commands_are_coalesced():
+    scheduler = CommandScheduler(user_queue_size=5, host_limit=1)
+    log = []
+    results = await asyncio.gather(
+        scheduler.run(1, "vm", job(log, "running")),
+        scheduler.run(1, "vm", job(log, "ls", result="listing"), key=("ls", ".")),
+        scheduler.run(1, "vm", job(log, "ls-dup"), key=("ls", ".")),
+    )
+    assert results == ["running", "listing", "listing"]
+    assert log == ["running", "ls"]
+    assert scheduler.coalesced == 1
+
+
+async def test_user_is_told_queue_position():
+    scheduler = CommandScheduler(user_queue_size=5, host_limit=1)
+    positions = []
+
+    async def on_queued(ahead):
+        positions.append(ahead)
+
+    log = []
+    await asyncio.gather(
+        scheduler.run(1, "vm", job(log, "a"), on_queued=on_queued),
+        scheduler.run(1, "vm", job(log, "b"), on_queued=on_queued),
+        scheduler.run(1, "vm", job(log, "c"), on_queued=on_queued),
+    )
+    assert positions == [1, 2]
+
+
+async def test_errors_propagate_and_queue_continues():
+    scheduler = CommandScheduler(user_queue_size=5, host_limit=1)
+
+    async def boom():
+        raise RuntimeError("ssh failed")
+
+    log = []
+    results = await asyncio.gather(scheduler.run(1, "vm", boom), scheduler.run(1, "vm", job(log, "next")),
+                                   return_exceptions=True)
+    assert isinstance(results[0], RuntimeError)
+    assert results[1] == "next"
+    assert scheduler.snapshot()["queued"] == 0
@@ -0,0 +1,62 @@
+import io
+import time
+
+import pytest
+
+from script.classes import SSHConnection
+from script.executor import SSHExecutor
+from handlers.vm_commands import batch_command, parse_batch
+
+
+class FakeChannel:
+    def __init__(self, status):
+        self.status = status
+
+    def recv_exit_status(self):
+        return self.status
+
+
+class FakeStream(io.BytesIO):
+    def __init__(self, data, status=0):
+        super().__init__(data)
+        self.channel = FakeChannel(status)
+
+
+class FakeClient:
+    def exec_command(self, command, timeout=None):
+        time.sleep(0.1)
+        if command == "boom":
+            raise OSError("channel open failed")
+        status = 1 if command.startswith("false") else 0
+        return None, FakeStream(f"out:{command}".encode(), status), FakeStream(b"err")
+
+
+class FakeTransport:
+    def is_active(self):
+        return True
+
+
+@pytest.fixture
+def connection():
+    executor = SSHExecutor(max_workers=8, per_host_limit=4)
+    conn = SSHConnection("vm", executor=executor)
+    conn.client, conn.transport = FakeClient(), FakeTransport()
+    yield conn
+    executor.shutdown(wait=True)
+
+
+async def test_batch_runs_channels_concurrently(connection):
+    started = time.monotonic()
+    results = await connection.execute_batch(["a", "b", "false", "boom"])
+    assert time.monotonic() - started < 0.3
+    assert results[0] == ("out:a", "err", 0)
+    assert results[2][2] == 1
+    assert isinstance(results[3], OSError)
+
+
+def test_parse_batch_and_quoting():
+    assert parse_batch("ls; cat a.txt\ncat ~/b c.txt") == [("ls", "."), ("cat", "a.txt"), ("cat", "~/b c.txt")]
+    assert batch_command("cat", "~/b c.txt").endswith("-- 'b c.txt'")
+    assert batch_command("ls", "$(rm -rf ~)") == "ls -la -- '$(rm -rf ~)'"
+    with pytest.raises(ValueError):
+        parse_batch("rm -rf /")
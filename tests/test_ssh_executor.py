@@ -0,0 +1,98 @@
+import time
+import asyncio
+import threading
+import pytest
+
+from script.executor import SSHExecutor, executor_wait
+
+
+@pytest.fixture
+def executor():
+    ex = SSHExecutor(max_workers=4, per_host_limit=2)
+    yield ex
+    ex.shutdown(wait=True)
+
+
+async def test_runs_in_dedicated_pool(executor):
+    name = await executor.run("h1", lambda: threading.current_thread().name)
+    assert name.startswith("ssh-worker")
+    assert executor.stats.completed == 1
+    assert executor.stats.queue_depth == 0
+    assert executor.stats.active == 0
+
+
+async def test_per_host_limit(executor):
+    running = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def work():
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        time.sleep(0.05)
+        with lock:
+            running -= 1
+
+    await asyncio.gather(*(executor.run("slow-host", work) for _ in range(6)))
+    assert peak == 2
+    snapshot = executor.snapshot()
+    assert snapshot["slow-host"]["completed"] == 6
+    assert snapshot["total"]["max_wait"] > 0
+    # Ожидание каждого вызова попадает в гистограмму по хосту
+    assert executor_wait.count(host="slow-host") == 6
+
+
+async def test_slow_host_does_not_block_other_hosts(executor):
+    release = threading.Event()
+    blocked = [asyncio.ensure_future(executor.run("hung", release.wait, 5)) for _ in range(2)]
+    await asyncio.sleep(0.01)
+    assert await asyncio.wait_for(executor.run("ok", lambda: 42), timeout=1) == 42
+    release.set()
+    await asyncio.gather(*blocked)
+
+
+async def test_failures_are_counted(executor):
+    def boom():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        await executor.run("h1", boom)
+    assert executor.stats.failed == 1
+    assert executor.stats.active == 0
+
+
+async def test_cancelled_call_keeps_host_slot_until_thread_finishes(executor):
+    release = threading.Event()
+    running = [asyncio.ensure_future(executor.run("hung", release.wait, 5)) for _ in range(2)]
+    await asyncio.sleep(0.05)
+    for task in running:
+        task.cancel()
+    await asyncio.gather(*running, return_exceptions=True)
+
+    # Потоки еще заняты: новый вызов к тому же хосту ждет, а не запускается третьим
+    waiting = asyncio.ensure_future(executor.run("hung", lambda: 42))
+    await asyncio.sleep(0.05)
+    assert not waiting.done()
+    assert executor.host_stats["hung"].active == 2
+    release.set()
+    assert await asyncio.wait_for(waiting, timeout=1) == 42
+    snapshot = executor.snapshot()["hung"]
+    assert snapshot["completed"] == 3
+    assert snapshot["active"] == 0 and snapshot["queue_depth"] == 0
+
+
+async def test_call_cancelled_before_start_frees_its_slot(executor):
+    release = threading.Event()
+    running = [asyncio.ensure_future(executor.run("h1", release.wait, 5)) for _ in range(2)]
+    await asyncio.sleep(0.05)
+    queued = asyncio.ensure_future(executor.run("h1", lambda: 1))
+    await asyncio.sleep(0.01)
+    queued.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await queued
+    release.set()
+    await asyncio.gather(*running)
+    assert executor.stats.queue_depth == 0
+    assert await executor.run("h1", lambda: 2) == 2
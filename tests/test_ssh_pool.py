@@ -0,0 +1,135 @@
+import asyncio
+import pytest
+
+from script import pool as pool_module
+from script.pool import SSHConnectionPool
+from script.classes import VMConfig
+
+
+class FakeSSHConnection:
+    instances = []
+
+    def __init__(self, host, port=22, username=None, password=None, keepalive_interval=0):
+        self.host = host
+        self.alive = False
+        self.keepalive_interval = keepalive_interval
+        FakeSSHConnection.instances.append(self)
+
+    async def connect(self):
+        self.alive = True
+        return True
+
+    def is_alive(self):
+        return self.alive
+
+    async def run_blocking(self, func, *args):
+        return func(*args)
+
+    def disconnect(self):
+        self.alive = False
+
+
+@pytest.fixture(autouse=True)
+def fake_connection(monkeypatch):
+    FakeSSHConnection.instances = []
+    monkeypatch.setattr(pool_module, "SSHConnection", FakeSSHConnection)
+
+
+def vm(host="10.0.0.1", password="secret"):
+    return VMConfig(host, 22, "student", password)
+
+
+async def test_reuses_live_connection():
+    pool = SSHConnectionPool(max_size=4)
+    async with pool.connection(1, vm()) as first:
+        pass
+    async with pool.connection(1, vm()) as second:
+        pass
+    assert first is second
+    assert (pool.hits, pool.misses) == (1, 1)
+
+
+async def test_reconnects_when_transport_is_dead():
+    pool = SSHConnectionPool(max_size=4)
+    async with pool.connection(1, vm()) as first:
+        pass
+    first.alive = False
+    async with pool.connection(1, vm()) as second:
+        assert second is not first
+    assert len(FakeSSHConnection.instances) == 2
+
+
+async def test_lru_eviction_when_full():
+    pool = SSHConnectionPool(max_size=2)
+    async with pool.connection(1, vm("h1")) as c1:
+        pass
+    async with pool.connection(2, vm("h2")):
+        pass
+    async with pool.connection(3, vm("h3")):
+        pass
+    assert len(pool) == 2
+    assert not c1.alive
+    assert pool.evictions == 1
+
+
+async def test_waits_for_slot_when_all_busy():
+    pool = SSHConnectionPool(max_size=1)
+    order = []
+
+    async def hold():
+        async with pool.connection(1, vm("h1")):
+            order.append("first-acquired")
+            await asyncio.sleep(0.05)
+        order.append("first-released")
+
+    async def second():
+        await asyncio.sleep(0.01)
+        async with pool.connection(2, vm("h2")):
+            order.append("second-acquired")
+
+    await asyncio.gather(hold(), second())
+    assert order == ["first-acquired", "first-released", "second-acquired"]
+
+
+async def test_idle_ttl_eviction():
+    pool = SSHConnectionPool(max_size=4, idle_ttl=0)
+    async with pool.connection(1, vm()) as conn:
+        pass
+    assert await pool.evict_expired() == 1
+    assert not conn.alive
+    assert len(pool) == 0
+
+
+async def test_invalidate_user_and_changed_credentials():
+    pool = SSHConnectionPool(max_size=4)
+    async with pool.connection(1, vm()) as conn:
+        pass
+    async with pool.connection(1, vm(password="changed")) as fresh:
+        assert fresh is not conn
+    assert not conn.alive
+    await pool.invalidate_user(1)
+    assert len(pool) == 0
+    assert not fresh.alive
+
+
+async def test_key_locks_do_not_accumulate():
+    pool = SSHConnectionPool(max_size=2)
+    for user_id in range(10):
+        async with pool.connection(user_id, vm(f"h{user_id}")):
+            pass
+    # Подключения вытеснены, их блокировки никто не держит
+    assert len(pool) == 2
+    assert len(pool._key_locks) == 0
+
+
+async def test_discard_drops_only_one_connection():
+    pool = SSHConnectionPool(max_size=4)
+    async with pool.connection(1, vm("h1")) as hung:
+        async with pool.connection(1, vm("h2")) as other:
+            pass
+        await pool.discard(hung)
+        # Занятое подключение закрывается после возврата
+        assert hung.alive
+    assert not hung.alive
+    assert other.alive
+    assert len(pool) == 1
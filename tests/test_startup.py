@@ -0,0 +1,53 @@
+import sys
+import subprocess
+
+from benchmarks.startup import ROOT, parse_importtime
+
+
+def _run(code: str) -> str:
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    return result.stdout.strip()
+
+
+def test_core_modules_do_not_import_heavy_dependencies():
+    out = _run(
+        "import sys, script, script.db, script.pool, script.classes, script.metrics, script.logs, script.main\n"
+        "print(sorted(m for m in ('paramiko', 'aiogram', 'aiohttp') if m in sys.modules))"
+    )
+    assert out == "[]"
+
+
+def test_package_exports_load_on_first_access():
+    out = _run(
+        "import sys, script\n"
+        "assert 'script.pool' not in sys.modules and 'ssh_pool' in dir(script)\n"
+        "from script import ssh_pool, SSHConnection\n"
+        "print(type(ssh_pool).__name__, 'paramiko' in sys.modules)"
+    )
+    assert out == "SSHConnectionPool False"
+
+
+def test_vm_config_manager_resolves_session_maker_at_call_time():
+    from script import db
+    from script.classes import VMConfigManager
+
+    manager = VMConfigManager()
+    saved = db.async_session
+    try:
+        db.async_session = marker = object()
+        assert manager.async_session is marker
+    finally:
+        db.async_session = saved
+
+
+def test_parse_importtime():
+    stderr = (
+        "import time: self [us] | cumulative | imported package\n"
+        "import time:       120 |        120 |     _io\n"
+        "import time:      1500 |       1620 |   script.db\n"
+        "import time:        80 |       1700 | script\n"
+    )
+    records = parse_importtime(stderr)
+    assert [(r.module, r.self_us, r.cumulative_us, r.depth) for r in records] == [
+        ("_io", 120, 120, 2), ("script.db", 1500, 1620, 1), ("script", 80, 1700, 0)]
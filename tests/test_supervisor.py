@@ -0,0 +1,158 @@
+import os
+import time
+import queue
+import asyncio
+from collections import defaultdict
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from script import delivery, executor, scheduler
+from script.main import worker_limits
+from script.supervisor import Supervisor, build_supervisor_app, route_key, serve_worker
+
+
+def make_update(update_id: int, user_id: int, text: str = "hi") -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": text,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "u"},
+        },
+    }
+
+
+def recording_worker(index, inbox, outbox, log_path):
+    """Рабочий процесс для тестов: записывает, кто и в каком порядке обработал обновление."""
+
+    async def feed(update):
+        if update["message"]["text"] == "crash":
+            os._exit(3)
+        # Разная задержка, чтобы параллельная обработка могла перепутать порядок
+        await asyncio.sleep(0.001 * (update["update_id"] % 4))
+        with open(log_path, "a") as log:
+            log.write(f"{index} {route_key(update)} {update['update_id']}\n")
+
+    asyncio.run(serve_worker(index, inbox, outbox, feed, stats_interval=0.05))
+
+
+def read_log(path):
+    if not path.exists():
+        return []
+    return [tuple(map(int, line.split())) for line in path.read_text().splitlines()]
+
+
+async def wait_for(predicate, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.05)
+
+
+def test_worker_limits_split_shared_limits(monkeypatch):
+    monkeypatch.setattr(delivery, "GLOBAL_RATE", 30.0)
+    monkeypatch.setattr(scheduler, "DEFAULT_HOST_LIMIT", 4)
+    monkeypatch.setattr(executor, "DEFAULT_PER_HOST_LIMIT", 6)
+    assert worker_limits(4) == {"TG_GLOBAL_RATE": "7.5", "SCHED_HOST_LIMIT": "1", "SSH_PER_HOST_LIMIT": "1"}
+    assert worker_limits(2)["SSH_PER_HOST_LIMIT"] == "3"
+    # Меньше одной команды на хост процесс не получает
+    assert worker_limits(8)["SCHED_HOST_LIMIT"] == "1"
+
+
+def test_route_key():
+    assert route_key(make_update(1, 42)) == 42
+    assert route_key({"update_id": 2, "callback_query": {"id": "q", "from": {"id": 7}}}) == 7
+    assert route_key({"update_id": 3, "channel_post": {"message_id": 1, "chat": {"id": -100}}}) == -100
+    assert route_key({"update_id": 4, "poll": {"id": "p"}}) == 4
+
+
+async def test_updates_are_sharded_by_user_in_order(tmp_path):
+    log_path = tmp_path / "handled.log"
+    supervisor = Supervisor(recording_worker, workers=2, args=(str(log_path),))
+    supervisor.start()
+    try:
+        for update_id in range(1, 61):
+            await supervisor.dispatch(make_update(update_id, user_id=update_id % 6))
+        await wait_for(lambda: len(read_log(log_path)) == 60)
+    finally:
+        await supervisor.stop()
+
+    per_user = defaultdict(list)
+    for worker, user, update_id in read_log(log_path):
+        assert worker == user % 2
+        per_user[user].append(update_id)
+    for updates in per_user.values():
+        assert updates == sorted(updates)
+
+    stats = supervisor.stats()
+    assert [worker["dispatched"] for worker in stats] == [30, 30]
+    assert sum(worker["handled"] for worker in stats) == 60
+    assert all(worker["restarts"] == 0 for worker in stats)
+
+
+async def test_crashed_worker_is_restarted(tmp_path):
+    log_path = tmp_path / "handled.log"
+    supervisor = Supervisor(recording_worker, workers=2, args=(str(log_path),), restart_delay=0.05)
+    supervisor.start()
+    try:
+        await supervisor.dispatch(make_update(1, user_id=3, text="crash"))
+        await wait_for(lambda: supervisor.workers[1].restarts == 1)
+        # Очередь упавшего процесса сохраняется и обрабатывается новым
+        await supervisor.dispatch(make_update(2, user_id=3))
+        await wait_for(lambda: read_log(log_path) == [(1, 3, 2)])
+        assert supervisor.workers[1].alive
+        assert supervisor.workers[0].restarts == 0
+    finally:
+        await supervisor.stop()
+
+
+class StatsSink:
+    def send(self, stats):
+        pass
+
+
+async def test_waiting_update_does_not_hold_a_slot():
+    inbox = queue.Queue()
+    release = asyncio.Event()
+    handled = []
+
+    async def feed(update):
+        if update["update_id"] == 1:
+            await release.wait()
+        handled.append(update["update_id"])
+
+    # Два слота: первый занят обновлением 1, второе обновление того же
+    # пользователя ждет его без слота, и обновление 3 другого пользователя не задерживается
+    for update_id, user_id in ((1, 5), (2, 5), (3, 6)):
+        inbox.put(make_update(update_id, user_id))
+    worker = asyncio.create_task(serve_worker(0, inbox, StatsSink(), feed, max_concurrent=2, stats_interval=0.05))
+    await wait_for(lambda: handled == [3])
+    release.set()
+    await wait_for(lambda: handled == [3, 1, 2])
+    inbox.put(None)
+    await worker
+
+
+class StubSupervisor:
+    def __init__(self):
+        self.updates = []
+
+    async def dispatch(self, update):
+        self.updates.append(update)
+
+    def stats(self):
+        return [{"worker": 0, "alive": True, "pending": len(self.updates)}]
+
+
+async def test_supervisor_webhook_app():
+    supervisor = StubSupervisor()
+    app = build_supervisor_app(supervisor, path="/webhook", secret_token="s3cret")
+    async with TestClient(TestServer(app)) as client:
+        resp = await client.post("/webhook", json=make_update(1, 5))
+        assert resp.status == 401
+        resp = await client.post("/webhook", json=make_update(1, 5),
+                                 headers={"X-Telegram-Bot-Api-Secret-Token": "s3cret"})
+        assert resp.status == 200
+        health = await (await client.get("/healthz")).json()
+    assert supervisor.updates == [make_update(1, 5)]
+    assert health == {"status": "ok", "workers": [{"worker": 0, "alive": True, "pending": 1}]}
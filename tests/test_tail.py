@@ -0,0 +1,143 @@
+import os
+import asyncio
+from contextlib import asynccontextmanager
+
+from benchmarks.ssh_server import BENCH_PASSWORD, BenchSSHServer
+from handlers.vm_commands import tail_command
+from script.classes import SSHConnection
+from script.tail import TailRegistry, TailSession, TailWindow
+
+
+class QueueStream:
+    """Поток для TailSession: данные из asyncio.Queue, None - конец вывода."""
+
+    def __init__(self):
+        self.queue = asyncio.Queue()
+        self.closed = False
+
+    async def read_available(self, timeout=None):
+        data = await asyncio.wait_for(self.queue.get(), timeout)
+        return data or b""
+
+
+class Recorder:
+    def __init__(self, alive=True):
+        self.calls = []
+        self.alive = alive
+
+    async def __call__(self, window, reason):
+        self.calls.append((window, reason))
+        return self.alive
+
+
+def opener(stream):
+    @asynccontextmanager
+    async def open_stream():
+        try:
+            yield stream
+        finally:
+            stream.closed = True
+    return open_stream
+
+
+def test_window_keeps_last_lines():
+    window = TailWindow(max_lines=3)
+    text = "один\nдва\nтри\n<четыре>\nпя".encode()
+    for i in range(0, len(text), 3):  # разрывы внутри многобайтовых символов
+        window.feed(text[i:i + 3])
+    assert window.render() == "два\nтри\n&lt;четыре&gt;\nпя"
+    assert not window.changed
+
+
+def test_window_fits_message():
+    window = TailWindow(max_lines=100, max_chars=50)
+    window.feed(b"".join(b"line %02d\n" % i for i in range(100)))
+    rendered = window.render()
+    assert len(rendered) <= 50
+    assert rendered.endswith("line 99")
+
+
+async def test_edits_are_throttled_and_stop_on_end():
+    stream, publish = QueueStream(), Recorder()
+    session = TailSession(opener(stream), publish, edit_interval=0.2, idle_timeout=10)
+    task = asyncio.create_task(session.run())
+    for i in range(20):
+        stream.queue.put_nowait(b"line %d\n" % i)
+        await asyncio.sleep(0.02)
+    stream.queue.put_nowait(None)
+    assert await task == "ended"
+
+    interim = [window for window, reason in publish.calls if reason is None]
+    assert 1 <= len(interim) <= 4  # 20 порций за ~0.4 с
+    assert publish.calls[-1][1] == "ended"
+    assert publish.calls[-1][0].endswith("line 19")
+    assert stream.closed
+
+
+async def test_idle_timeout():
+    stream, publish = QueueStream(), Recorder()
+    session = TailSession(opener(stream), publish, edit_interval=0.05, idle_timeout=0.2)
+    stream.queue.put_nowait(b"started\n")
+    assert await asyncio.wait_for(session.run(), 5) == "idle"
+    assert publish.calls[-1] == ("started", "idle")
+
+
+async def test_deleted_message_stops_session():
+    stream, publish = QueueStream(), Recorder(alive=False)
+    session = TailSession(opener(stream), publish, edit_interval=0.05, idle_timeout=5)
+    stream.queue.put_nowait(b"x\n")
+    assert await asyncio.wait_for(session.run(), 5) == "gone"
+    assert len(publish.calls) == 1
+
+
+async def test_registry_stop_and_replace():
+    tails = TailRegistry()
+    first_publish, second_publish = Recorder(), Recorder()
+    first = TailSession(opener(QueueStream()), first_publish)
+    second = TailSession(opener(QueueStream()), second_publish)
+    first_task = tails.start(1, first)
+    await asyncio.sleep(0)
+    second_task = tails.start(1, second)
+    assert await first_task == "replaced"
+    assert len(tails) == 1
+
+    assert tails.stop(1)
+    assert await second_task == "stop"
+    assert second_publish.calls[-1][1] == "stop"
+    assert len(tails) == 0
+    assert not tails.stop(1)
+
+
+async def test_follow_remote_file():
+    with BenchSSHServer() as server:
+        log_path = os.path.join(server.root, "app.log")
+        with open(log_path, "w") as f:
+            f.write("".join(f"old {i}\n" for i in range(10)))
+        connection = SSHConnection("127.0.0.1", server.port, "student", BENCH_PASSWORD)
+        assert await connection.connect()
+
+        @asynccontextmanager
+        async def open_stream():
+            async with connection.stream_command(tail_command("~/app.log", 3), combine_stderr=True) as proc:
+                yield proc
+
+        publish = Recorder()
+        tails = TailRegistry()
+        task = tails.start(1, TailSession(open_stream, publish, lines=3, edit_interval=0.05))
+        for _ in range(100):
+            if publish.calls:
+                break
+            await asyncio.sleep(0.02)
+        assert publish.calls[0][0] == "old 7\nold 8\nold 9"
+
+        with open(log_path, "a") as f:
+            f.write("new line\n")
+        for _ in range(100):
+            if publish.calls[-1][0].endswith("new line"):
+                break
+            await asyncio.sleep(0.02)
+        assert publish.calls[-1][0] == "old 8\nold 9\nnew line"
+
+        tails.stop(1)
+        assert await task == "stop"
+        connection.disconnect()
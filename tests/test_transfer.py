@@ -0,0 +1,209 @@
+import os
+import asyncio
+
+import pytest
+
+from benchmarks.ssh_server import BENCH_PASSWORD, BenchSSHServer
+from handlers.vm_commands import put_target
+from script.classes import FileOperations, SSHConnection
+from script.streaming import read_ahead
+from script.transfer import TransferMeter, transfer_bytes
+
+
+async def numbers(count, produced):
+    for i in range(count):
+        produced.append(i)
+        yield bytes([i])
+
+
+async def test_read_ahead_is_bounded():
+    produced, consumed = [], []
+    async for chunk in read_ahead(numbers(50, produced), depth=3):
+        await asyncio.sleep(0.002)
+        consumed.append(chunk[0])
+        # В очереди не больше depth блоков и еще один ждет места в ней
+        assert len(produced) - len(consumed) <= 4
+    assert consumed == list(range(50))
+
+
+async def test_read_ahead_propagates_errors_and_closes_source():
+    closed = []
+
+    async def failing():
+        try:
+            yield b"a"
+            raise OSError("connection lost")
+        finally:
+            closed.append(True)
+
+    received = []
+    with pytest.raises(OSError, match="connection lost"):
+        async for chunk in read_ahead(failing(), depth=2):
+            received.append(chunk)
+    assert received == [b"a"]
+    assert closed == [True]
+
+
+async def test_transfer_meter():
+    before = transfer_bytes.get(direction="get")
+    meter = TransferMeter("get")
+    assert [chunk async for chunk in meter.count(numbers(5, []))] == [bytes([i]) for i in range(5)]
+    assert meter.bytes == 5
+    assert transfer_bytes.get(direction="get") - before == 5
+    assert "5 Б" in meter.summary()
+
+
+async def test_put_target():
+    with BenchSSHServer(files=0) as server:
+        os.makedirs(os.path.join(server.root, "lab1"))
+        connection = SSHConnection("127.0.0.1", server.port, "student", BENCH_PASSWORD)
+        assert await connection.connect()
+        file_ops = FileOperations(connection)
+
+        assert await put_target(file_ops, None, "report.pdf") == "report.pdf"
+        assert await put_target(file_ops, "~/lab1/", "report.pdf") == "~/lab1/report.pdf"
+        # Существующая директория без "/" на конце
+        assert await put_target(file_ops, "~/lab1", "report.pdf") == "~/lab1/report.pdf"
+        assert await put_target(file_ops, "~/lab1/main.py", "upload.py") == "~/lab1/main.py"
+        assert await put_target(file_ops, "big.log", "upload.log") == "big.log"
+        connection.disconnect()
+
+
+async def test_prefetched_read_and_write_round_trip():
+    payload = os.urandom(300 * 1024 + 123)
+    with BenchSSHServer(files=0) as server:
+        with open(os.path.join(server.root, "blob.bin"), "wb") as f:
+            f.write(payload)
+        connection = SSHConnection("127.0.0.1", server.port, "student", BENCH_PASSWORD)
+        assert await connection.connect()
+        file_ops = FileOperations(connection)
+
+        windows = [w async for w in file_ops.read_file_prefetched("~/blob.bin", chunk_size=8192, window=4)]
+        assert b"".join(windows) == payload
+        assert max(len(w) for w in windows) == 8192 * 4
+        part = b"".join([w async for w in file_ops.read_file_prefetched("blob.bin", offset=1000, length=50000)])
+        assert part == payload[1000:51000]
+
+        written = await file_ops.write_file("~/copy.bin", file_ops.read_file_prefetched("blob.bin"))
+        assert written == len(payload)
+        with open(os.path.join(server.root, "copy.bin"), "rb") as f:
+            assert f.read() == payload
+        assert not os.path.exists(os.path.join(server.root, "copy.bin.part"))
+        connection.disconnect()
+
+
+async def test_failed_rename_removes_partial_file():
+    with BenchSSHServer(files=0) as server:
+        os.makedirs(os.path.join(server.root, "lab1"))
+        connection = SSHConnection("127.0.0.1", server.port, "student", BENCH_PASSWORD)
+        assert await connection.connect()
+
+        # Поверх директории файл не переименовать
+        with pytest.raises(IOError):
+            await FileOperations(connection).write_file("lab1", numbers(3, []))
+        assert sorted(os.listdir(server.root)) == ["big.log", "data", "lab1"]
+        connection.disconnect()
+
+
+class UnsupportedRenameSFTP:
+    """SFTP-сервер без posix-rename: rename поверх существующего файла не работает."""
+
+    def __init__(self, files, fail_rename_from=None):
+        self.files = set(files)
+        self.fail_rename_from = fail_rename_from
+        self.calls = []
+
+    def posix_rename(self, source, target):
+        raise IOError("Operation unsupported")
+
+    def remove(self, path):
+        self.calls.append(("remove", path))
+        if path not in self.files:
+            raise FileNotFoundError(path)
+        self.files.remove(path)
+
+    def rename(self, source, target):
+        self.calls.append(("rename", source, target))
+        if source not in self.files:
+            raise FileNotFoundError(source)
+        if target in self.files or source == self.fail_rename_from:
+            raise IOError("Failure")
+        self.files.remove(source)
+        self.files.add(target)
+
+
+class SFTPConnection:
+    def __init__(self, sftp):
+        self.sftp = sftp
+
+    async def get_sftp(self):
+        return self.sftp
+
+    async def run_blocking(self, func, *args):
+        return func(*args)
+
+
+async def test_rename_without_posix_rename_extension():
+    sftp = UnsupportedRenameSFTP({"a.txt", "a.txt.part"})
+    await FileOperations(SFTPConnection(sftp))._replace("a.txt.part", "a.txt")
+    assert sftp.files == {"a.txt"}
+    assert sftp.calls[1:] == [
+        ("rename", "a.txt", "a.txt.part.old"),
+        ("rename", "a.txt.part", "a.txt"),
+        ("remove", "a.txt.part.old"),
+    ]
+
+    # Нового файла еще нет - переименовывать в сторону нечего
+    sftp = UnsupportedRenameSFTP({"b.txt.part"})
+    await FileOperations(SFTPConnection(sftp))._replace("b.txt.part", "b.txt")
+    assert sftp.files == {"b.txt"}
+
+
+async def test_failed_fallback_rename_restores_target():
+    sftp = UnsupportedRenameSFTP({"a.txt", "a.txt.part"}, fail_rename_from="a.txt.part")
+    with pytest.raises(IOError):
+        await FileOperations(SFTPConnection(sftp))._replace("a.txt.part", "a.txt")
+    assert sftp.files == {"a.txt", "a.txt.part"}
+
+
+async def test_failed_close_is_not_repeated():
+    class FailingFile:
+        closes = 0
+
+        def set_pipelined(self, pipelined):
+            pass
+
+        def write(self, data):
+            pass
+
+        def close(self):
+            # Подтверждения pipelined-записи приходят при закрытии
+            FailingFile.closes += 1
+            raise IOError("No space left on device")
+
+    sftp = UnsupportedRenameSFTP({"a.txt.part"})
+    sftp.open = lambda path, mode: FailingFile()
+    with pytest.raises(IOError, match="No space"):
+        await FileOperations(SFTPConnection(sftp)).write_file("a.txt", numbers(3, []))
+    assert FailingFile.closes == 1
+    assert sftp.files == set()
+
+
+async def test_failed_write_keeps_old_file():
+    async def broken():
+        yield b"new content"
+        raise ConnectionError("download interrupted")
+
+    with BenchSSHServer(files=0) as server:
+        target = os.path.join(server.root, "notes.txt")
+        with open(target, "w") as f:
+            f.write("old content")
+        connection = SSHConnection("127.0.0.1", server.port, "student", BENCH_PASSWORD)
+        assert await connection.connect()
+
+        with pytest.raises(ConnectionError):
+            await FileOperations(connection).write_file("notes.txt", broken())
+        with open(target) as f:
+            assert f.read() == "old content"
+        assert not os.path.exists(target + ".part")
+        connection.disconnect()
@@ -0,0 +1,39 @@
+import os
+
+import pytest
+
+from benchmarks.ssh_server import BENCH_PASSWORD, BenchSSHServer
+from script.classes import SSHConnection
+from script.tree import build_index, refresh_index, tree_scans
+
+
+async def test_index_and_incremental_refresh():
+    with BenchSSHServer(files=3) as server:
+        os.makedirs(os.path.join(server.root, "lab1", "src"))
+        with open(os.path.join(server.root, "lab1", "src", "main.py"), "w") as f:
+            f.write("print('hi')\n")
+        connection = SSHConnection("127.0.0.1", server.port, "student", BENCH_PASSWORD)
+        assert await connection.connect()
+
+        index = await build_index(connection, ".", max_depth=3)
+        assert index.find("data/file0001.log").size == server.file_size
+        assert index.summary("lab1") == (1, 1, 12)
+
+        # Без изменений обновление - одна команда, только список директорий
+        changed_before = tree_scans.get(kind="dirs_changed")
+        await refresh_index(connection, index)
+        assert tree_scans.get(kind="dirs_changed") == changed_before
+
+        os.makedirs(os.path.join(server.root, "lab1", "docs"))
+        with open(os.path.join(server.root, "lab1", "docs", "report.md"), "w") as f:
+            f.write("# report\n")
+        # mtime директории меняется не чаще, чем позволяет точность часов ФС
+        os.utime(os.path.join(server.root, "lab1"), (1, 1))
+        await refresh_index(connection, index)
+        assert tree_scans.get(kind="dirs_changed") == changed_before + 1
+        assert index.find("lab1/docs/report.md").size == 9
+        assert index.summary("lab1") == (2, 2, 21)
+
+        with pytest.raises(FileNotFoundError):
+            await build_index(connection, "missing")
+        connection.disconnect()
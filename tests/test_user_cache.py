@@ -0,0 +1,64 @@
+import pytest
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from script.db import Base, User
+from script.users import UserCache
+
+
+@pytest.fixture
+async def session_maker(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/test.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    queries = []
+    event.listen(engine.sync_engine, "before_cursor_execute", lambda *args: queries.append(args[2]))
+    maker = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    maker.queries = queries
+    yield maker
+    await engine.dispose()
+
+
+async def test_profile_lookups_are_cached(session_maker):
+    cache = UserCache(session_maker)
+    assert await cache.get(1) is None
+    assert await cache.get(1) is None
+    assert len(session_maker.queries) == 1
+
+
+async def test_register_replaces_negative_entry(session_maker):
+    cache = UserCache(session_maker)
+    assert await cache.get(1) is None
+    await cache.register(User(userid=1, username="teacher", role="teacher", tutorcode="abc12345"))
+    session_maker.queries.clear()
+
+    assert (await cache.get(1)).role == "teacher"
+    assert (await cache.get_teacher_by_code("abc12345")).userid == 1
+    assert session_maker.queries == []
+
+
+async def test_teacher_code_lookup_and_invalidation(session_maker):
+    async with session_maker() as session:
+        session.add(User(userid=7, username="t", role="teacher", tutorcode="code7"))
+        await session.commit()
+    cache = UserCache(session_maker)
+    session_maker.queries.clear()
+
+    assert (await cache.get_teacher_by_code("code7")).username == "t"
+    assert await cache.get_teacher_by_code("wrong") is None
+    assert (await cache.get(7)).tutorcode == "code7"
+    assert len(session_maker.queries) == 2
+
+    cache.invalidate(7)
+    await cache.get_teacher_by_code("code7")
+    assert len(session_maker.queries) == 3
+
+
+async def test_duplicate_registration_raises(session_maker):
+    cache = UserCache(session_maker)
+    await cache.register(User(userid=1, username="s", role="student"))
+    with pytest.raises(IntegrityError):
+        await cache.register(User(userid=1, username="s", role="student"))
+    assert (await cache.get(1)).username == "s"
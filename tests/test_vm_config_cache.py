@@ -0,0 +1,72 @@
+import pytest
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from script.db import Base, User
+from script.classes import VMConfig, VMConfigManager
+
+
+@pytest.fixture
+async def session_maker(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/test.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    maker = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    async with maker() as session:
+        session.add(User(userid=1, username="student", role="student"))
+        await session.commit()
+
+    queries = []
+    event.listen(engine.sync_engine, "before_cursor_execute", lambda *args: queries.append(args[2]))
+    maker.queries = queries
+    yield maker
+    await engine.dispose()
+
+
+class FakePool:
+    def __init__(self):
+        self.invalidated = []
+
+    async def invalidate_user(self, user_id):
+        self.invalidated.append(user_id)
+
+
+async def test_missing_config_is_cached(session_maker):
+    manager = VMConfigManager(session_maker)
+    assert await manager.get_vm_config(1) is None
+    assert await manager.get_vm_config(1) is None
+    assert len(session_maker.queries) == 1
+
+
+async def test_projection_query_and_cache_hit(session_maker):
+    manager = VMConfigManager(session_maker)
+    assert await manager.save_vm_config(1, "10.0.0.5", 2222, "student", "pw")
+    manager.cache.clear()
+    session_maker.queries.clear()
+
+    config = await manager.get_vm_config(1)
+    assert config == VMConfig("10.0.0.5", 2222, "student", "pw")
+    assert await manager.get_vm_config(1) is config
+    assert len(session_maker.queries) == 1
+    assert "users.extra" not in session_maker.queries[0]
+
+
+async def test_save_writes_through_and_drops_pooled_connections(session_maker):
+    pool = FakePool()
+    manager = VMConfigManager(session_maker, ssh_pool=pool)
+    await manager.get_vm_config(1)
+    assert await manager.save_vm_config(1, "10.0.0.5", 22, "student", "pw")
+    session_maker.queries.clear()
+
+    assert (await manager.get_vm_config(1)).host == "10.0.0.5"
+    assert session_maker.queries == []
+    assert pool.invalidated == [1]
+
+    assert await manager.save_vm_config(1, "10.0.0.5", 22, "student", "pw")
+    assert pool.invalidated == [1]
+
+
+async def test_unknown_user_is_not_saved(session_maker):
+    manager = VMConfigManager(session_maker)
+    assert not await manager.save_vm_config(42, "h", 22, "u", "p")
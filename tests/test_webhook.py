@@ -0,0 +1,115 @@
+import asyncio
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from aiogram import Bot, Dispatcher, Router
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.filters import Command
+from aiogram.types import Message
+
+from script.webhook import build_webhook_app, HEALTH_PATH
+
+TOKEN = "42:TEST"
+SECRET = "s3cret"
+
+
+class FakeTelegramAPI:
+    """Локальная замена Bot API: записывает вызовы методов и отвечает успехом."""
+
+    def __init__(self):
+        self.calls = []
+        self.app = web.Application()
+        self.app.router.add_post("/bot{token}/{method}", self.handle)
+
+    async def handle(self, request):
+        data = dict(await request.post())
+        self.calls.append((request.match_info["method"], data))
+        return web.json_response({"ok": True, "result": {
+            "message_id": len(self.calls), "date": 0, "chat": {"id": int(data.get("chat_id", 0)), "type": "private"},
+        }})
+
+
+def make_update(update_id, text="/ping", user_id=1):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": text,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Student"},
+        },
+    }
+
+
+@pytest.fixture
+async def telegram_api():
+    api = FakeTelegramAPI()
+    server = TestServer(api.app)
+    await server.start_server()
+    api.url = str(server.make_url(""))
+    yield api
+    await server.close()
+
+
+def make_bot_and_dispatcher(api, on_ping=None):
+    session = AiohttpSession(api=TelegramAPIServer.from_base(api.url))
+    bot = Bot(TOKEN, session=session)
+    router = Router()
+
+    @router.message(Command("ping"))
+    async def ping(message: Message):
+        if on_ping:
+            await on_ping()
+        await message.answer("pong")
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    return bot, dp
+
+
+async def test_update_is_handled_and_reply_sent(telegram_api):
+    bot, dp = make_bot_and_dispatcher(telegram_api)
+    app = build_webhook_app(dp, bot, secret_token=SECRET)
+    async with TestClient(TestServer(app)) as client:
+        resp = await client.post("/webhook", json=make_update(1),
+                                 headers={"X-Telegram-Bot-Api-Secret-Token": SECRET})
+        assert resp.status == 200
+        await app["webhook_handler"].close()
+    assert telegram_api.calls[0][0] == "sendMessage"
+    assert telegram_api.calls[0][1]["text"] == "pong"
+
+
+async def test_wrong_secret_is_rejected(telegram_api):
+    bot, dp = make_bot_and_dispatcher(telegram_api)
+    app = build_webhook_app(dp, bot, secret_token=SECRET)
+    async with TestClient(TestServer(app)) as client:
+        resp = await client.post("/webhook", json=make_update(1),
+                                 headers={"X-Telegram-Bot-Api-Secret-Token": "nope"})
+        assert resp.status == 401
+    assert telegram_api.calls == []
+
+
+async def test_concurrency_is_bounded_and_health_reports_it(telegram_api):
+    running = 0
+    peak = 0
+
+    async def on_ping():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.05)
+        running -= 1
+
+    bot, dp = make_bot_and_dispatcher(telegram_api, on_ping)
+    app = build_webhook_app(dp, bot, secret_token=SECRET, max_concurrent=2)
+    headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+    async with TestClient(TestServer(app)) as client:
+        await asyncio.gather(*(client.post("/webhook", json=make_update(i), headers=headers) for i in range(6)))
+        health = await (await client.get(HEALTH_PATH)).json()
+        assert health["status"] == "ok"
+        assert health["in_flight"] <= 2
+        await app["webhook_handler"].close()
+        health = await (await client.get(HEALTH_PATH)).json()
+    assert peak == 2
+    assert health["handled"] == 6
+    assert len(telegram_api.calls) == 6